@@ -1,6 +1,8 @@
+import time
 import os
+import sys
 import subprocess
-import time
+import shutil
 import datetime
 import json
 import platform
@@ -8,72 +10,274 @@ import threading
 import socket
 import base64
 import re
-import keyboard
 import uuid
+import hashlib
+import math
+import zlib
+import signal
+import codecs
+import queue
+import shlex
+import heapq
+import random
+import atexit
+import itertools
+import contextlib
+import gzip
+import importlib
+import importlib.util
+import mmap
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from pathlib import Path
 from typing import Dict, List, Optional, Any
 from io import BytesIO
 
-import google.generativeai as genai
 from colorama import init, Fore, Style
 
-# Optional imports with fallback
-try:
-    import requests
-    REQUESTS_AVAILABLE = True
-except ImportError:
-    REQUESTS_AVAILABLE = False
-
-try:
-    from bs4 import BeautifulSoup
-    BS4_AVAILABLE = True
-except ImportError:
-    BS4_AVAILABLE = False
-
-try:
-    from PIL import Image, ImageDraw, ImageFont
-    PIL_AVAILABLE = True
-except ImportError:
-    PIL_AVAILABLE = False
-
-try:
-    import pyautogui
-    PYAUTOGUI_AVAILABLE = True
-    pyautogui.PAUSE = 0.1
-    pyautogui.FAILSAFE = True
-except ImportError:
-    PYAUTOGUI_AVAILABLE = False
-
-try:
-    from ddgs import DDGS
-    DDGS_AVAILABLE = True
-except ImportError:
+
+class StartupProfiler:
+    """Per-phase startup timings (printed by --profile-startup)"""
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = []  # [name, depth, seconds] in start order
+        self._depth = 0
+    
+    def record(self, name, seconds, depth=0):
+        self.phases.append([name, depth, seconds])
+    
+    @contextlib.contextmanager
+    def phase(self, name):
+        entry = [name, self._depth, 0.0]
+        self.phases.append(entry)
+        self._depth += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry[2] = time.perf_counter() - started
+            self._depth -= 1
+    
+    def report(self):
+        print(f"\n{Fore.CYAN}Startup profile:{Style.RESET_ALL}")
+        for name, depth, seconds in self.phases:
+            label = "  " * depth + name
+            print(f"  {label:<48} {seconds * 1000:9.1f} ms")
+        print(f"  {'total':<48} {(time.perf_counter() - self.started) * 1000:9.1f} ms")
+
+
+STARTUP_PROFILER = StartupProfiler()
+
+
+class LazyModule:
+    """Module proxy: imports (and optionally configures) the module on first attribute access.
+    
+    If the import fails (installed but broken), the module-level flag named by `flag` is set to False
+    and ImportError is raised.
+    """
+    
+    def __init__(self, name, on_load=None, flag=None):
+        self._name = name
+        self._on_load = on_load
+        self._flag = flag
+        self._module = None
+        self._lock = threading.RLock()
+    
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    try:
+                        with STARTUP_PROFILER.phase(f"import {self._name}"):
+                            module = importlib.import_module(self._name)
+                            if self._on_load:
+                                self._on_load(module)
+                    except Exception as e:
+                        if self._flag:
+                            globals()[self._flag] = False
+                        raise ImportError(f"{self._name} failed to load: {e}") from e
+                    self._module = module
+        return self._module
+    
+    def is_loadable(self) -> bool:
+        """Import now and report whether it worked"""
+        try:
+            self._load()
+            return True
+        except ImportError:
+            return False
+    
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        return getattr(self._load(), attr)
+
+
+def module_available(name) -> bool:
+    """Whether a module can be imported, without importing it"""
     try:
-        from duckduckgo_search import DDGS
-        DDGS_AVAILABLE = True
-    except ImportError:
-        DDGS_AVAILABLE = False
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def _configure_genai(module):
+    """Configure the Gemini SDK when it is first used"""
+    if GEMINI_BASE_URL:
+        module.configure(
+            api_key=GEMINI_API_KEY,
+            transport="rest",
+            client_options={"api_endpoint": GEMINI_BASE_URL}
+        )
+    else:
+        module.configure(api_key=GEMINI_API_KEY)
+
+
+def _configure_pyautogui(module):
+    module.PAUSE = 0.1
+    module.FAILSAFE = True
+
+
+# Heavy and optional dependencies are imported at first use of their feature
+genai = LazyModule("google.generativeai", on_load=_configure_genai)
+
+REQUESTS_AVAILABLE = module_available("requests")
+requests = LazyModule("requests", flag="REQUESTS_AVAILABLE")
+
+BS4_AVAILABLE = module_available("bs4")
+bs4 = LazyModule("bs4", flag="BS4_AVAILABLE")
+
+PIL_AVAILABLE = module_available("PIL")
+Image = LazyModule("PIL.Image", flag="PIL_AVAILABLE")
+ImageDraw = LazyModule("PIL.ImageDraw", flag="PIL_AVAILABLE")
+ImageFont = LazyModule("PIL.ImageFont", flag="PIL_AVAILABLE")
+
+PYAUTOGUI_AVAILABLE = module_available("pyautogui")
+pyautogui = LazyModule("pyautogui", on_load=_configure_pyautogui, flag="PYAUTOGUI_AVAILABLE")
+
+DDGS_MODULE = "ddgs" if module_available("ddgs") else "duckduckgo_search" if module_available("duckduckgo_search") else None
+DDGS_AVAILABLE = DDGS_MODULE is not None
+ddgs_lib = LazyModule(DDGS_MODULE or "ddgs", flag="DDGS_AVAILABLE")
+
+NUMPY_AVAILABLE = module_available("numpy")
+np = LazyModule("numpy", flag="NUMPY_AVAILABLE")
 
 init(autoreset=True)
 
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', "Or Enter Your API Key Here")
 GEMINI_BASE_URL = os.getenv('GEMINI_BASE_URL', '')  # Custom API endpoint (e.g., http://127.0.0.1:8045)
 
-if GEMINI_BASE_URL:
-    genai.configure(
-        api_key=GEMINI_API_KEY,
-        transport="rest",
-        client_options={"api_endpoint": GEMINI_BASE_URL}
-    )
-else:
-    genai.configure(api_key=GEMINI_API_KEY)
-
 # Memory file path
 MEMORY_FILE = ".zaishell_memory.json"
+MEMORY_JOURNAL_FILE = ".zaishell_memory.journal"
+MEMORY_FLUSH_DELAY = 2.0  # max seconds a mutation waits before it is appended
+MEMORY_COMPACT_RECORDS = 200  # fold the journal into the snapshot after this many records
+
+# SQLite memory backend (used when the database exists or ZAISHELL_MEMORY_BACKEND=sqlite)
+MEMORY_DB_FILE = ".zaishell_memory.db"
+MEMORY_DB_MESSAGE_MAX = 4000
+MEMORY_RETENTION_DAYS = 365
+MEMORY_RETENTION_MAX_ROWS = 100000
+MEMORY_DB_HOT_ENTRIES = 5000  # SQLite keeps more raw turns hot (indexed, full-text searchable)
+
+# Tiered memory: hot raw turns -> warm session summaries -> cold gzip archive
+MEMORY_ARCHIVE_FILE = ".zaishell_memory_archive.jsonl.gz"
+MEMORY_HOT_MAX_ENTRIES = 40  # JSON store; compaction halves the hot tier once it is exceeded
+MEMORY_HOT_MIN_ENTRIES = 6  # never archive the last few turns, however old
+MEMORY_HOT_MAX_AGE_DAYS = 30
+MEMORY_WARM_MAX_SUMMARIES = 30
+MEMORY_SUMMARY_CHARS = 600
+MEMORY_SUMMARY_ITEM_CHARS = 80
+MEMORY_COMPACT_BATCH = 100  # turns folded into one summary
+MEMORY_COMPACT_INTERVAL = 300  # seconds between age checks
+MEMORY_SEMANTIC_MAX_ENTRIES = 50000  # ChromaDB / vector entries kept searchable
 
 # ChromaDB settings
 CHROMA_DB_PATH = ".zaishell_chromadb"
 CHROMA_COLLECTION_NAME = "zaishell_memory"
+CHROMA_TAIL_SIZE = 100  # newest entries kept locally for recent-history lookups
+CHROMA_INGEST_BATCH = 32  # documents per collection.add
+CHROMA_INGEST_DELAY = 1.0  # seconds to wait for a batch to fill
+CHROMA_INGEST_MAX_PENDING = 1000  # queued documents before new ones are dropped
+
+# Embedding cache (content hash -> float32 vector, memory-mapped) and local embedders
+EMBEDDING_CACHE_PATH = ".zaishell_embeddings"
+EMBEDDING_CACHE_MAX_ROWS = 50000
+EMBEDDING_DEFAULT = "minilm"  # "minilm" (chromadb's ONNX model) or "hashing" (no dependencies)
+EMBEDDING_HASH_DIM = 256
+EMBEDDING_LOCAL_WINDOW = 500  # history entries scanned by semantic search without ChromaDB
+EMBEDDING_MIN_SIMILARITY = 0.2
+
+# Built-in vector memory (numpy; used when chromadb is absent or ZAISHELL_VECTOR_BACKEND=numpy)
+VECTOR_STORE_PATH = ".zaishell_vectors"
+VECTOR_INITIAL_CAPACITY = 1024  # rows preallocated in the memmap, doubled as needed
+VECTOR_IVF_THRESHOLD = 10000  # build an inverted-file index past this many entries
+VECTOR_IVF_PROBES = 8
+VECTOR_IVF_ITERATIONS = 5
+VECTOR_IVF_REBUILD_GROWTH = 1.5  # rebuild once the store grew by this factor
+
+# Response cache settings
+RESPONSE_CACHE_FILE = ".zaishell_response_cache.json"
+RESPONSE_CACHE_MAX_ENTRIES = 256
+RESPONSE_CACHE_MAX_BYTES = 1024 * 1024
+RESPONSE_CACHE_TTL = 6 * 3600  # seconds
+RESPONSE_CACHE_MAX_TEMPERATURE = 0.3  # eco and lightning are cacheable, normal is not
+
+# Static prompt prefix (bump the version whenever the prefix template changes)
+PROMPT_PREFIX_VERSION = 1
+
+# Model call ledger (tokens and latency per call site and mode)
+LEDGER_FILE = ".zaishell_ledger.jsonl"
+LEDGER_MAX_BYTES = 1024 * 1024  # rotate to .1, .2, ... past this size
+LEDGER_BACKUPS = 3
+
+# Client-side rate limiting of model calls (defaults match the Gemini free tier)
+RATE_LIMIT_RPM = 15
+RATE_LIMIT_TPM = 250000
+RATE_LIMIT_MAX_WAIT = 90.0  # seconds a required call may queue before failing
+RATE_LIMIT_OPTIONAL_WAIT = 2.0  # optional calls are skipped rather than queued longer
+RATE_LIMIT_MAX_RETRIES = 3  # quota (429) retries per call
+RATE_LIMIT_BACKOFF_BASE = 2.0
+RATE_LIMIT_JITTER = 0.5
+RATE_PRIORITY_PLAN = 0
+RATE_PRIORITY_NORMAL = 1
+RATE_PRIORITY_OPTIONAL = 2
+
+# Retry engine budgets (per request)
+RETRY_DEADLINE_SECONDS = 120
+RETRY_TOKEN_BUDGET = 24000
+
+# Strategy racing on retry
+RACE_CANDIDATES = 3
+RACE_CONCURRENCY = 3
+
+# Concurrent execution of independent actions
+ACTION_CONCURRENCY = 4
+
+# Command execution and output capture
+COMMAND_TIMEOUT = 600
+OUTPUT_IDLE_TIMEOUT = 300
+OUTPUT_MAX_BYTES = 64 * 1024 * 1024
+OUTPUT_STDOUT_HEAD = 1500
+OUTPUT_STDOUT_TAIL = 500
+OUTPUT_STDERR_HEAD = 600
+OUTPUT_STDERR_TAIL = 400
+
+# Persistent shell sessions
+POOLED_POSIX_SHELLS = ['bash', 'sh', 'zsh', 'ksh', 'dash']
+
+# Error-signature fix store
+FIX_STORE_FILE = ".zaishell_fixes.json"
+FIX_STORE_MAX_ENTRIES = 200
+FIX_MIN_SUCCESS_RATE = 0.34  # stop auto-applying fixes that keep failing (after 3 uses)
+
+# Local intent classifier settings (stored next to MEMORY_FILE)
+INTENT_MODEL_FILE = ".zaishell_intent_model.json"
+INTENT_CONFIDENCE_THRESHOLD = 0.85
+INTENT_MIN_EXAMPLES = 20  # model predictions are trusted only after this many labeled examples
+INTENT_MAX_EXAMPLES = 500
 
 # Offline model settings
 OFFLINE_MODEL_PATH = ".zaishell_offline_model"
@@ -129,13 +333,20 @@ TERMINAL_CAPABILITIES = {
 
 SUPPORTED_IMAGE_FORMATS = ['png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp']
 
-# Shell paths (used in _detect_shells and run_command)
+# Shell paths (used by ShellRegistry and run_command)
 GIT_BASH_PATHS = [
     r'C:\Program Files\Git\bin\bash.exe',
     r'C:\Program Files (x86)\Git\bin\bash.exe',
     os.path.expanduser(r'~\AppData\Local\Programs\Git\bin\bash.exe')
 ]
 CYGWIN_PATHS = [r'C:\cygwin64\bin\bash.exe', r'C:\cygwin\bin\bash.exe']
+SHELL_SEARCH_DIRS = ['/bin', '/usr/bin', '/usr/local/bin', '/opt/homebrew/bin'] if os.name != 'nt' else []
+SHELL_CACHE_FILE = ".zaishell_shells.json"
+SHELL_PROBE_TIMEOUT = 3
+
+# Background system sampler (feeds gather_info and the prompt's load line)
+SYSTEM_SAMPLE_INTERVAL = 5.0  # seconds
+SYSTEM_SAMPLE_HISTORY = 60  # ring buffer size (5 minutes at the default interval)
 
 
 class TaskContext:
@@ -216,165 +427,1341 @@ Variables: {json.dumps(self.variables) if self.variables else 'None'}
         self.variables[key] = value
 
 
-class WebResearchEngine:
-    """DuckDuckGo web research engine using official library"""
+class RetryState:
+    """Per-request state for the iterative retry engine (deadline, token budget, delta context)"""
     
-    def __init__(self):
-        self.max_results = 5
-        self.is_available_flag = DDGS_AVAILABLE or (REQUESTS_AVAILABLE and BS4_AVAILABLE)
-        self.ai_model = None
+    STEP_FIELDS = ('failed_action', 'last_error', 'step_failures', 'pending_alternatives',
+                   'failure_signature', 'failure_action', 'applied_fix')
     
-    def set_ai_model(self, model):
-        """Set AI model for query optimization"""
-        self.ai_model = model
+    def __init__(self, request: str, max_retries: int, deadline_seconds: float = RETRY_DEADLINE_SECONDS,
+                 token_budget: int = RETRY_TOKEN_BUDGET):
+        self.request = request
+        self.max_retries = max_retries
+        self.deadline_seconds = deadline_seconds
+        self.deadline = None  # set by start() once actions begin executing
+        self._queued_base = 0.0
+        self.token_budget = token_budget
+        self.tokens_used = 0
+        self.attempt = 0
+        self.failed_action = None
+        self.last_error = ""
+        self.step_failures = []
+        self.pending_alternatives = []
+        self.failure_signature = None
+        self.failure_action = None
+        self.applied_fix = None
+        self._step_key = None
+        self._parked_steps = {}
     
-    def is_available(self) -> bool:
-        """Check if web research is available"""
-        return self.is_available_flag
+    def start(self):
+        """Start the deadline clock (planning time does not count against it)"""
+        if self.deadline is None:
+            self.deadline = time.time() + self.deadline_seconds
+            self._queued_base = RATE_LIMITER.waited_total
     
-    def optimize_query(self, user_query: str) -> str:
-        """Use AI to extract optimal English search keywords"""
-        if not self.ai_model:
-            return user_query
-        
+    @contextlib.contextmanager
+    def paused(self):
+        """Stop the deadline clock while waiting on the user"""
+        started = time.time()
         try:
-            prompt = f"""Convert this user query to optimal English search keywords.
-User query: "{user_query}"
+            yield
+        finally:
+            if self.deadline is not None:
+                self.deadline += time.time() - started
+    
+    def deadline_passed(self) -> bool:
+        """Time spent queued in the rate limiter does not count either"""
+        if self.deadline is None:
+            return False
+        return time.time() >= self.deadline + (RATE_LIMITER.waited_total - self._queued_base)
+    
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """Rough token estimate (~4 chars per token)"""
+        return len(text or "") // 4 + 1
+    
+    def charge(self, *texts: str):
+        """Add prompt/response text to the token bill"""
+        self.tokens_used += sum(self.estimate_tokens(t) for t in texts)
+    
+    def record_failure(self, action: Dict, result: Dict):
+        """Keep only the failing action and its error as context for the next attempt"""
+        error = str(result.get('error') or result.get('output') or 'Unknown error')
+        if not self.step_failures:
+            self.failure_signature = FixStore.signature(action, result)
+            self.failure_action = action
+        self.failed_action = action
+        self.last_error = error
+        self.step_failures.append((action, error))
+    
+    def step_succeeded(self):
+        """Forget attempts for a step once it has been repaired"""
+        self.failed_action = None
+        self.step_failures = []
+        self.pending_alternatives = []
+        self.failure_signature = None
+        self.failure_action = None
+        self.applied_fix = None
+    
+    def switch_step(self, key):
+        """Park the current step's repair context and resume the one for key (graph plans)"""
+        if key == self._step_key:
+            return
+        self._parked_steps[self._step_key] = {f: getattr(self, f) for f in self.STEP_FIELDS}
+        parked = self._parked_steps.pop(key, None)
+        if parked is None:
+            self.step_succeeded()
+        else:
+            for field, value in parked.items():
+                setattr(self, field, value)
+        self._step_key = key
+    
+    def can_retry(self):
+        """Returns (allowed, reason)"""
+        if self.attempt >= self.max_retries:
+            return False, f"Max retry limit ({self.max_retries}) reached"
+        if self.deadline_passed():
+            return False, "Retry deadline reached"
+        if self.tokens_used >= self.token_budget:
+            return False, f"Token budget ({self.token_budget}) exhausted"
+        return True, ""
 
-Rules:
-- Extract the main topic/subject
-- Convert to English
-- Use 2-5 keywords only
-- For version queries: add "latest version" or "current version"
-- No full sentences, just keywords
 
-Examples:
-- "python son sürümünü araştır" → "python latest version"
-- "nodejs nasıl kurulur" → "nodejs install tutorial"
-- "react ile proje nasıl başlatılır" → "react create project"
+class ResponseCache:
+    """Persistent content-addressed cache for model responses (LRU + TTL)"""
+    
+    def __init__(self, cache_file: str = RESPONSE_CACHE_FILE, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 max_bytes: int = RESPONSE_CACHE_MAX_BYTES, ttl: int = RESPONSE_CACHE_TTL):
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._load()
+    
+    def _load(self):
+        """Load cache file, dropping expired entries"""
+        try:
+            if os.path.exists(self.cache_file):
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                now = time.time()
+                for key, entry in data.get("entries", []):
+                    if now - entry.get("created", 0) < self.ttl:
+                        self.entries[key] = entry
+                        self.total_bytes += entry.get("size", 0)
+                self._evict()
+        except Exception as e:
+            print(f"{Fore.YELLOW}⚠️ Response cache load error: {e}. Starting empty.{Style.RESET_ALL}")
+            self.entries = OrderedDict()
+            self.total_bytes = 0
+    
+    def _save(self):
+        """Write cache to disk (atomic replace)"""
+        try:
+            tmp_file = f"{self.cache_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({"entries": list(self.entries.items())}, f)
+            os.replace(tmp_file, self.cache_file)
+        except Exception as e:
+            print(f"{Fore.YELLOW}⚠️ Response cache save error: {e}{Style.RESET_ALL}")
+    
+    def _evict(self):
+        """Evict least recently used entries until under size caps"""
+        while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            _, entry = self.entries.popitem(last=False)
+            self.total_bytes -= entry.get("size", 0)
+    
+    @staticmethod
+    def model_signature(model) -> Dict:
+        """Model name and generation config used as part of the cache key"""
+        return {
+            "model": getattr(model, 'model_name', str(model)),
+            "config": getattr(model, '_generation_config', {}) or {}
+        }
+    
+    def make_key(self, model, prompt: str) -> str:
+        """Hash model name, generation config and full prompt"""
+        payload = dict(self.model_signature(model), prompt=prompt)
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    
+    def is_cacheable(self, model, prompt, max_temperature: Optional[float] = RESPONSE_CACHE_MAX_TEMPERATURE) -> bool:
+        """Call-site policy: only text prompts, and only at or below max_temperature (None = always)"""
+        if model is None or not isinstance(prompt, str):
+            return False
+        if max_temperature is None:
+            return True
+        temperature = self.model_signature(model)["config"].get("temperature", 1.0)
+        return temperature is not None and temperature <= max_temperature
+    
+    def get(self, model, prompt: str) -> Optional[str]:
+        """Return cached response text or None"""
+        key = self.make_key(model, prompt)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.time() - entry.get("created", 0) >= self.ttl:
+                self.entries.pop(key)
+                self.total_bytes -= entry.get("size", 0)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry["text"]
+    
+    def put(self, model, prompt: str, text: str):
+        """Store response text and persist"""
+        if not text:
+            return
+        key = self.make_key(model, prompt)
+        size = len(text.encode('utf-8'))
+        with self._lock:
+            old = self.entries.pop(key, None)
+            if old:
+                self.total_bytes -= old.get("size", 0)
+            self.entries[key] = {"text": text, "created": time.time(), "size": size}
+            self.total_bytes += size
+            self._evict()
+            self._save()
+    
+    def clear(self):
+        """Drop all cached responses"""
+        with self._lock:
+            self.entries = OrderedDict()
+            self.total_bytes = 0
+            self._save()
+    
+    def get_stats(self) -> Dict:
+        """Hit/miss counters and size"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "size_kb": round(self.total_bytes / 1024, 1),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(100 * self.hits / lookups, 1) if lookups else 0.0
+        }
 
-Return ONLY the optimized search keywords, nothing else."""
 
-            response = self.ai_model.generate_content(prompt)
-            optimized = response.text.strip().strip('"').strip("'")
-            if optimized and len(optimized) < 100:
-                return optimized
-        except:
-            pass
-        
-        return user_query
+class FixStore:
+    """Persistent map from normalized error signatures to the replacement action that fixed them"""
     
-    def search(self, query: str) -> List[Dict]:
-        """Perform DuckDuckGo search"""
-        
-        if DDGS_AVAILABLE:
-            try:
-                with DDGS() as ddgs:
-                    results = []
-                    for r in ddgs.text(query, max_results=self.max_results):
-                        results.append({
-                            "title": r.get("title", ""),
-                            "snippet": r.get("body", ""),
-                            "url": r.get("href", "")
-                        })
-                    return results
-            except Exception as e:
-                print(f"{Fore.YELLOW}DDGS search error: {e}{Style.RESET_ALL}")
-        
-        if REQUESTS_AVAILABLE and BS4_AVAILABLE:
-            try:
-                headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
-                search_url = f"https://html.duckduckgo.com/html/?q={requests.utils.quote(query)}"
-                
-                response = requests.get(search_url, headers=headers, timeout=10)
-                if response.status_code != 200:
-                    return []
-                
-                soup = BeautifulSoup(response.text, 'html.parser')
-                results = []
-                
-                for result in soup.select('.result')[:self.max_results]:
-                    title_elem = result.select_one('.result__title')
-                    snippet_elem = result.select_one('.result__snippet')
-                    link_elem = result.select_one('.result__url')
-                    
-                    if title_elem:
-                        results.append({
-                            "title": title_elem.get_text(strip=True),
-                            "snippet": snippet_elem.get_text(strip=True) if snippet_elem else "",
-                            "url": link_elem.get_text(strip=True) if link_elem else ""
-                        })
-                
-                return results
-                
-            except Exception as e:
-                print(f"{Fore.YELLOW}Web search error: {e}{Style.RESET_ALL}")
-        
-        return []
+    def __init__(self, store_file: str = FIX_STORE_FILE, max_entries: int = FIX_STORE_MAX_ENTRIES):
+        self.store_file = store_file
+        self.max_entries = max_entries
+        self.fixes = {}
+        self.lookups = 0
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._load()
     
-    def format_results_for_ai(self, results: List[Dict], query: str) -> str:
-        """Format search results for AI consumption"""
-        if not results:
-            return f"No results found for: {query}"
-        
-        formatted = f"""IMPORTANT: Use the following web search results to answer the user's question.
-User asked: "{query}"
-
-Search Results:
-"""
-        for i, r in enumerate(results, 1):
-            formatted += f"\n{i}. {r['title']}\n"
-            formatted += f"   Source: {r['url']}\n"
-            formatted += f"   Summary: {r['snippet']}\n"
-        
-        formatted += "\nBased on these search results, provide a helpful and accurate answer."
-        return formatted
+    def _load(self):
+        """Load fix file"""
+        try:
+            if os.path.exists(self.store_file):
+                with open(self.store_file, 'r', encoding='utf-8') as f:
+                    self.fixes = json.load(f).get("fixes", {})
+        except Exception as e:
+            print(f"{Fore.YELLOW}⚠️ Fix store load error: {e}. Starting empty.{Style.RESET_ALL}")
+            self.fixes = {}
     
-    def print_results_to_user(self, results: List[Dict], query: str):
-        """Print formatted results to console for user to see"""
-        print(f"\n{Fore.CYAN}Web Search Results for '{query}':{Style.RESET_ALL}\n")
-        for i, r in enumerate(results, 1):
-            print(f"{Fore.GREEN}{i}. {r['title']}{Style.RESET_ALL}")
-            print(f"   {Fore.BLUE}{r['url']}{Style.RESET_ALL}")
-            print(f"   {r['snippet'][:150]}...\n")
+    def _save(self):
+        """Write fix file (atomic replace)"""
+        try:
+            tmp_file = f"{self.store_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({"fixes": self.fixes}, f, ensure_ascii=False)
+            os.replace(tmp_file, self.store_file)
+        except Exception as e:
+            print(f"{Fore.YELLOW}⚠️ Fix store save error: {e}{Style.RESET_ALL}")
+    
+    @staticmethod
+    def normalize_error(text: str) -> str:
+        """Mask paths, quoted values and numbers so the same failure maps to one signature"""
+        text = str(text or '').lower()
+        text = re.sub(r'[a-z]:\\[^\s"\':]*', '<path>', text)
+        text = re.sub(r'(?<![\w.])/[^\s"\':]+', '<path>', text)
+        text = re.sub(r'"[^"]*"|\'[^\']*\'', '<str>', text)
+        text = re.sub(r'0x[0-9a-f]+|\d+', '<n>', text)
+        return re.sub(r'\s+', ' ', text).strip()[:300]
+    
+    @classmethod
+    def signature(cls, action: Dict, result: Dict) -> str:
+        """Hash of action type, shell, return code and masked error text"""
+        details = action.get('details', {}) if isinstance(action.get('details'), dict) else {}
+        parts = [
+            action.get('type', '?'),
+            str(details.get('shell', '')).lower(),
+            str(result.get('returncode', '')),
+            cls.normalize_error(result.get('error') or result.get('output') or '')
+        ]
+        return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:16]
+    
+    @staticmethod
+    def _transform(failed_action: Dict, fix_action: Dict) -> Optional[Dict]:
+        """Shell/encoding change that turned the failed command into the fix, if that is all it was"""
+        if failed_action.get('type') != 'command' or fix_action.get('type') != 'command':
+            return None
+        old, new = failed_action.get('details', {}), fix_action.get('details', {})
+        if str(old.get('content', '')).strip() != str(new.get('content', '')).strip():
+            return None
+        change = {k: new[k] for k in ('shell', 'encoding') if new.get(k) and new.get(k) != old.get(k)}
+        return change or None
+    
+    def lookup(self, signature: str, action: Dict) -> Optional[List[Dict]]:
+        """Replacement actions for a failure, or None if no trusted fix applies"""
+        with self._lock:
+            self.lookups += 1
+            entry = self.fixes.get(signature)
+            if not entry:
+                return None
+            if entry["uses"] >= 3 and entry["successes"] / entry["uses"] < FIX_MIN_SUCCESS_RATE:
+                return None
+            
+            if entry.get("transform"):
+                fixed = json.loads(json.dumps(action))
+                fixed.setdefault('details', {}).update(entry["transform"])
+                replacement = [fixed]
+            elif entry.get("failed_content") == action.get('details', {}).get('content'):
+                replacement = json.loads(json.dumps(entry["fix"]))
+            else:
+                return None
+            
+            self.hits += 1
+            entry["uses"] += 1
+            entry["last_used"] = time.time()
+            return replacement
+    
+    def record_outcome(self, signature: str, success: bool):
+        """Count whether an applied fix worked"""
+        with self._lock:
+            entry = self.fixes.get(signature)
+            if entry:
+                entry["successes"] += 1 if success else 0
+                self._save()
+    
+    def learn(self, signature: str, failed_action: Dict, fix_actions: List[Dict]):
+        """Remember the action(s) that eventually repaired a failure"""
+        if not signature or not failed_action or not fix_actions:
+            return
+        transform = self._transform(failed_action, fix_actions[0]) if len(fix_actions) == 1 else None
+        with self._lock:
+            entry = self.fixes.get(signature)
+            if entry and entry.get("fix") == fix_actions:
+                return
+            self.fixes[signature] = {
+                "failed_content": failed_action.get('details', {}).get('content'),
+                "fix": fix_actions,
+                "transform": transform,
+                "uses": 0,
+                "successes": 0,
+                "created": time.time(),
+                "last_used": time.time()
+            }
+            if len(self.fixes) > self.max_entries:
+                oldest = sorted(self.fixes, key=lambda k: self.fixes[k].get("last_used", 0))
+                for key in oldest[:len(self.fixes) - self.max_entries]:
+                    self.fixes.pop(key)
+            self._save()
+    
+    def clear(self):
+        """Forget all fixes"""
+        with self._lock:
+            self.fixes = {}
+            self._save()
+    
+    def get_stats(self) -> Dict:
+        """Stored fixes, hit rate and success rate of applied fixes"""
+        uses = sum(e.get("uses", 0) for e in self.fixes.values())
+        successes = sum(e.get("successes", 0) for e in self.fixes.values())
+        return {
+            "fixes": len(self.fixes),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(100 * self.hits / self.lookups, 1) if self.lookups else 0.0,
+            "uses": uses,
+            "success_rate": round(100 * successes / uses, 1) if uses else 0.0
+        }
 
 
-class ImageAnalyzer:
-    """Image file analyzer using Gemini Vision"""
+class PromptPrefixCache:
+    """Static prompt prefixes built once per key (system info, shells, mode, safety and schema)"""
     
     def __init__(self):
-        self.model = None
-        self.is_available_flag = PIL_AVAILABLE
+        self.prefixes = {}  # key -> prefix text
+        self.builds = 0
+        self.reuses = 0
     
-    def _init_model(self):
-        """Lazy initialize the model"""
-        if self.model is None:
-            self.model = genai.GenerativeModel('gemini-3-flash')
+    def get(self, key: str, build) -> str:
+        """Prefix for key, calling build() only the first time"""
+        prefix = self.prefixes.get(key)
+        if prefix is None:
+            prefix = self.prefixes[key] = build()
+            self.builds += 1
+        else:
+            self.reuses += 1
+        return prefix
     
-    def is_supported_format(self, file_path: str) -> bool:
-        """Check if file format is supported"""
-        ext = Path(file_path).suffix.lower().lstrip('.')
-        return ext in SUPPORTED_IMAGE_FORMATS
+    def get_stats(self) -> Dict:
+        return {
+            "prefixes": len(self.prefixes),
+            "builds": self.builds,
+            "reuses": self.reuses
+        }
+
+
+class CallLedger:
+    """Rotating JSONL ledger of model calls: call site, mode, tokens, latency, retry index"""
     
-    def encode_image_to_base64(self, image_path: str) -> Optional[str]:
-        """Encode image file to base64"""
-        if not self.is_available_flag:
-            return None
+    def __init__(self, path: str = LEDGER_FILE, max_bytes: int = LEDGER_MAX_BYTES, backups: int = LEDGER_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._local = threading.local()  # retry index of the request running on each thread
+    
+    @property
+    def retry_index(self) -> int:
+        return getattr(self._local, 'retry_index', 0)
+    
+    @retry_index.setter
+    def retry_index(self, value: int):
+        self._local.retry_index = value
+    
+    @contextlib.contextmanager
+    def call_site(self, site: str):
+        """Label this thread's model calls with an explicit call site (calls made through shared helpers)"""
+        previous = getattr(self._local, 'site', None)
+        self._local.site = site
         try:
-            with open(image_path, 'rb') as f:
-                return base64.b64encode(f.read()).decode('utf-8')
-        except Exception as e:
-            print(f"{Fore.RED}Image encoding error: {e}{Style.RESET_ALL}")
-            return None
+            yield
+        finally:
+            self._local.site = previous
     
-    def analyze_image(self, image_path: str, context: str = None) -> Dict:
-        """Analyze image and return structured analysis"""
-        self._init_model()
-        
-        if not os.path.exists(image_path):
-            return {"success": False, "error": f"File not found: {image_path}"}
+    def current_site(self) -> Optional[str]:
+        return getattr(self._local, 'site', None)
+    
+    def carry(self, fn):
+        """Wrap fn for a worker thread so its calls are recorded with the submitting thread's retry index"""
+        retry_index = self.retry_index
         
-        if not self.is_supported_format(image_path):
+        def _run(*args, **kwargs):
+            self.retry_index = retry_index
+            return fn(*args, **kwargs)
+        return _run
+    
+    @staticmethod
+    def _prompt_text(contents) -> str:
+        if isinstance(contents, str):
+            return contents
+        if isinstance(contents, (list, tuple)):
+            return "".join(part for part in contents if isinstance(part, str))
+        return ""
+    
+    @staticmethod
+    def _usage(response):
+        """(prompt, output, cached) token counts from usage metadata, or None"""
+        usage = getattr(response, 'usage_metadata', None)
+        prompt_tokens = getattr(usage, 'prompt_token_count', None) if usage else None
+        if not prompt_tokens:
+            return None
+        return (prompt_tokens, getattr(usage, 'candidates_token_count', 0) or 0,
+                getattr(usage, 'cached_content_token_count', 0) or 0)
+    
+    def record(self, site: str, mode: str, model: str, contents, started: float, response=None,
+               output_text: str = "", first_chunk_at: float = None, stream: bool = False, error: str = None,
+               queued: float = 0.0):
+        if not self.enabled:
+            return
+        usage = self._usage(response) if response is not None else None
+        if usage is None:
+            usage = (RetryState.estimate_tokens(self._prompt_text(contents)),
+                     RetryState.estimate_tokens(output_text) if output_text else 0, 0)
+        entry = {
+            "ts": datetime.datetime.now().isoformat(timespec='seconds'),
+            "site": site,
+            "mode": mode,
+            "model": model,
+            "prompt_tokens": usage[0],
+            "output_tokens": usage[1],
+            "cached_tokens": usage[2],
+            "estimated": response is None or self._usage(response) is None,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            "retry": self.retry_index,
+            "stream": stream
+        }
+        if queued:
+            entry["queued_ms"] = round(queued * 1000, 1)
+        if first_chunk_at is not None:
+            entry["first_chunk_ms"] = round((first_chunk_at - started) * 1000, 1)
+        if error:
+            entry["error"] = error
+        try:
+            with self._lock:
+                if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                    self._rotate()
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry) + "\n")
+        except Exception:
+            pass
+    
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+    
+    def entries(self) -> List[Dict]:
+        """All ledger entries, oldest first (backups included)"""
+        entries = []
+        for path in [f"{self.path}.{i}" for i in range(self.backups, 0, -1)] + [self.path]:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            entries.append(json.loads(line))
+                        except ValueError:
+                            continue
+            except OSError:
+                continue
+        return entries
+    
+    @staticmethod
+    def _percentile(values: List[float], pct: float) -> float:
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))] if ordered else 0.0
+    
+    def summary(self, field: str) -> Dict[str, Dict]:
+        """Per-group (by 'site' or 'mode') call count, p50/p95 latency and token spend"""
+        groups = {}
+        for entry in self.entries():
+            groups.setdefault(entry.get(field) or "?", []).append(entry)
+        return {
+            name: {
+                "calls": len(items),
+                "errors": sum(1 for e in items if e.get("error")),
+                "p50_ms": self._percentile([e["latency_ms"] for e in items], 50),
+                "p95_ms": self._percentile([e["latency_ms"] for e in items], 95),
+                "prompt_tokens": sum(e["prompt_tokens"] for e in items),
+                "output_tokens": sum(e["output_tokens"] for e in items),
+                "avg_tokens": round(sum(e["prompt_tokens"] + e["output_tokens"] for e in items) / len(items))
+            }
+            for name, items in sorted(groups.items())
+        }
+    
+    def clear(self):
+        with self._lock:
+            for path in [self.path] + [f"{self.path}.{i}" for i in range(1, self.backups + 1)]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+LLM_LEDGER = CallLedger()
+
+
+class RateLimitedError(Exception):
+    """A model call could not be scheduled within the rate limits"""
+    
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Token-bucket RPM/TPM limiter shared by every model call; queued calls are granted by priority"""
+    
+    def __init__(self, rpm: int = RATE_LIMIT_RPM, tpm: int = RATE_LIMIT_TPM):
+        self.enabled = True
+        self.blocked_until = 0.0  # set from quota errors (retry-after)
+        self._cond = threading.Condition()
+        self._waiters = []  # heap of (priority, seq)
+        self._seq = itertools.count()
+        self._local = threading.local()
+        self.stats = {"granted": 0, "queued": 0, "wait_seconds": 0.0, "skipped": 0, "quota_errors": 0}
+        self.waited_total = 0.0  # every second spent in acquire, skipped calls included
+        self.configure(rpm, tpm)
+    
+    def configure(self, rpm: int, tpm: int):
+        with self._cond:
+            self.rpm, self.tpm = max(1, int(rpm)), max(1, int(tpm))
+            self._requests, self._tokens = float(self.rpm), float(self.tpm)
+            self._refilled = time.monotonic()
+            self._cond.notify_all()
+    
+    @contextlib.contextmanager
+    def priority(self, level: int):
+        """Run this thread's model calls at a given priority (RATE_PRIORITY_*)"""
+        previous = self.current_priority()
+        self._local.priority = level
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+    
+    def current_priority(self) -> int:
+        return getattr(self._local, 'priority', RATE_PRIORITY_NORMAL)
+    
+    def _refill(self, now: float):
+        elapsed = now - self._refilled
+        self._refilled = now
+        self._requests = min(float(self.rpm), self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(float(self.tpm), self._tokens + elapsed * self.tpm / 60)
+    
+    def _delay(self, tokens: int, now: float) -> float:
+        """Seconds until a call of `tokens` fits both buckets"""
+        delay = max(0.0, self.blocked_until - now)
+        if self._requests < 1:
+            delay = max(delay, (1 - self._requests) * 60 / self.rpm)
+        if self._tokens < tokens:
+            delay = max(delay, (tokens - self._tokens) * 60 / self.tpm)
+        return delay
+    
+    def acquire(self, tokens: int) -> float:
+        """Wait for a slot and return the seconds spent queued.
+        
+        Optional calls give up after RATE_LIMIT_OPTIONAL_WAIT, others after RATE_LIMIT_MAX_WAIT,
+        by raising RateLimitedError.
+        """
+        if not self.enabled:
+            return 0.0
+        tokens = min(tokens, self.tpm)  # an oversized prompt waits for a full bucket, not forever
+        priority = self.current_priority()
+        max_wait = RATE_LIMIT_OPTIONAL_WAIT if priority >= RATE_PRIORITY_OPTIONAL else RATE_LIMIT_MAX_WAIT
+        ticket = (priority, next(self._seq))
+        started = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    delay = self._delay(tokens, now) if self._waiters[0] == ticket else None
+                    if delay == 0:
+                        break
+                    remaining = max_wait - (now - started)
+                    if remaining <= 0 or (delay is not None and delay > remaining):
+                        self.stats["skipped"] += 1
+                        raise RateLimitedError(f"Rate limit reached ({self.rpm} RPM / {self.tpm} TPM)",
+                                               retry_after=delay or 0.0)
+                    self._cond.wait(min(remaining, delay if delay is not None else 1.0))
+                self._requests -= 1
+                self._tokens -= tokens
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+                self.waited_total += time.monotonic() - started
+        waited = time.monotonic() - started
+        self.stats["granted"] += 1
+        if waited > 0.05:
+            self.stats["queued"] += 1
+            self.stats["wait_seconds"] += waited
+        return waited
+    
+    def settle(self, estimated: int, actual: int):
+        """Charge the token bucket the difference once a call's real usage is known"""
+        if self.enabled and actual:
+            with self._cond:
+                self._tokens -= actual - min(estimated, self.tpm)
+    
+    @staticmethod
+    def quota_delay(error) -> Optional[float]:
+        """Server retry-after for a quota (429) error: seconds, 0.0 if none given, None if not a quota error"""
+        text = str(error)
+        if getattr(error, 'code', None) != 429 and type(error).__name__ not in ('ResourceExhausted', 'TooManyRequests') \
+                and '429' not in text:
+            return None
+        match = re.search(r'retry in ([\d.]+)\s*s', text, re.I) or re.search(r'retry_delay\s*\{\s*seconds:\s*(\d+)', text)
+        return float(match.group(1)) if match else 0.0
+    
+    def backoff(self, attempt: int, retry_after: float) -> float:
+        """Jittered exponential backoff of at least retry_after; holds back every caller meanwhile"""
+        delay = max(retry_after, RATE_LIMIT_BACKOFF_BASE * 2 ** attempt) * random.uniform(1.0, 1.0 + RATE_LIMIT_JITTER)
+        with self._cond:
+            self.stats["quota_errors"] += 1
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+            self._requests = min(self._requests, 0.0)
+        return delay
+    
+    def get_stats(self) -> Dict:
+        with self._cond:
+            self._refill(time.monotonic())
+            return {
+                **self.stats,
+                "enabled": self.enabled,
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "requests_left": max(0, int(self._requests)),
+                "tokens_left": max(0, int(self._tokens)),
+                "blocked_for": max(0.0, self.blocked_until - time.monotonic())
+            }
+
+
+RATE_LIMITER = RateLimiter()
+
+
+class MeteredModel:
+    """Model proxy that rate-limits every generate_content call and records it in the call ledger"""
+    
+    def __init__(self, model, mode=""):
+        self._model = model
+        self._mode = mode  # str or callable returning the active mode
+    
+    def __getattr__(self, attr):
+        if attr.startswith('__') or attr in ('_model', '_mode'):
+            raise AttributeError(attr)
+        return getattr(self._model, attr)
+    
+    def _labels(self):
+        site = LLM_LEDGER.current_site()
+        if site is None:
+            frame = sys._getframe(2)
+            owner = frame.f_locals.get('self')
+            site = f"{type(owner).__name__}.{frame.f_code.co_name}" if owner is not None else frame.f_code.co_name
+        mode = self._mode() if callable(self._mode) else self._mode
+        return site, mode, str(getattr(self._model, 'model_name', '') or '')
+    
+    def generate_content(self, contents, *args, **kwargs):
+        site, mode, model_name = self._labels()
+        stream = kwargs.get('stream', False)
+        tokens = RetryState.estimate_tokens(CallLedger._prompt_text(contents))
+        for attempt in itertools.count():
+            queued = RATE_LIMITER.acquire(tokens)
+            started = time.perf_counter()
+            try:
+                response = self._model.generate_content(contents, *args, **kwargs)
+                break
+            except Exception as e:
+                LLM_LEDGER.record(site, mode, model_name, contents, started, stream=stream,
+                                  error=type(e).__name__, queued=queued)
+                retry_after = RATE_LIMITER.quota_delay(e)
+                if retry_after is None or not RATE_LIMITER.enabled:
+                    raise
+                delay = RATE_LIMITER.backoff(attempt, retry_after)
+                if attempt >= RATE_LIMIT_MAX_RETRIES or RATE_LIMITER.current_priority() >= RATE_PRIORITY_OPTIONAL:
+                    raise RateLimitedError(f"API quota exceeded: {str(e)[:200]}", retry_after=delay) from e
+                print(f"{Fore.YELLOW}⏳ API quota hit, retrying in {delay:.1f}s...{Style.RESET_ALL}")
+        if stream:
+            return self._metered_stream(response, site, mode, model_name, contents, started, tokens, queued)
+        try:
+            text = response.text
+        except Exception:
+            text = ""
+        usage = CallLedger._usage(response)
+        if usage:
+            RATE_LIMITER.settle(tokens, usage[0] + usage[1])
+        LLM_LEDGER.record(site, mode, model_name, contents, started, response=response, output_text=text, queued=queued)
+        return response
+    
+    @staticmethod
+    def _metered_stream(chunks, site, mode, model_name, contents, started, tokens, queued):
+        """Pass chunks through; record once the stream ends (usage metadata rides on the last chunk)"""
+        first_chunk_at, last, parts, error = None, None, [], None
+        try:
+            for chunk in chunks:
+                if first_chunk_at is None:
+                    first_chunk_at = time.perf_counter()
+                last = chunk
+                try:
+                    parts.append(chunk.text)
+                except Exception:
+                    pass
+                yield chunk
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            usage = CallLedger._usage(last) if last is not None else None
+            if usage:
+                RATE_LIMITER.settle(tokens, usage[0] + usage[1])
+            LLM_LEDGER.record(site, mode, model_name, contents, started, response=last, output_text="".join(parts),
+                              first_chunk_at=first_chunk_at, stream=True, error=error, queued=queued)
+
+
+class StreamingPlanParser:
+    """Incrementally scans a streamed JSON plan and detects when the actions array closes"""
+    
+    def __init__(self):
+        self.text = ""
+        self.understanding = None
+        self.intent = None
+        self.actions = None
+        self.done = threading.Event()
+        self._pos = 0
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = -1
+        self._last_key = None
+        self._expect_value = False
+        self._actions_start = -1
+        self._intent_start = -1
+    
+    def _find_json_start(self) -> int:
+        """Find the plan's opening brace, skipping any <thinking> block"""
+        offset = 0
+        if "<thinking>" in self.text:
+            end = self.text.find("</thinking>")
+            if end < 0:
+                return -1
+            offset = end + len("</thinking>")
+        return self.text.find('{', offset)
+    
+    def feed(self, chunk: str) -> bool:
+        """Consume a chunk; returns True once the actions array is available"""
+        self.text += chunk
+        
+        if not self._started:
+            start = self._find_json_start()
+            if start < 0:
+                return False
+            self._started = True
+            self._pos = start
+        
+        text = self.text
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._on_top_level_string(text[self._string_start:i + 1])
+                continue
+            
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c in '{[':
+                if self._depth == 1 and self._expect_value:
+                    if c == '[' and self._last_key == 'actions':
+                        self._actions_start = i
+                    elif c == '{' and self._last_key == 'intent':
+                        self._intent_start = i
+                self._depth += 1
+            elif c in '}]':
+                self._depth -= 1
+                if c == ']' and self._depth == 1 and self._actions_start >= 0 and self.actions is None:
+                    try:
+                        self.actions = json.loads(text[self._actions_start:i + 1])
+                    except json.JSONDecodeError:
+                        self.actions = []
+                elif c == '}' and self._depth == 1 and self._intent_start >= 0 and self.intent is None:
+                    try:
+                        self.intent = json.loads(text[self._intent_start:i + 1])
+                    except json.JSONDecodeError:
+                        self.intent = {}
+            elif self._depth == 1:
+                if c == ':':
+                    self._expect_value = True
+                elif c == ',':
+                    self._expect_value = False
+        
+        self._pos = len(text)
+        return self.actions is not None
+    
+    def _on_top_level_string(self, literal: str):
+        """Track top-level keys and pick up the understanding value early"""
+        try:
+            value = json.loads(literal)
+        except json.JSONDecodeError:
+            return
+        if self._expect_value:
+            if self._last_key == 'understanding':
+                self.understanding = value
+            self._expect_value = False
+        else:
+            self._last_key = value
+    
+    def finish(self):
+        """Mark the stream as complete"""
+        self.done.set()
+    
+    def result(self, timeout: float = None) -> Optional[Dict]:
+        """Wait for the stream to end and return the full parsed plan"""
+        self.done.wait(timeout)
+        json_start = self._find_json_start()
+        json_end = self.text.rfind('}') + 1
+        if json_start >= 0 and json_end > json_start:
+            try:
+                return json.loads(self.text[json_start:json_end])
+            except json.JSONDecodeError:
+                pass
+        return None
+
+
+class IntentClassifier:
+    """Offline research/GUI/terminal intent classifier (rules + hashed n-gram logistic model)"""
+    
+    LABELS = ["terminal", "research", "gui"]
+    FEATURE_DIM = 2 ** 14
+    LEARNING_RATE = 0.5
+    RULE_CONFIDENCE = 0.95
+    
+    RULES = {
+        "research": [re.compile(p, re.IGNORECASE) for p in [
+            r'\b(latest|newest|current|recent)\b.{0,30}\b(version|release|news|update)s?\b',
+            r'\b(news|weather|exchange rate|stock price|release date|who won)\b',
+            r'\b(search|look up|google)\b.{0,20}\b(web|internet|online)\b',
+            r'\bwhat is the (price|population|capital)\b',
+            r'(araştır|son sürüm|güncel sürüm|haberler|hava durumu|döviz kuru)',
+        ]],
+        "gui": [re.compile(p, re.IGNORECASE) for p in [
+            r'\b(click|double[- ]click|right[- ]click|drag)\b',
+            r'\b(press|tap) (on )?the .{0,30}\b(button|icon|tab|menu)\b',
+            r'(tıkla|butonuna|butona|simgesine)',
+        ]],
+        "terminal": [re.compile(p, re.IGNORECASE) for p in [
+            r'^(list|show|create|make|delete|remove|copy|move|rename|run|install|uninstall|kill|find|count|check|print|write|compress|extract|ping)\b',
+            r'\b(disk usage|free space|cpu usage|memory usage|ip address|running processes|folder|directory|\.txt|\.py|\.log)\b',
+            r'(oluştur|listele|göster|kopyala|taşı|çalıştır|klasör|dosya)',
+        ]],
+    }
+    RESEARCH_PREFIX = "IMPORTANT: Use the following web search results"
+    
+    def __init__(self, model_file: str = INTENT_MODEL_FILE, threshold: float = INTENT_CONFIDENCE_THRESHOLD):
+        self.model_file = model_file
+        self.threshold = threshold
+        self.weights = {label: {} for label in self.LABELS}
+        self.bias = {label: 0.0 for label in self.LABELS}
+        self.examples = []
+        self.stats = {"rule_decisions": 0, "classifier_decisions": 0, "llm_fallbacks": 0}
+        self._load()
+    
+    def _load(self):
+        """Load weights, examples and counters"""
+        try:
+            if os.path.exists(self.model_file):
+                with open(self.model_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.weights = {label: {int(k): v for k, v in data.get("weights", {}).get(label, {}).items()} for label in self.LABELS}
+                self.bias = {label: data.get("bias", {}).get(label, 0.0) for label in self.LABELS}
+                self.examples = data.get("examples", [])
+                self.stats.update(data.get("stats", {}))
+        except Exception as e:
+            print(f"{Fore.YELLOW}⚠️ Intent model load error: {e}. Starting untrained.{Style.RESET_ALL}")
+    
+    def save(self):
+        """Persist weights, examples and counters"""
+        try:
+            with open(self.model_file, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "weights": self.weights,
+                    "bias": self.bias,
+                    "examples": self.examples[-INTENT_MAX_EXAMPLES:],
+                    "stats": self.stats
+                }, f)
+        except Exception as e:
+            print(f"{Fore.YELLOW}⚠️ Intent model save error: {e}{Style.RESET_ALL}")
+    
+    def _features(self, text: str) -> Dict[int, float]:
+        """Hashed word uni/bigrams and character trigrams"""
+        words = re.findall(r'\w+', text.lower())
+        grams = [f"w:{w}" for w in words]
+        grams += [f"b:{a}_{b}" for a, b in zip(words, words[1:])]
+        for w in words:
+            padded = f"#{w}#"
+            grams += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+        
+        features = {}
+        for gram in grams:
+            idx = zlib.crc32(gram.encode('utf-8')) % self.FEATURE_DIM
+            features[idx] = features.get(idx, 0.0) + 1.0
+        norm = sum(v * v for v in features.values()) ** 0.5 or 1.0
+        return {k: v / norm for k, v in features.items()}
+    
+    def _probabilities(self, features: Dict[int, float]) -> Dict[str, float]:
+        """Softmax over label scores"""
+        scores = {}
+        for label in self.LABELS:
+            w = self.weights[label]
+            scores[label] = self.bias[label] + sum(w.get(k, 0.0) * v for k, v in features.items())
+        top = max(scores.values())
+        exp = {label: math.exp(score - top) for label, score in scores.items()}
+        total = sum(exp.values())
+        return {label: v / total for label, v in exp.items()}
+    
+    def _match_rules(self, text: str) -> Optional[str]:
+        """Label if exactly one rule group matches"""
+        matched = [label for label, patterns in self.RULES.items() if any(p.search(text) for p in patterns)]
+        if len(matched) == 1:
+            return matched[0]
+        # Research/GUI cues outrank generic terminal verbs ("show the latest python version")
+        non_terminal = [label for label in matched if label != "terminal"]
+        if len(non_terminal) == 1:
+            return non_terminal[0]
+        return None
+    
+    def is_trained(self) -> bool:
+        """Enough labeled examples from at least two classes"""
+        return len(self.examples) >= INTENT_MIN_EXAMPLES and len({label for _, label in self.examples}) >= 2
+    
+    def classify(self, text: str):
+        """Returns (label, confidence, source); label is None when the input is ambiguous"""
+        rule_label = self._match_rules(text)
+        if rule_label:
+            return rule_label, self.RULE_CONFIDENCE, "rule"
+        
+        if self.is_trained():
+            probs = self._probabilities(self._features(text))
+            label = max(probs, key=probs.get)
+            if probs[label] >= self.threshold:
+                return label, probs[label], "model"
+            return None, probs[label], "model"
+        
+        return None, 0.0, None
+    
+    def observe(self, text: str, label: str, save: bool = True):
+        """Online SGD update from a labeled example (e.g. intent flags returned by the LLM)"""
+        if label not in self.LABELS or not text:
+            return
+        features = self._features(text)
+        probs = self._probabilities(features)
+        for cls in self.LABELS:
+            gradient = (1.0 if cls == label else 0.0) - probs[cls]
+            w = self.weights[cls]
+            for k, v in features.items():
+                w[k] = w.get(k, 0.0) + self.LEARNING_RATE * gradient * v
+            self.bias[cls] += self.LEARNING_RATE * gradient * 0.1
+        
+        self.examples.append([text[:200], label])
+        if len(self.examples) > INTENT_MAX_EXAMPLES:
+            self.examples = self.examples[-INTENT_MAX_EXAMPLES:]
+        if save:
+            self.save()
+    
+    def learn_from_history(self, history: List[Dict]):
+        """Recover labels from past conversations (research requests are stored with search results)"""
+        known = {text for text, _ in self.examples}
+        learned = 0
+        for entry in history:
+            message = entry.get('message', '')
+            if entry.get('role') != 'user' or not message.startswith(self.RESEARCH_PREFIX):
+                continue
+            match = re.search(r'User asked: "(.+?)"', message)
+            if match and match.group(1)[:200] not in known:
+                self.observe(match.group(1), "research", save=False)
+                learned += 1
+        if learned:
+            self.save()
+    
+    def record_decision(self, source: Optional[str]):
+        """Count who settled an intent: 'rule', 'model' or None (left to the LLM)"""
+        if source == "rule":
+            self.stats["rule_decisions"] += 1
+        elif source == "model":
+            self.stats["classifier_decisions"] += 1
+        else:
+            self.stats["llm_fallbacks"] += 1
+    
+    def get_stats(self) -> Dict:
+        """Counters for the 'intent' command"""
+        return dict(
+            self.stats,
+            llm_calls_saved=self.stats["rule_decisions"] + self.stats["classifier_decisions"],
+            threshold=self.threshold,
+            examples=len(self.examples),
+            trained=self.is_trained()
+        )
+
+
+class ContextAssembler:
+    """Builds the prompt's conversation context from recent and semantically related history under a token budget"""
+    
+    RECENT_CANDIDATES = 8
+    RELATED_CANDIDATES = 5
+    RECENT_SHARE = 0.6  # part of the budget reserved for recent turns; unused tokens flow to related hits
+    SUMMARY_SHARE = 0.25  # at most this part goes to warm-tier session summaries
+    MIN_SUMMARY_TOKENS = 30
+    MAX_ENTRY_TOKENS = 120
+    
+    def __init__(self, memory):
+        self.memory = memory
+        self.last_report = {}
+    
+    @staticmethod
+    def _key(entry) -> str:
+        return f"{entry.get('role')}|{' '.join(str(entry.get('message', '')).split())[:200]}"
+    
+    @staticmethod
+    def _is_current(entry, current: str) -> bool:
+        """The request being answered is already in history; don't feed it back as context"""
+        message = str(entry.get('message', ''))
+        return entry.get('role') == 'user' and bool(message) and current.startswith(message) and len(message) >= min(len(current), 500)
+    
+    def _related(self, query: str) -> List[Dict]:
+        """Semantic (or full-text) hits as history entries with a similarity score"""
+        if not query or not hasattr(self.memory, 'search_memory'):
+            return []
+        try:
+            results = self.memory.search_memory(query[:500], n_results=self.RELATED_CANDIDATES)
+        except Exception:
+            return []
+        if not results or not results.get('metadatas'):
+            return []
+        distances = (results.get('distances') or [[]])[0]
+        hits = []
+        for rank, (doc, meta) in enumerate(zip(results['documents'][0], results['metadatas'][0])):
+            similarity = 1 / (1 + distances[rank]) if rank < len(distances) else 1 / (1 + rank)
+            hits.append({
+                "role": meta.get('role', 'user'),
+                "message": meta.get('full_message', doc),
+                "timestamp": meta.get('timestamp', ''),
+                "score": similarity
+            })
+        return hits
+    
+    def _render(self, entries, budget: int):
+        """Format entries until the budget is spent; returns (lines, tokens)"""
+        lines, spent = [], 0
+        for entry in entries:
+            remaining = budget - spent
+            if remaining < 8:
+                break
+            role = {"user": "👤 User", "summary": "📜 Earlier"}.get(entry['role'], "🤖 ZAI")
+            message = ' '.join(str(entry['message']).split())
+            room = (min(remaining, self.MAX_ENTRY_TOKENS) - 4) * 4
+            line = f"{role}: {message if len(message) <= room else message[:room] + '...'}"
+            lines.append(line)
+            spent += RetryState.estimate_tokens(line)
+        return lines, spent
+    
+    def _summaries(self) -> List[Dict]:
+        """Warm-tier summaries, newest first, as history-like entries"""
+        tiers = getattr(self.memory, 'tiers', None)
+        if not tiers:
+            return []
+        try:
+            return [{"role": "summary", "message": f"{s['from'][:10]}: {s['summary']}"} for s in reversed(tiers.summaries())]
+        except Exception:
+            return []
+    
+    def assemble(self, query: str, budget: int) -> str:
+        """Context text for the prompt; per-section token use is kept in last_report"""
+        summary_lines, summary_tokens = [], 0
+        if budget * self.SUMMARY_SHARE >= self.MIN_SUMMARY_TOKENS:
+            summary_lines, summary_tokens = self._render(self._summaries(), int(budget * self.SUMMARY_SHARE))
+            summary_lines.reverse()
+        budget -= summary_tokens
+        
+        recent = [e for e in self.memory.get_recent_history(self.RECENT_CANDIDATES) if not self._is_current(e, query)]
+        seen = {self._key(e) for e in recent}
+        related = []
+        for hit in sorted(self._related(query), key=lambda h: h['score'], reverse=True):
+            if self._is_current(hit, query) or self._key(hit) in seen:
+                continue
+            seen.add(self._key(hit))
+            related.append(hit)
+        
+        # Newest turns first when trimming, shown oldest-first
+        recent_lines, recent_tokens = self._render(list(reversed(recent)), int(budget * self.RECENT_SHARE) if related else budget)
+        recent_lines.reverse()
+        related_lines, related_tokens = self._render(related, budget - recent_tokens)
+        
+        self.last_report = {
+            "budget": budget + summary_tokens,
+            "summaries": summary_tokens,
+            "recent": recent_tokens,
+            "related": related_tokens,
+            "total": summary_tokens + recent_tokens + related_tokens,
+            "summary_entries": len(summary_lines),
+            "recent_entries": len(recent_lines),
+            "related_entries": len(related_lines)
+        }
+        
+        if not recent_lines and not related_lines and not summary_lines:
+            return "First conversation"
+        sections = []
+        if summary_lines:
+            sections.append("Earlier sessions (summaries):\n" + "\n".join(summary_lines))
+        if related_lines:
+            sections.append("Related earlier conversation:\n" + "\n".join(related_lines))
+        if recent_lines:
+            sections.append("Recent conversation:\n" + "\n".join(recent_lines))
+        return "\n\n".join(sections)
+
+
+class WebResearchEngine:
+    """DuckDuckGo web research engine using official library"""
+    
+    def __init__(self):
+        self.max_results = 5
+        self.is_available_flag = DDGS_AVAILABLE or (REQUESTS_AVAILABLE and BS4_AVAILABLE)
+        self.ai_model = None
+        self.response_cache = None
+    
+    def set_ai_model(self, model):
+        """Set AI model for query optimization"""
+        self.ai_model = model
+    
+    def set_response_cache(self, cache: ResponseCache):
+        """Share the AI brain's response cache"""
+        self.response_cache = cache
+    
+    def is_available(self) -> bool:
+        """Check if web research is available"""
+        return self.is_available_flag
+    
+    def optimize_query(self, user_query: str) -> str:
+        """Use AI to extract optimal English search keywords"""
+        if not self.ai_model:
+            return user_query
+        
+        try:
+            prompt = f"""Convert this user query to optimal English search keywords.
+User query: "{user_query}"
+
+Rules:
+- Extract the main topic/subject
+- Convert to English
+- Use 2-5 keywords only
+- For version queries: add "latest version" or "current version"
+- No full sentences, just keywords
+
+Examples:
+- "python son sürümünü araştır" → "python latest version"
+- "nodejs nasıl kurulur" → "nodejs install tutorial"
+- "react ile proje nasıl başlatılır" → "react create project"
+
+Return ONLY the optimized search keywords, nothing else."""
+
+            # Keyword extraction is stable, so it is cached at any temperature
+            cacheable = self.response_cache is not None and self.response_cache.is_cacheable(self.ai_model, prompt, max_temperature=None)
+            text = self.response_cache.get(self.ai_model, prompt) if cacheable else None
+            if text is None:
+                text = self.ai_model.generate_content(prompt).text
+                if cacheable:
+                    self.response_cache.put(self.ai_model, prompt, text)
+            optimized = text.strip().strip('"').strip("'")
+            if optimized and len(optimized) < 100:
+                return optimized
+        except:
+            pass
+        
+        return user_query
+    
+    def search(self, query: str) -> List[Dict]:
+        """Perform DuckDuckGo search"""
+        
+        if DDGS_AVAILABLE:
+            try:
+                with ddgs_lib.DDGS() as ddgs:
+                    results = []
+                    for r in ddgs.text(query, max_results=self.max_results):
+                        results.append({
+                            "title": r.get("title", ""),
+                            "snippet": r.get("body", ""),
+                            "url": r.get("href", "")
+                        })
+                    return results
+            except Exception as e:
+                print(f"{Fore.YELLOW}DDGS search error: {e}{Style.RESET_ALL}")
+        
+        if REQUESTS_AVAILABLE and BS4_AVAILABLE:
+            try:
+                headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
+                search_url = f"https://html.duckduckgo.com/html/?q={requests.utils.quote(query)}"
+                
+                response = requests.get(search_url, headers=headers, timeout=10)
+                if response.status_code != 200:
+                    return []
+                
+                soup = bs4.BeautifulSoup(response.text, 'html.parser')
+                results = []
+                
+                for result in soup.select('.result')[:self.max_results]:
+                    title_elem = result.select_one('.result__title')
+                    snippet_elem = result.select_one('.result__snippet')
+                    link_elem = result.select_one('.result__url')
+                    
+                    if title_elem:
+                        results.append({
+                            "title": title_elem.get_text(strip=True),
+                            "snippet": snippet_elem.get_text(strip=True) if snippet_elem else "",
+                            "url": link_elem.get_text(strip=True) if link_elem else ""
+                        })
+                
+                return results
+                
+            except Exception as e:
+                print(f"{Fore.YELLOW}Web search error: {e}{Style.RESET_ALL}")
+        
+        return []
+    
+    def format_results_for_ai(self, results: List[Dict], query: str) -> str:
+        """Format search results for AI consumption"""
+        if not results:
+            return f"No results found for: {query}"
+        
+        formatted = f"""IMPORTANT: Use the following web search results to answer the user's question.
+User asked: "{query}"
+
+Search Results:
+"""
+        for i, r in enumerate(results, 1):
+            formatted += f"\n{i}. {r['title']}\n"
+            formatted += f"   Source: {r['url']}\n"
+            formatted += f"   Summary: {r['snippet']}\n"
+        
+        formatted += "\nBased on these search results, provide a helpful and accurate answer."
+        return formatted
+    
+    def print_results_to_user(self, results: List[Dict], query: str):
+        """Print formatted results to console for user to see"""
+        print(f"\n{Fore.CYAN}Web Search Results for '{query}':{Style.RESET_ALL}\n")
+        for i, r in enumerate(results, 1):
+            print(f"{Fore.GREEN}{i}. {r['title']}{Style.RESET_ALL}")
+            print(f"   {Fore.BLUE}{r['url']}{Style.RESET_ALL}")
+            print(f"   {r['snippet'][:150]}...\n")
+
+
+class ImageAnalyzer:
+    """Image file analyzer using Gemini Vision"""
+    
+    def __init__(self):
+        self.model = None
+        self.is_available_flag = PIL_AVAILABLE and Image.is_loadable()
+    
+    def _init_model(self):
+        """Lazy initialize the model"""
+        if self.model is None:
+            self.model = MeteredModel(genai.GenerativeModel('gemini-3-flash'), mode="vision")
+    
+    def is_supported_format(self, file_path: str) -> bool:
+        """Check if file format is supported"""
+        ext = Path(file_path).suffix.lower().lstrip('.')
+        return ext in SUPPORTED_IMAGE_FORMATS
+    
+    def encode_image_to_base64(self, image_path: str) -> Optional[str]:
+        """Encode image file to base64"""
+        if not self.is_available_flag:
+            return None
+        try:
+            with open(image_path, 'rb') as f:
+                return base64.b64encode(f.read()).decode('utf-8')
+        except Exception as e:
+            print(f"{Fore.RED}Image encoding error: {e}{Style.RESET_ALL}")
+            return None
+    
+    def analyze_image(self, image_path: str, context: str = None) -> Dict:
+        """Analyze image and return structured analysis"""
+        self._init_model()
+        
+        if not os.path.exists(image_path):
+            return {"success": False, "error": f"File not found: {image_path}"}
+        
+        if not self.is_supported_format(image_path):
             return {"success": False, "error": f"Unsupported format. Supported: {SUPPORTED_IMAGE_FORMATS}"}
         
         try:
@@ -425,22 +1812,26 @@ class GUIAutomationBridge:
     
     def __init__(self, ai_brain=None):
         self.ai_brain = ai_brain
-        self.is_available_flag = PYAUTOGUI_AVAILABLE
+        self.is_available_flag = PYAUTOGUI_AVAILABLE and pyautogui.is_loadable()
         self.screen_width = 0
         self.screen_height = 0
         self.model = None
         self.action_history = []
         
         if self.is_available_flag:
-            self.screen_width, self.screen_height = pyautogui.size()
+            try:
+                self.screen_width, self.screen_height = pyautogui.size()
+            except Exception as e:
+                print(f"{Fore.YELLOW}⚠️ GUI automation unavailable: {e}{Style.RESET_ALL}")
+                self.is_available_flag = False
     
     def _init_model(self):
         """Initialize model with temperature 0 for deterministic GUI actions"""
         if self.model is None:
-            self.model = genai.GenerativeModel(
+            self.model = MeteredModel(genai.GenerativeModel(
                 'gemini-3-flash',
                 generation_config={'temperature': 0.0, 'top_k': 1}
-            )
+            ), mode="gui")
     
     def is_available(self) -> bool:
         """Check if GUI automation is available"""
@@ -961,7 +2352,271 @@ class P2PTerminalSharing:
         print(f"\n{Fore.GREEN}Session ended{Style.RESET_ALL}\n")
 
 
-class ChromaMemoryManager:
+class HashingEmbedder:
+    """Dependency-free embedder: signed feature hashing of words and character trigrams"""
+    
+    name = "hashing"
+    storage_name = "hashing2"  # cached vectors, collections and vector files; bumped when features change
+    
+    def __init__(self, dim=EMBEDDING_HASH_DIM):
+        self.dim = dim
+    
+    def _features(self, text):
+        # \w keeps Turkish, accented and CJK words (plus path characters for commands)
+        words = re.findall(r"[\w./-]+", text.lower(), re.UNICODE)
+        for word in words:
+            yield word, 1.0
+            padded = f" {word} "
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3], 0.5
+        for first, second in zip(words, words[1:]):
+            yield f"{first} {second}", 0.75
+    
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for text in texts:
+            vector = [0.0] * self.dim
+            for feature, weight in self._features(text):
+                h = zlib.crc32(feature.encode('utf-8'))
+                vector[h % self.dim] += weight if (h >> 16) & 1 else -weight
+            norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+            vectors.append([v / norm for v in vector])
+        return vectors
+
+
+class MiniLMEmbedder:
+    """ChromaDB's bundled all-MiniLM-L6-v2 ONNX model (CPU, downloaded once)"""
+    
+    name = "minilm"
+    storage_name = "minilm"
+    dim = 384
+    
+    def __init__(self):
+        from chromadb.utils import embedding_functions
+        self._fn = embedding_functions.DefaultEmbeddingFunction()
+    
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return [[float(v) for v in vector] for vector in self._fn(texts)]
+
+
+EMBEDDERS = {"minilm": MiniLMEmbedder, "hashing": HashingEmbedder}
+
+
+class EmbeddingCache:
+    """Content-hash -> vector cache stored as a memory-mapped float32 matrix"""
+    
+    def __init__(self, name, dim, path=EMBEDDING_CACHE_PATH, max_rows=EMBEDDING_CACHE_MAX_ROWS):
+        self.dim = dim
+        self.row_bytes = dim * 4
+        self.max_rows = max_rows
+        self.data_file = f"{path}.{name}.f32"
+        self.index_file = f"{path}.{name}.json"
+        self.rows = {}
+        self._mm = None
+        self._mm_rows = 0
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        self._load()
+        self._fh = open(self.data_file, 'ab')
+    
+    def _load(self):
+        """Read the row index; rows beyond the data file (interrupted write) are dropped"""
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get("dim") == self.dim:
+                stored = os.path.getsize(self.data_file) // self.row_bytes
+                self.rows = {k: row for k, row in index.get("rows", {}).items() if row < stored}
+        except Exception:
+            self.rows = {}
+        # Vectors appended after the last index save are unreachable; cut them so rows stay aligned
+        if os.path.exists(self.data_file):
+            os.truncate(self.data_file, len(self.rows) * self.row_bytes)
+    
+    def _remap(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._fh.flush()
+        size = os.path.getsize(self.data_file)
+        self._mm_rows = size // self.row_bytes
+        if size:
+            with open(self.data_file, 'rb') as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    def get(self, key) -> Optional[List[float]]:
+        with self._lock:
+            row = self.rows.get(key)
+            if row is None:
+                return None
+            if row >= self._mm_rows:
+                self._remap()
+            offset = row * self.row_bytes
+            vector = array('f')
+            vector.frombytes(self._mm[offset:offset + self.row_bytes])
+            return vector.tolist()
+    
+    def put(self, key, vector: List[float]):
+        with self._lock:
+            if key in self.rows or len(vector) != self.dim:
+                return
+            if len(self.rows) >= self.max_rows:
+                self._reset()
+            self._fh.write(array('f', vector).tobytes())
+            self.rows[key] = len(self.rows)
+            self._unsaved += 1
+        if self._unsaved >= 50:
+            self.save()
+    
+    def _reset(self):
+        """Start over when the cache is full (vectors are cheap to recompute)"""
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._mm_rows = 0
+        self._fh.close()
+        self._fh = open(self.data_file, 'wb')
+        self.rows = {}
+    
+    def save(self):
+        """Persist the row index (vectors are appended to the data file as they arrive)"""
+        with self._lock:
+            if not self._unsaved:
+                return
+            try:
+                self._fh.flush()
+                temp_file = self.index_file + ".tmp"
+                with open(temp_file, 'w', encoding='utf-8') as f:
+                    json.dump({"dim": self.dim, "rows": self.rows}, f)
+                os.replace(temp_file, self.index_file)
+                self._unsaved = 0
+            except Exception:
+                pass
+
+
+class CachedEmbeddingFunction:
+    """Chroma-compatible embedding function that consults the embedding cache first"""
+    
+    def __init__(self, embedder):
+        self.embedder = embedder
+        self.cache = EmbeddingCache(embedder.storage_name, embedder.dim)
+        self.hits = 0
+        self.misses = 0
+        atexit.register(self.cache.save)
+    
+    def __call__(self, input):
+        keys = [hashlib.sha1(text.encode('utf-8', errors='replace')).hexdigest() for text in input]
+        vectors = [self.cache.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            computed = self.embedder.embed([input[i] for i in missing])
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+                self.cache.put(keys[i], vector)
+        return vectors
+    
+    def name(self):
+        return f"zaishell_{self.embedder.name}"
+    
+    def get_stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "embedder": self.embedder.name,
+            "cached": len(self.cache.rows),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total * 100, 1) if total else 0.0
+        }
+
+
+def create_embedding_function(name):
+    """Cached embedding function for the named embedder (hashing if it cannot be loaded)"""
+    try:
+        return CachedEmbeddingFunction(EMBEDDERS.get(name, HashingEmbedder)())
+    except Exception as e:
+        if name != "hashing" and module_available("chromadb"):
+            print(f"{Fore.YELLOW}⚠️ Embedder '{name}' unavailable ({e}), using hashing embedder{Style.RESET_ALL}")
+        return CachedEmbeddingFunction(HashingEmbedder())
+
+
+class MemoryFacade:
+    """Vector memory front-end base: settings, stats and plain history live in the JSON/SQLite store"""
+    
+    @property
+    def memory(self):
+        return self.json_manager.memory
+    
+    def get_offline_mode(self):
+        """Get offline mode status"""
+        return self.json_manager.get_offline_mode()
+    
+    def set_offline_mode(self, enabled):
+        """Set offline mode"""
+        self.json_manager.set_offline_mode(enabled)
+    
+    def save_memory(self):
+        """Save the underlying store"""
+        self.json_manager.save_memory()
+    
+    def _add_hot(self, role, message):
+        """Append a turn to the store (hot tier) and let the compactor check its limits"""
+        self.json_manager.add_conversation(role, message)
+        self.tiers.notify()
+    
+    def clear_history(self):
+        """Clear the conversation history in every tier (hot turns, warm summaries, cold archive)"""
+        with self.tiers._lock:  # a compaction in progress must not drop turns added after the clear
+            self.json_manager.clear_history()
+            self.tiers.clear()
+    
+    def update_stats(self, successful=0, failed=0):
+        """Update statistics"""
+        self.json_manager.update_stats(successful, failed)
+    
+    def set_mode(self, mode):
+        """Set current mode"""
+        self.json_manager.set_mode(mode)
+    
+    def get_mode(self):
+        """Get current mode"""
+        return self.json_manager.get_mode()
+    
+    def set_thinking(self, enabled):
+        """Set thinking mode"""
+        self.json_manager.set_thinking(enabled)
+    
+    def get_thinking(self):
+        """Get thinking mode"""
+        return self.json_manager.get_thinking()
+    
+    def set_gui_enabled(self, enabled):
+        """Set GUI enabled"""
+        self.json_manager.set_gui_enabled(enabled)
+    
+    def get_gui_enabled(self):
+        """Get GUI enabled status"""
+        return self.json_manager.get_gui_enabled()
+    
+    def set_research_enabled(self, enabled):
+        """Set research enabled"""
+        self.json_manager.set_research_enabled(enabled)
+    
+    def get_research_enabled(self):
+        """Get research enabled status"""
+        return self.json_manager.get_research_enabled()
+    
+    def set_setting(self, key, value):
+        """Set a generic setting"""
+        self.json_manager.set_setting(key, value)
+    
+    def get_setting(self, key, default=None):
+        """Get a generic setting"""
+        return self.json_manager.get_setting(key, default)
+
+
+class ChromaMemoryManager(MemoryFacade):
     """ChromaDB-based persistent memory manager"""
     
     def __init__(self, fallback_to_json=True):
@@ -969,84 +2624,236 @@ class ChromaMemoryManager:
         self.chroma_client = None
         self.collection = None
         self.fallback_to_json = fallback_to_json
+        self.embedding_function = None
         
-        try:
-            import chromadb
-            from chromadb.config import Settings
+        # Always keep the JSON (or SQLite) store as backup/fallback
+        with STARTUP_PROFILER.phase("memory store"):
+            self.json_manager = create_memory_store()
+        embedder = self.json_manager.get_setting("embedder", EMBEDDING_DEFAULT)
+        
+        with STARTUP_PROFILER.phase("chromadb init"):
+            try:
+                import chromadb
+                from chromadb.config import Settings
             
-            self.chroma_client = chromadb.PersistentClient(
-                path=CHROMA_DB_PATH,
-                settings=Settings(anonymized_telemetry=False)
-            )
+                self.chroma_client = chromadb.PersistentClient(
+                    path=CHROMA_DB_PATH,
+                    settings=Settings(anonymized_telemetry=False)
+                )
             
-            self.collection = self.chroma_client.get_or_create_collection(
-                name=CHROMA_COLLECTION_NAME,
-                metadata={"description": "ZAIShell conversation memory"}
-            )
+                self.embedding_function = create_embedding_function(embedder)
+                self.collection = self._open_collection()
             
-            self.use_chromadb = True
-            print(f"{Fore.GREEN}✓ ChromaDB memory initialized{Style.RESET_ALL}")
+                self.use_chromadb = True
+                print(f"{Fore.GREEN}✓ ChromaDB memory initialized{Style.RESET_ALL}")
             
-        except ImportError:
-            print(f"{Fore.YELLOW}⚠️ ChromaDB not installed. Install: pip install chromadb{Style.RESET_ALL}")
-            if fallback_to_json:
-                print(f"{Fore.YELLOW}→ Falling back to JSON memory{Style.RESET_ALL}")
-        except Exception as e:
-            print(f"{Fore.YELLOW}⚠️ ChromaDB error: {e}. Using JSON memory{Style.RESET_ALL}")
+            except ImportError:
+                print(f"{Fore.YELLOW}⚠️ ChromaDB not installed. Install: pip install chromadb{Style.RESET_ALL}")
+                if fallback_to_json:
+                    print(f"{Fore.YELLOW}→ Falling back to JSON memory{Style.RESET_ALL}")
+            except Exception as e:
+                print(f"{Fore.YELLOW}⚠️ ChromaDB error: {e}. Using JSON memory{Style.RESET_ALL}")
+        
+        # Without ChromaDB the hashing embedder gives the local store semantic search
+        if not self.use_chromadb:
+            self.embedding_function = create_embedding_function("hashing")
         
-        # Always keep JSON as backup/fallback
-        self.json_manager = MemoryManager()
-        self.memory = self.json_manager.memory
+        # Recency index: every document carries a monotonically increasing "seq"
+        self._next_seq = 0
+        self._tail = deque(maxlen=CHROMA_TAIL_SIZE)
+        
+        # Background ingestion: embeddings are computed off the interactive loop, in batches
+        self._ingest_queue = queue.Queue(maxsize=CHROMA_INGEST_MAX_PENDING)
+        self._ingest_inflight = 0
+        self._ingest_flushing = False
+        self.ingested = 0
+        self.ingest_dropped = 0
+        self.ingest_errors = 0
+        
+        if self.use_chromadb:
+            self._load_recency_index()
+            threading.Thread(target=self._ingest_worker, daemon=True).start()
+            atexit.register(self.flush_ingestion)
+        
+        self.tiers = MemoryTiers(self)
     
-    def get_offline_mode(self):
-        """Get offline mode status"""
-        return self.json_manager.get_offline_mode()
+    def _open_collection(self):
+        """Collection embedded through the cache; vectors of different embedders live in separate collections"""
+        name = CHROMA_COLLECTION_NAME
+        if self.embedding_function.embedder.name != EMBEDDING_DEFAULT:
+            name = f"{CHROMA_COLLECTION_NAME}_{self.embedding_function.embedder.storage_name}"
+        metadata = {"description": "ZAIShell conversation memory"}
+        try:
+            return self.chroma_client.get_or_create_collection(
+                name=name, metadata=metadata, embedding_function=self.embedding_function
+            )
+        except Exception as e:
+            print(f"{Fore.YELLOW}⚠️ Embedding cache not used by ChromaDB ({e}){Style.RESET_ALL}")
+            self.embedding_function = None
+            return self.chroma_client.get_or_create_collection(name=name, metadata=metadata)
     
-    def set_offline_mode(self, enabled):
-        """Set offline mode"""
-        self.json_manager.set_offline_mode(enabled)
+    def _load_recency_index(self):
+        """Restore the sequence counter and the tail cache (one-time seq backfill for old collections)"""
+        try:
+            next_seq = self.json_manager.get_setting("chroma_next_seq")
+            if not self.collection.count():
+                next_seq = self._seed_from_history()
+            elif next_seq is None:
+                next_seq = self._backfill_sequence()
+            self._next_seq = next_seq
+            
+            if next_seq:
+                results = self.collection.get(
+                    where={"seq": {"$gte": max(0, next_seq - CHROMA_TAIL_SIZE)}},
+                    include=["metadatas", "documents"]
+                )
+                for entry in sorted(self._to_history(results), key=lambda x: x["seq"]):
+                    self._tail.append(entry)
+        except Exception as e:
+            print(f"{Fore.YELLOW}⚠️ ChromaDB recency index error: {e}{Style.RESET_ALL}")
+    
+    def _seed_from_history(self) -> int:
+        """Queue recent local history for an empty collection (new or re-versioned embedder); returns the next free seq"""
+        history = self.json_manager.get_recent_history(CHROMA_INGEST_MAX_PENDING // 2)
+        for seq, entry in enumerate(history):
+            message = str(entry.get("message", ""))
+            metadata = {"role": entry.get("role", "user"), "timestamp": entry.get("timestamp", ""),
+                        "full_message": message[:2000], "seq": seq}
+            self._ingest_queue.put_nowait((message[:1000], metadata, f"{metadata['role']}_{metadata['timestamp']}_{seq}"))
+            self._tail.append({"role": metadata["role"], "message": message[:2000], "timestamp": metadata["timestamp"], "seq": seq})
+        self.json_manager.set_setting("chroma_next_seq", len(history))
+        return len(history)
+    
+    def _backfill_sequence(self) -> int:
+        """Number existing documents by timestamp; returns the next free seq"""
+        results = self.collection.get(include=["metadatas"])
+        ordered = sorted(zip(results["ids"], results["metadatas"]), key=lambda x: x[1].get("timestamp", ""))
+        if ordered:
+            self.collection.update(
+                ids=[doc_id for doc_id, _ in ordered],
+                metadatas=[dict(meta, seq=i) for i, (_, meta) in enumerate(ordered)]
+            )
+        self.json_manager.set_setting("chroma_next_seq", len(ordered))
+        return len(ordered)
+    
+    @staticmethod
+    def _to_history(results):
+        """Chroma get() results -> history entries"""
+        history = []
+        for i, metadata in enumerate(results["metadatas"]):
+            history.append({
+                "role": metadata["role"],
+                "message": metadata.get("full_message", results["documents"][i]),
+                "timestamp": metadata["timestamp"],
+                "seq": metadata.get("seq", -1)
+            })
+        return history
+    
+    def _ingest_worker(self):
+        """Collect queued documents into batches and write each batch with one collection.add"""
+        while True:
+            batch = [self._ingest_queue.get()]
+            deadline = time.time() + CHROMA_INGEST_DELAY
+            while len(batch) < CHROMA_INGEST_BATCH:
+                remaining = 0 if self._ingest_flushing else deadline - time.time()
+                try:
+                    batch.append(self._ingest_queue.get(timeout=max(remaining, 0.001)))
+                except queue.Empty:
+                    break
+            
+            self._ingest_inflight = len(batch)
+            try:
+                self.collection.add(
+                    documents=[doc for doc, _, _ in batch],
+                    metadatas=[meta for _, meta, _ in batch],
+                    ids=[doc_id for _, _, doc_id in batch]
+                )
+                self.ingested += len(batch)
+            except Exception as e:
+                self.ingest_errors += len(batch)
+                print(f"{Fore.YELLOW}⚠️ ChromaDB add error: {e}{Style.RESET_ALL}")
+            finally:
+                self._ingest_inflight = 0
+                for _ in batch:
+                    self._ingest_queue.task_done()
+    
+    def clear_history(self):
+        """Forget the conversation history, including the recency tail and the indexed documents"""
+        with self.tiers._lock:
+            super().clear_history()
+            if self.use_chromadb and self.collection:
+                self.flush_ingestion()
+                try:
+                    self.collection.delete(where={"seq": {"$gte": 0}})
+                except Exception as e:
+                    print(f"{Fore.YELLOW}⚠️ ChromaDB clear error: {e}{Style.RESET_ALL}")
+                self._tail.clear()
+                self._next_seq = 0
+                self.json_manager.set_setting("chroma_next_seq", 0)
+    
+    def prune(self, keep):
+        """Drop indexed documents older than the newest `keep` (their text is in the cold archive)"""
+        if not self.use_chromadb or self._next_seq <= keep:
+            return
+        try:
+            if self.collection.count() > keep:
+                self.collection.delete(where={"seq": {"$lt": self._next_seq - keep}})
+        except Exception as e:
+            print(f"{Fore.YELLOW}⚠️ ChromaDB prune error: {e}{Style.RESET_ALL}")
+    
+    def ingest_backlog(self) -> int:
+        """Documents queued or being embedded"""
+        return self._ingest_queue.qsize() + self._ingest_inflight
+    
+    def flush_ingestion(self):
+        """Write out queued documents now (called on exit)"""
+        if self.use_chromadb and self.ingest_backlog():
+            self._ingest_flushing = True
+            self._ingest_queue.join()
+            self._ingest_flushing = False
     
     def add_conversation(self, role, message):
         """Add conversation to both ChromaDB and JSON"""
         timestamp = datetime.datetime.now().isoformat()
         
         # Add to JSON (always)
-        self.json_manager.add_conversation(role, message)
+        self._add_hot(role, message)
         
         # Add to ChromaDB if available
         if self.use_chromadb and self.collection:
             try:
-                doc_id = f"{role}_{timestamp}"
-                self.collection.add(
-                    documents=[message[:1000]],
-                    metadatas=[{
-                        "role": role,
-                        "timestamp": timestamp,
-                        "full_message": message[:2000]
-                    }],
-                    ids=[doc_id]
-                )
+                seq = self._next_seq
+                self._next_seq += 1
+                self.json_manager.set_setting("chroma_next_seq", self._next_seq)
+                metadata = {
+                    "role": role,
+                    "timestamp": timestamp,
+                    "full_message": message[:2000],
+                    "seq": seq
+                }
+                self._tail.append({"role": role, "message": message[:2000], "timestamp": timestamp, "seq": seq})
+                self._ingest_queue.put_nowait((message[:1000], metadata, f"{role}_{timestamp}"))
+            except queue.Full:
+                self.ingest_dropped += 1
+                if self.ingest_dropped == 1:
+                    print(f"{Fore.YELLOW}⚠️ ChromaDB ingestion backlog full, skipping semantic indexing{Style.RESET_ALL}")
             except Exception as e:
                 print(f"{Fore.YELLOW}⚠️ ChromaDB add error: {e}{Style.RESET_ALL}")
     
     def get_recent_history(self, count=5):
-        """Get recent history from ChromaDB or JSON"""
+        """Get recent history from the recency index (tail cache, then seq range query) or JSON"""
         if self.use_chromadb and self.collection:
             try:
-                results = self.collection.get(
-                    limit=count,
-                    include=["metadatas", "documents"]
-                )
-                
-                history = []
-                for i, metadata in enumerate(results["metadatas"]):
-                    history.append({
-                        "role": metadata["role"],
-                        "message": metadata.get("full_message", results["documents"][i]),
-                        "timestamp": metadata["timestamp"]
-                    })
+                if count <= len(self._tail) or len(self._tail) == self._next_seq:
+                    history = list(self._tail)[-count:]
+                else:
+                    results = self.collection.get(
+                        where={"seq": {"$gte": max(0, self._next_seq - count)}},
+                        include=["metadatas", "documents"]
+                    )
+                    history = sorted(self._to_history(results), key=lambda x: x["seq"])[-count:]
                 
-                return sorted(history, key=lambda x: x["timestamp"])[-count:]
+                return [{k: v for k, v in entry.items() if k != "seq"} for entry in history]
             except Exception as e:
                 print(f"{Fore.YELLOW}⚠️ ChromaDB query error: {e}{Style.RESET_ALL}")
         
@@ -1065,70 +2872,362 @@ class ChromaMemoryManager:
                 return results
             except Exception as e:
                 print(f"{Fore.YELLOW}⚠️ ChromaDB search error: {e}{Style.RESET_ALL}")
+        else:
+            results = self._local_search(query, n_results)
+            if results:
+                return results
+        if hasattr(self.json_manager, 'search_memory'):
+            return self.json_manager.search_memory(query, n_results)
         return None
     
+    def _local_search(self, query, n_results):
+        """Cosine search over recent local history with cached embeddings (chroma result layout)"""
+        if not self.embedding_function or not query.strip():
+            return None
+        try:
+            history = self.json_manager.get_recent_history(EMBEDDING_LOCAL_WINDOW)
+            if not history:
+                return None
+            vectors = self.embedding_function([entry["message"][:1000] for entry in history] + [query])
+            query_vector = vectors.pop()
+            scored = []
+            for entry, vector in zip(history, vectors):
+                similarity = sum(a * b for a, b in zip(query_vector, vector))
+                if similarity >= EMBEDDING_MIN_SIMILARITY:
+                    scored.append((similarity, entry))
+            scored.sort(key=lambda x: x[0], reverse=True)
+            scored = scored[:n_results]
+            if not scored:
+                return None
+            return {
+                "documents": [[entry["message"][:1000] for _, entry in scored]],
+                "metadatas": [[{"role": entry["role"], "timestamp": entry["timestamp"], "full_message": entry["message"][:2000]} for _, entry in scored]],
+                "distances": [[round(1.0 - similarity, 4) for similarity, _ in scored]]
+            }
+        except Exception as e:
+            print(f"{Fore.YELLOW}⚠️ Local memory search error: {e}{Style.RESET_ALL}")
+            return None
+    
     def save_memory(self):
         """Save to JSON (ChromaDB auto-persists)"""
         self.json_manager.save_memory()
+        if self.embedding_function:
+            self.embedding_function.cache.save()
+
+
+class VectorMemoryManager(MemoryFacade):
+    """Built-in vector memory: np.memmap float32 embedding matrix + JSONL metadata, cosine top-k"""
     
-    def update_stats(self, successful=0, failed=0):
-        """Update statistics"""
-        self.json_manager.update_stats(successful, failed)
+    def __init__(self, path=VECTOR_STORE_PATH):
+        self.use_chromadb = False
+        with STARTUP_PROFILER.phase("memory store"):
+            self.json_manager = create_memory_store()
+        self.embedding_function = create_embedding_function(self.json_manager.get_setting("embedder", EMBEDDING_DEFAULT))
+        self.dim = self.embedding_function.embedder.dim
+        
+        self.path = Path(path)
+        self.path.mkdir(exist_ok=True)
+        self.meta_file = self.path / "entries.jsonl"
+        self.generation = 0  # bumped when pruning rewrites the files
+        self.vector_file = None
+        
+        self.entries = []  # row i of the matrix belongs to entries[i]
+        self._matrix = None
+        self._capacity = 0
+        self._lock = threading.Lock()
+        
+        # Inverted-file index (k-means lists), built in the background past VECTOR_IVF_THRESHOLD
+        self._ivf = None
+        self._ivf_rows = 0
+        self._ivf_building = False
+        self.last_search_ms = 0.0
+        
+        with STARTUP_PROFILER.phase("vector store load"):
+            self._load()
+        self.tiers = MemoryTiers(self)
+        atexit.register(self.flush)
+        print(f"{Fore.GREEN}✓ Vector memory initialized ({len(self.entries)} entries){Style.RESET_ALL}")
     
-    def set_mode(self, mode):
-        """Set current mode"""
-        self.json_manager.set_mode(mode)
-        self.memory = self.json_manager.memory
+    def _vector_path(self, generation):
+        suffix = f".g{generation}" if generation else ""
+        return self.path / f"vectors.{self.embedding_function.embedder.storage_name}{suffix}.f32"
     
-    def get_mode(self):
-        """Get current mode"""
-        return self.json_manager.get_mode()
+    def _map(self, rows):
+        """(Re)map the matrix file with room for at least `rows` vectors"""
+        capacity = max(VECTOR_INITIAL_CAPACITY, self._capacity)
+        while capacity < rows:
+            capacity *= 2
+        if self._matrix is not None:
+            self._matrix.flush()
+            self._matrix = None
+        size = capacity * self.dim * 4
+        if not self.vector_file.exists() or self.vector_file.stat().st_size < size:
+            with open(self.vector_file, 'ab') as f:
+                f.truncate(size)
+        self._matrix = np.memmap(self.vector_file, dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+        self._capacity = capacity
     
-    def set_thinking(self, enabled):
-        """Set thinking mode"""
-        self.json_manager.set_thinking(enabled)
+    def _load(self):
+        """Read the metadata log and embed any rows the matrix is missing (new embedder, interrupted write)"""
+        if self.meta_file.exists():
+            with open(self.meta_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if "role" in entry:
+                        self.entries.append(entry)
+                    else:
+                        self.generation = entry.get("generation", 0)
+        else:
+            # First start: seed from the existing conversation history
+            self.entries = [dict(entry, message=entry["message"][:2000])
+                            for entry in self.json_manager.get_recent_history(MEMORY_RETENTION_MAX_ROWS)]
+            with open(self.meta_file, 'w', encoding='utf-8') as f:
+                for entry in self.entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        
+        self.vector_file = self._vector_path(self.generation)
+        self._map(len(self.entries))
+        count = len(self.entries)
+        if count:
+            missing = np.flatnonzero(~self._matrix[:count].any(axis=1))
+            for start in range(0, len(missing), 256):
+                rows = missing[start:start + 256]
+                self._matrix[rows] = self._embed([self.entries[i]["message"] for i in rows])
+        self._maybe_build_ivf()
     
-    def get_thinking(self):
-        """Get thinking mode"""
-        return self.json_manager.get_thinking()
+    def _embed(self, texts):
+        vectors = np.asarray(self.embedding_function([text[:1000] for text in texts]), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1.0, norms)
     
-    def set_gui_enabled(self, enabled):
-        """Set GUI enabled"""
-        self.json_manager.set_gui_enabled(enabled)
-        self.memory = self.json_manager.memory
+    def add_conversation(self, role, message):
+        """Add conversation to the store and the vector matrix"""
+        self._add_hot(role, message)
+        try:
+            entry = {"role": role, "message": message[:2000], "timestamp": datetime.datetime.now().isoformat()}
+            vector = self._embed([message])[0]
+            with self._lock:
+                row = len(self.entries)
+                if row >= self._capacity:
+                    self._map(row + 1)
+                self._matrix[row] = vector
+                with open(self.meta_file, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                self.entries.append(entry)
+            self._maybe_build_ivf()
+        except Exception as e:
+            print(f"{Fore.YELLOW}⚠️ Vector memory add error: {e}{Style.RESET_ALL}")
     
-    def get_gui_enabled(self):
-        """Get GUI enabled status"""
-        return self.json_manager.get_gui_enabled()
+    def get_recent_history(self, count=5):
+        """Get recent history"""
+        return [dict(entry) for entry in self.entries[-count:]]
     
-    def set_research_enabled(self, enabled):
-        """Set research enabled"""
-        self.json_manager.set_research_enabled(enabled)
-        self.memory = self.json_manager.memory
+    def search_memory(self, query, n_results=3):
+        """Cosine top-k: one matrix-vector product (IVF-probed lists plus unindexed rows on large stores)"""
+        if not query.strip() or not self.entries:
+            return None
+        started = time.perf_counter()
+        query_vector = self._embed([query])[0]
+        with self._lock:
+            count = len(self.entries)
+            ivf = self._ivf
+            if ivf is not None:
+                centroids, lists = ivf
+                probes = np.argsort(centroids @ query_vector)[-VECTOR_IVF_PROBES:]
+                rows = np.concatenate([lists[p] for p in probes] + [np.arange(self._ivf_rows, count)])
+                scores = self._matrix[rows] @ query_vector
+            else:
+                rows = None
+                scores = self._matrix[:count] @ query_vector
+        
+        k = min(n_results, len(scores))
+        if not k:
+            return None
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        hits = [(float(scores[i]), self.entries[int(rows[i]) if rows is not None else int(i)]) for i in top
+                if scores[i] >= EMBEDDING_MIN_SIMILARITY]
+        self.last_search_ms = (time.perf_counter() - started) * 1000
+        if not hits:
+            return None
+        return {
+            "documents": [[entry["message"][:1000] for _, entry in hits]],
+            "metadatas": [[{"role": entry["role"], "timestamp": entry["timestamp"], "full_message": entry["message"]} for _, entry in hits]],
+            "distances": [[round(1.0 - similarity, 4) for similarity, _ in hits]]
+        }
     
-    def get_research_enabled(self):
-        """Get research enabled status"""
-        return self.json_manager.get_research_enabled()
+    def prune(self, keep):
+        """Keep the newest `keep` entries: write them to the next generation of files, then switch"""
+        with self._lock:
+            drop = len(self.entries) - keep
+            if drop <= 0:
+                return
+            self._switch_generation(self.entries[drop:], self._matrix[drop:drop + keep])
+        self._maybe_build_ivf()
+    
+    def clear_history(self):
+        """Forget the conversation history and its vectors (an empty next generation)"""
+        with self.tiers._lock:
+            super().clear_history()
+            with self._lock:
+                self._switch_generation([], None)
+    
+    def _switch_generation(self, kept, vectors):
+        """Write kept entries and their vectors as the next generation of files and switch to it (lock held)"""
+        generation = self.generation + 1
+        target = self._vector_path(generation)
+        capacity = VECTOR_INITIAL_CAPACITY
+        while capacity < len(kept):
+            capacity *= 2
+        matrix = np.memmap(target, dtype=np.float32, mode='w+', shape=(capacity, self.dim))
+        if kept:
+            matrix[:len(kept)] = vectors
+        matrix.flush()
+        del matrix
+        
+        # The metadata header names the live generation, so replacing it is the commit point
+        temp_file = self.meta_file.with_suffix(".tmp")
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"generation": generation}) + "\n")
+            for entry in kept:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(temp_file, self.meta_file)
+        
+        old_file = self.vector_file
+        self._matrix = None
+        self._capacity = 0
+        self.generation = generation
+        self.vector_file = target
+        self.entries = kept
+        self._map(len(kept))
+        self._ivf = None
+        self._ivf_rows = 0
+        try:
+            os.remove(old_file)
+        except OSError:
+            pass
+    
+    def _maybe_build_ivf(self):
+        count = len(self.entries)
+        if (count >= VECTOR_IVF_THRESHOLD and not self._ivf_building
+                and count >= self._ivf_rows * VECTOR_IVF_REBUILD_GROWTH):
+            self._ivf_building = True
+            threading.Thread(target=self._build_ivf, args=(count,), daemon=True).start()
+    
+    def _build_ivf(self, count):
+        """Spherical k-means over the first `count` rows; rows added later are scanned exhaustively"""
+        generation = self.generation
+        try:
+            data = np.array(self._matrix[:count])
+            nlist = max(1, int(math.sqrt(count)))
+            rng = np.random.default_rng(0)
+            centroids = data[rng.choice(count, nlist, replace=False)]
+            for _ in range(VECTOR_IVF_ITERATIONS):
+                assign = np.argmax(data @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assign, data)
+                norms = np.linalg.norm(sums, axis=1, keepdims=True)
+                centroids = np.where(norms > 0, sums / np.where(norms == 0, 1.0, norms), centroids)
+            assign = np.argmax(data @ centroids.T, axis=1)
+            order = np.argsort(assign, kind='stable')
+            bounds = np.searchsorted(assign[order], np.arange(nlist + 1))
+            lists = [order[bounds[c]:bounds[c + 1]] for c in range(nlist)]
+            with self._lock:
+                if generation == self.generation:
+                    self._ivf = (centroids, lists)
+                    self._ivf_rows = count
+        except Exception as e:
+            print(f"{Fore.YELLOW}⚠️ Vector index build error: {e}{Style.RESET_ALL}")
+        finally:
+            self._ivf_building = False
+    
+    def flush(self):
+        """Write dirty matrix pages and the embedding cache index"""
+        with self._lock:
+            if self._matrix is not None:
+                self._matrix.flush()
+        self.embedding_function.cache.save()
+    
+    def save_memory(self):
+        """Save the store and the vector matrix"""
+        self.json_manager.save_memory()
+        self.flush()
+    
+    def get_stats(self) -> Dict:
+        return {
+            "entries": len(self.entries),
+            "dim": self.dim,
+            "ivf_lists": len(self._ivf[1]) if self._ivf else 0,
+            "last_search_ms": round(self.last_search_ms, 3)
+        }
+
+
+def create_memory_manager():
+    """Semantic memory front-end: ZAISHELL_VECTOR_BACKEND=chroma|numpy, else ChromaDB when installed, then numpy"""
+    backend = os.getenv('ZAISHELL_VECTOR_BACKEND', '').lower()
+    if not backend:
+        backend = "chroma" if module_available("chromadb") else "numpy"
+    if backend == "numpy" and NUMPY_AVAILABLE:
+        try:
+            return VectorMemoryManager()
+        except Exception as e:
+            print(f"{Fore.YELLOW}⚠️ Vector memory error: {e}. Trying ChromaDB{Style.RESET_ALL}")
+    return ChromaMemoryManager()
 
 
 class MemoryManager:
-    """Manages persistent memory storage"""
+    """Manages persistent memory storage.
+    
+    Mutations are applied in memory and appended to a journal by a background
+    writer (batched, fsynced). The JSON snapshot is only rewritten on compaction.
+    """
+    
+    hot_capacity = MEMORY_HOT_MAX_ENTRIES
     
     def __init__(self):
         self.memory_file = MEMORY_FILE
+        self.journal_file = MEMORY_JOURNAL_FILE
+        self._lock = threading.RLock()
+        self._io_lock = threading.Lock()
+        self._pending = []
+        self._seq = 0
+        self._journal_records = 0
+        self._wake = threading.Event()
         self.memory = self._load_memory()
+        threading.Thread(target=self._writer, daemon=True).start()
+        atexit.register(self.close)
     
     def _load_memory(self):
-        """Load memory from file"""
+        """Load memory snapshot and replay the journal onto it"""
         try:
             if os.path.exists(self.memory_file):
                 with open(self.memory_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                    memory = json.load(f)
             else:
-                return self._create_default_memory()
+                memory = self._create_default_memory()
         except Exception as e:
             print(f"{Fore.YELLOW}⚠️ Memory load error: {e}. Creating new memory.{Style.RESET_ALL}")
-            return self._create_default_memory()
+            memory = self._create_default_memory()
+        
+        self._seq = memory.pop("journal_seq", 0)
+        try:
+            if os.path.exists(self.journal_file):
+                with open(self.journal_file, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            continue  # torn write from a crash
+                        self._journal_records += 1
+                        if record.get("seq", 0) > self._seq:
+                            self._apply(memory, record)
+                            self._seq = record["seq"]
+        except Exception as e:
+            print(f"{Fore.YELLOW}⚠️ Memory journal replay error: {e}{Style.RESET_ALL}")
+        return memory
     
     def _create_default_memory(self):
         """Create default memory structure"""
@@ -1145,6 +3244,7 @@ class MemoryManager:
             "offline_mode": False,
             "gui_enabled": False,
             "research_enabled": False,
+            "settings": {},
             "stats": {
                 "total_requests": 0,
                 "successful_actions": 0,
@@ -1152,15 +3252,97 @@ class MemoryManager:
             }
         }
     
-    def save_memory(self):
-        """Save memory to file"""
+    @staticmethod
+    def _apply(memory, record):
+        """Apply one journal record to a memory dict"""
+        op, args = record["op"], record.get("args", [])
+        if op == "conversation":
+            memory["conversation_history"].append(args[0])
+            if len(memory["conversation_history"]) > 50:
+                memory["conversation_history"] = memory["conversation_history"][-50:]
+        elif op == "stats":
+            memory["stats"]["total_requests"] += 1
+            memory["stats"]["successful_actions"] += args[0]
+            memory["stats"]["failed_actions"] += args[1]
+        elif op == "set":
+            memory[args[0]] = args[1]
+        elif op == "setting":
+            memory.setdefault("settings", {})[args[0]] = args[1]
+        elif op == "clear_history":
+            memory["conversation_history"] = []
+        elif op == "drop_oldest":
+            memory["conversation_history"] = memory["conversation_history"][args[0]:]
+        memory["user"]["last_seen"] = record.get("ts", memory["user"]["last_seen"])
+    
+    def _commit(self, op, *args):
+        """Apply a mutation now and queue it for the journal writer"""
+        with self._lock:
+            self._seq += 1
+            record = {"seq": self._seq, "ts": datetime.datetime.now().isoformat(), "op": op, "args": list(args)}
+            self._apply(self.memory, record)
+            self._pending.append(record)
+        self._wake.set()
+    
+    def _writer(self):
+        """Background writer: batch mutations for up to MEMORY_FLUSH_DELAY, then append them"""
+        while True:
+            self._wake.wait()
+            time.sleep(MEMORY_FLUSH_DELAY)
+            self._wake.clear()
+            self.flush()
+    
+    def flush(self):
+        """Append pending mutations to the journal (fsync) and compact when it grows"""
+        with self._io_lock:
+            with self._lock:
+                records, self._pending = self._pending, []
+            if records:
+                try:
+                    with open(self.journal_file, 'a', encoding='utf-8') as f:
+                        f.write(''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in records))
+                        f.flush()
+                        os.fsync(f.fileno())
+                    self._journal_records += len(records)
+                except Exception as e:
+                    with self._lock:
+                        self._pending[:0] = records
+                    print(f"{Fore.RED}❌ Memory journal write error: {e}{Style.RESET_ALL}")
+                    return
+            if self._journal_records >= MEMORY_COMPACT_RECORDS:
+                self._compact()
+    
+    def _compact(self):
+        """Write a fresh snapshot (atomic replace) and truncate the journal; caller holds _io_lock"""
         try:
-            self.memory["user"]["last_seen"] = datetime.datetime.now().isoformat()
-            with open(self.memory_file, 'w', encoding='utf-8') as f:
-                json.dump(self.memory, indent=2, fp=f)
+            with self._lock:
+                self.memory["user"]["last_seen"] = datetime.datetime.now().isoformat()
+                snapshot = dict(self.memory, journal_seq=self._seq)
+                data = json.dumps(snapshot, indent=2)
+            tmp_file = f"{self.memory_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.memory_file)
+            # Records up to journal_seq are in the snapshot; replay skips them if truncation is lost
+            open(self.journal_file, 'w').close()
+            self._journal_records = 0
         except Exception as e:
             print(f"{Fore.RED}❌ Memory save error: {e}{Style.RESET_ALL}")
     
+    def save_memory(self):
+        """Save memory to file (flush the journal and write a full snapshot now)"""
+        self.flush()
+        with self._io_lock:
+            self._compact()
+    
+    def close(self):
+        """Flush pending mutations on exit, folding the journal into the snapshot"""
+        self.flush()
+        if self._journal_records:
+            with self._io_lock:
+                self._compact()
+    
     def add_conversation(self, role, message):
         """Add conversation entry"""
         entry = {
@@ -1168,66 +3350,478 @@ class MemoryManager:
             "message": message[:500],
             "timestamp": datetime.datetime.now().isoformat()
         }
-        self.memory["conversation_history"].append(entry)
-        if len(self.memory["conversation_history"]) > 50:
-            self.memory["conversation_history"] = self.memory["conversation_history"][-50:]
-        self.save_memory()
+        self._commit("conversation", entry)
+    
+    def get_recent_history(self, count=5):
+        """Get recent conversation history"""
+        return self.memory["conversation_history"][-count:]
+    
+    def clear_history(self):
+        """Forget the conversation history"""
+        self._commit("clear_history")
+    
+    def history_size(self) -> int:
+        return len(self.memory["conversation_history"])
+    
+    def oldest_history(self, count):
+        """Oldest `count` history entries (oldest first)"""
+        return self.memory["conversation_history"][:count]
+    
+    def drop_oldest(self, count):
+        """Remove the oldest `count` entries (moved to the warm/cold tiers)"""
+        self._commit("drop_oldest", count)
+    
+    def update_stats(self, successful=0, failed=0):
+        """Update statistics"""
+        self._commit("stats", successful, failed)
+    
+    def set_mode(self, mode):
+        """Set current mode"""
+        self._commit("set", "mode", mode)
+    
+    def get_mode(self):
+        """Get current mode"""
+        return self.memory.get("mode", "normal")
+    
+    def set_thinking(self, enabled):
+        """Set thinking mode"""
+        self._commit("set", "thinking_enabled", enabled)
+    
+    def get_thinking(self):
+        """Get thinking mode"""
+        return self.memory.get("thinking_enabled", False)
+    
+    def set_offline_mode(self, enabled):
+        """Set offline mode"""
+        self._commit("set", "offline_mode", enabled)
+    
+    def get_offline_mode(self):
+        """Get offline mode status"""
+        return self.memory.get("offline_mode", False)
+    
+    def set_gui_enabled(self, enabled):
+        """Set GUI enabled"""
+        self._commit("set", "gui_enabled", enabled)
+    
+    def get_gui_enabled(self):
+        """Get GUI enabled status"""
+        return self.memory.get("gui_enabled", False)
+    
+    def set_research_enabled(self, enabled):
+        """Set research enabled"""
+        self._commit("set", "research_enabled", enabled)
+    
+    def get_research_enabled(self):
+        """Get research enabled status"""
+        return self.memory.get("research_enabled", False)
+    
+    def set_setting(self, key, value):
+        """Set a generic setting"""
+        self._commit("setting", key, value)
+    
+    def get_setting(self, key, default=None):
+        """Get a generic setting"""
+        return self.memory.get("settings", {}).get(key, default)
+
+
+class SQLiteMemoryManager:
+    """SQLite (WAL) memory store with unbounded, indexed history and FTS5 search"""
+    
+    FLAGS = ("mode", "thinking_enabled", "offline_mode", "gui_enabled", "research_enabled")
+    hot_capacity = MEMORY_DB_HOT_ENTRIES
+    
+    def __init__(self, db_file: str = MEMORY_DB_FILE):
+        import sqlite3
+        self.db_file = db_file
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.fts_enabled = False
+        self._inserts = 0
+        self._create_schema()
+        self.apply_retention()
+    
+    def _create_schema(self):
+        with self._lock, self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS conversations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    role TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    timestamp TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_conversations_timestamp ON conversations(timestamp);
+                CREATE INDEX IF NOT EXISTS idx_conversations_role ON conversations(role, timestamp);
+                CREATE TABLE IF NOT EXISTS stats (key TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0);
+                CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            """)
+            try:
+                self.conn.executescript("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts
+                        USING fts5(message, content='conversations', content_rowid='id');
+                    CREATE TRIGGER IF NOT EXISTS conversations_ai AFTER INSERT ON conversations BEGIN
+                        INSERT INTO conversations_fts(rowid, message) VALUES (new.id, new.message);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS conversations_ad AFTER DELETE ON conversations BEGIN
+                        INSERT INTO conversations_fts(conversations_fts, rowid, message) VALUES ('delete', old.id, old.message);
+                    END;
+                """)
+                self.fts_enabled = True
+            except Exception:
+                pass  # SQLite built without FTS5: search falls back to LIKE
+            
+            now = datetime.datetime.now().isoformat()
+            for key, value in (("user.name", "User"), ("user.first_seen", now), ("user.preferences", {})):
+                self.conn.execute("INSERT OR IGNORE INTO settings(key, value) VALUES (?, ?)", (key, json.dumps(value)))
+            for key in ("total_requests", "successful_actions", "failed_actions"):
+                self.conn.execute("INSERT OR IGNORE INTO stats(key, value) VALUES (?, 0)", (key,))
+    
+    def _put(self, key, value):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO settings(key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, json.dumps(value))
+            )
+    
+    def _get(self, key, default=None):
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+    
+    def apply_retention(self):
+        """Drop history older than MEMORY_RETENTION_DAYS and beyond MEMORY_RETENTION_MAX_ROWS"""
+        cutoff = (datetime.datetime.now() - datetime.timedelta(days=MEMORY_RETENTION_DAYS)).isoformat()
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM conversations WHERE timestamp < ?", (cutoff,))
+            self.conn.execute(
+                "DELETE FROM conversations WHERE id <= (SELECT id FROM conversations ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (MEMORY_RETENTION_MAX_ROWS,)
+            )
+    
+    @property
+    def memory(self):
+        """Dict view in the JSON manager's layout (user, history tail, flags, settings, stats)"""
+        with self._lock:
+            stats = dict(self.conn.execute("SELECT key, value FROM stats").fetchall())
+            settings = {key[len("settings."):]: json.loads(value) for key, value in
+                        self.conn.execute("SELECT key, value FROM settings WHERE key LIKE 'settings.%'")}
+        view = {
+            "user": {
+                "name": self._get("user.name", "User"),
+                "preferences": self._get("user.preferences", {}),
+                "first_seen": self._get("user.first_seen", ""),
+                "last_seen": self._get("user.last_seen", "")
+            },
+            "conversation_history": self.get_recent_history(50),
+            "settings": settings,
+            "stats": stats
+        }
+        for flag in self.FLAGS:
+            view[flag] = self._get(flag, "normal" if flag == "mode" else False)
+        return view
+    
+    def save_memory(self):
+        """Commit a WAL checkpoint (writes are already durable per transaction)"""
+        with self._lock:
+            self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+    
+    def add_conversation(self, role, message):
+        """Add conversation entry"""
+        timestamp = datetime.datetime.now().isoformat()
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO conversations(role, message, timestamp) VALUES (?, ?, ?)",
+                (role, message[:MEMORY_DB_MESSAGE_MAX], timestamp)
+            )
+        self._put("user.last_seen", timestamp)
+        self._inserts += 1
+        if self._inserts % 500 == 0:
+            self.apply_retention()
+    
+    def get_recent_history(self, count=5):
+        """Get recent conversation history (oldest first)"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT role, message, timestamp FROM conversations ORDER BY id DESC LIMIT ?", (count,)
+            ).fetchall()
+        return [{"role": r, "message": m, "timestamp": t} for r, m, t in reversed(rows)]
+    
+    def clear_history(self):
+        """Forget the conversation history"""
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM conversations")
+    
+    def history_size(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
     
-    def get_recent_history(self, count=5):
-        """Get recent conversation history"""
-        return self.memory["conversation_history"][-count:]
+    def oldest_history(self, count):
+        """Oldest `count` history entries (oldest first)"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT role, message, timestamp FROM conversations ORDER BY id LIMIT ?", (count,)
+            ).fetchall()
+        return [{"role": r, "message": m, "timestamp": t} for r, m, t in rows]
+    
+    def drop_oldest(self, count):
+        """Remove the oldest `count` entries (moved to the warm/cold tiers)"""
+        with self._lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM conversations WHERE id IN (SELECT id FROM conversations ORDER BY id LIMIT ?)", (count,)
+            )
+    
+    def search_memory(self, query, n_results=3):
+        """Full-text search over history (Chroma-style result layout)"""
+        with self._lock:
+            rows = []
+            if self.fts_enabled:
+                terms = ' OR '.join('"' + w.replace('"', '""') + '"' for w in query.split())
+                try:
+                    rows = self.conn.execute(
+                        "SELECT c.role, c.message, c.timestamp FROM conversations_fts f "
+                        "JOIN conversations c ON c.id = f.rowid WHERE conversations_fts MATCH ? "
+                        "ORDER BY bm25(conversations_fts) LIMIT ?", (terms, n_results)
+                    ).fetchall()
+                except Exception:
+                    rows = []
+            if not rows:
+                rows = self.conn.execute(
+                    "SELECT role, message, timestamp FROM conversations WHERE message LIKE ? ORDER BY id DESC LIMIT ?",
+                    (f"%{query}%", n_results)
+                ).fetchall()
+        if not rows:
+            return None
+        return {
+            "documents": [[m for _, m, _ in rows]],
+            "metadatas": [[{"role": r, "timestamp": t, "full_message": m} for r, m, t in rows]]
+        }
     
     def update_stats(self, successful=0, failed=0):
         """Update statistics"""
-        self.memory["stats"]["total_requests"] += 1
-        self.memory["stats"]["successful_actions"] += successful
-        self.memory["stats"]["failed_actions"] += failed
-        self.save_memory()
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "UPDATE stats SET value = value + ? WHERE key = ?",
+                [(1, "total_requests"), (successful, "successful_actions"), (failed, "failed_actions")]
+            )
     
     def set_mode(self, mode):
         """Set current mode"""
-        self.memory["mode"] = mode
-        self.save_memory()
+        self._put("mode", mode)
     
     def get_mode(self):
         """Get current mode"""
-        return self.memory.get("mode", "normal")
+        return self._get("mode", "normal")
     
     def set_thinking(self, enabled):
         """Set thinking mode"""
-        self.memory["thinking_enabled"] = enabled
-        self.save_memory()
+        self._put("thinking_enabled", enabled)
     
     def get_thinking(self):
         """Get thinking mode"""
-        return self.memory.get("thinking_enabled", False)
+        return self._get("thinking_enabled", False)
     
     def set_offline_mode(self, enabled):
         """Set offline mode"""
-        self.memory["offline_mode"] = enabled
-        self.save_memory()
+        self._put("offline_mode", enabled)
     
     def get_offline_mode(self):
         """Get offline mode status"""
-        return self.memory.get("offline_mode", False)
+        return self._get("offline_mode", False)
     
     def set_gui_enabled(self, enabled):
         """Set GUI enabled"""
-        self.memory["gui_enabled"] = enabled
-        self.save_memory()
+        self._put("gui_enabled", enabled)
     
     def get_gui_enabled(self):
         """Get GUI enabled status"""
-        return self.memory.get("gui_enabled", False)
+        return self._get("gui_enabled", False)
     
     def set_research_enabled(self, enabled):
         """Set research enabled"""
-        self.memory["research_enabled"] = enabled
-        self.save_memory()
+        self._put("research_enabled", enabled)
     
     def get_research_enabled(self):
         """Get research enabled status"""
-        return self.memory.get("research_enabled", False)
+        return self._get("research_enabled", False)
+    
+    def set_setting(self, key, value):
+        """Set a generic setting"""
+        self._put(f"settings.{key}", value)
+    
+    def get_setting(self, key, default=None):
+        """Get a generic setting"""
+        return self._get(f"settings.{key}", default)
+    
+    def migrate_from_json(self, json_manager=None) -> Dict:
+        """Copy history, stats, flags and settings from the JSON store (history is only copied into an empty table)"""
+        source = (json_manager or MemoryManager()).memory
+        copied = 0
+        with self._lock, self.conn:
+            if not self.conn.execute("SELECT 1 FROM conversations LIMIT 1").fetchone():
+                rows = [(m.get("role", "user"), str(m.get("message", "")), m.get("timestamp") or datetime.datetime.now().isoformat())
+                        for m in source.get("conversation_history", [])]
+                self.conn.executemany("INSERT INTO conversations(role, message, timestamp) VALUES (?, ?, ?)", rows)
+                copied = len(rows)
+            for key, value in source.get("stats", {}).items():
+                self.conn.execute(
+                    "INSERT INTO stats(key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                    (key, int(value))
+                )
+        for key, value in source.get("user", {}).items():
+            self._put(f"user.{key}", value)
+        for flag in self.FLAGS:
+            if flag in source:
+                self._put(flag, source[flag])
+        for key, value in source.get("settings", {}).items():
+            self.set_setting(key, value)
+        return {"conversations": copied, "settings": len(source.get("settings", {}))}
+
+
+def create_memory_store():
+    """JSON or SQLite store: ZAISHELL_MEMORY_BACKEND=json|sqlite, else SQLite once a database exists"""
+    backend = os.environ.get("ZAISHELL_MEMORY_BACKEND", "").lower()
+    if backend == "sqlite" or (backend != "json" and os.path.exists(MEMORY_DB_FILE)):
+        try:
+            return SQLiteMemoryManager()
+        except Exception as e:
+            print(f"{Fore.YELLOW}⚠️ SQLite memory error: {e}. Using JSON memory{Style.RESET_ALL}")
+    return MemoryManager()
+
+
+class MemoryTiers:
+    """Tiered memory: hot raw turns in the store, warm session summaries, cold gzip archive"""
+    
+    def __init__(self, memory, archive_file=MEMORY_ARCHIVE_FILE):
+        self.memory = memory
+        self.store = getattr(memory, 'json_manager', memory)
+        self.archive_file = archive_file
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self.compactions = 0
+        self.archived = 0
+        threading.Thread(target=self._compactor, daemon=True).start()
+    
+    def summaries(self) -> List[Dict]:
+        """Warm tier, oldest first"""
+        return self.store.get_setting("memory_summaries", []) or []
+    
+    def notify(self):
+        """A turn was added; let the compactor check the thresholds"""
+        if self.store.history_size() > self.store.hot_capacity:
+            self._wake.set()
+    
+    def _compactor(self):
+        while True:
+            self._wake.wait(MEMORY_COMPACT_INTERVAL)
+            self._wake.clear()
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"{Fore.YELLOW}⚠️ Memory compaction error: {e}{Style.RESET_ALL}")
+    
+    def _due(self) -> List[Dict]:
+        """Oldest hot entries that are over the size limit or the age limit"""
+        size = self.store.history_size()
+        movable = min(MEMORY_COMPACT_BATCH, size - MEMORY_HOT_MIN_ENTRIES)
+        if movable <= 0:
+            return []
+        batch = self.store.oldest_history(movable)
+        over = size - self.store.hot_capacity // 2 if size > self.store.hot_capacity else 0
+        cutoff = (datetime.datetime.now() - datetime.timedelta(days=MEMORY_HOT_MAX_AGE_DAYS)).isoformat()
+        aged = 0
+        while aged < len(batch) and batch[aged].get("timestamp", "") < cutoff:
+            aged += 1
+        return batch[:max(min(over, movable), aged)]
+    
+    def compact(self) -> int:
+        """Move due hot turns to a warm summary and the cold archive; returns turns moved"""
+        moved = 0
+        with self._lock:
+            while True:
+                batch = self._due()
+                if not batch:
+                    break
+                # Archive before dropping: a crash in between duplicates turns in the archive, never loses them
+                self._archive(batch)
+                warm = self.summaries() + [self._summarize(batch)]
+                if len(warm) > MEMORY_WARM_MAX_SUMMARIES:
+                    overflow = warm[:-MEMORY_WARM_MAX_SUMMARIES]
+                    self._archive([{"role": "summary", "message": s["summary"], "timestamp": s["to"]} for s in overflow])
+                    warm = warm[-MEMORY_WARM_MAX_SUMMARIES:]
+                self.store.set_setting("memory_summaries", warm)
+                self.store.drop_oldest(len(batch))
+                moved += len(batch)
+            if moved:
+                self.compactions += 1
+            if hasattr(self.memory, 'prune'):
+                self.memory.prune(MEMORY_SEMANTIC_MAX_ENTRIES)
+        return moved
+    
+    @staticmethod
+    def _summarize(entries) -> Dict:
+        """Extractive session summary: each request with the start of the reply that followed"""
+        items = []
+        for i, entry in enumerate(entries):
+            if entry.get("role") != "user":
+                continue
+            item = ' '.join(str(entry.get("message", "")).split())[:MEMORY_SUMMARY_ITEM_CHARS]
+            reply = entries[i + 1] if i + 1 < len(entries) and entries[i + 1].get("role") != "user" else None
+            if reply:
+                item += f" → {' '.join(str(reply.get('message', '')).split())[:MEMORY_SUMMARY_ITEM_CHARS // 2]}"
+            items.append(item)
+        summary = "; ".join(items) or ' '.join(str(entries[-1].get("message", "")).split())
+        if len(summary) > MEMORY_SUMMARY_CHARS:
+            summary = summary[:MEMORY_SUMMARY_CHARS - 3] + "..."
+        return {
+            "from": entries[0].get("timestamp", ""),
+            "to": entries[-1].get("timestamp", ""),
+            "turns": len(entries),
+            "summary": summary
+        }
+    
+    def clear(self):
+        """Drop the warm summaries and delete the cold archive"""
+        with self._lock:
+            self.store.set_setting("memory_summaries", [])
+            if os.path.exists(self.archive_file):
+                os.remove(self.archive_file)
+    
+    def _archive(self, entries):
+        """Append entries to the cold tier (gzip members appended to one file)"""
+        with gzip.open(self.archive_file, 'at', encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.archived += len(entries)
+    
+    def search_archive(self, query, limit=5) -> List[Dict]:
+        """Newest archived entries whose message contains every query word (linear scan of the cold tier)"""
+        words = query.lower().split()
+        if not words or not os.path.exists(self.archive_file):
+            return []
+        matches = deque(maxlen=limit)
+        with gzip.open(self.archive_file, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if not all(w in line.lower() for w in words):
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                message = str(entry.get("message", "")).lower()
+                if all(w in message for w in words):
+                    matches.append(entry)
+        return list(reversed(matches))
+    
+    def get_stats(self) -> Dict:
+        return {
+            "hot": self.store.history_size(),
+            "hot_capacity": self.store.hot_capacity,
+            "warm": len(self.summaries()),
+            "cold_kb": round(os.path.getsize(self.archive_file) / 1024, 1) if os.path.exists(self.archive_file) else 0,
+            "archived": self.archived,
+            "compactions": self.compactions
+        }
 
 
 class OfflineModelManager:
@@ -1403,12 +3997,14 @@ class ModeManager:
         "normal": {
             "model": "gemini-3-flash",
             "temperature": 0.7,
+            "context_tokens": 600,
             "description": "Standard mode - Balanced performance",
             "instruction_modifier": ""
         },
         "eco": {
             "model": "gemini-3-flash",
             "temperature": 0.3,
+            "context_tokens": 150,
             "max_output_tokens": 2048,
             "top_p": 0.8,
             "top_k": 20,
@@ -1426,6 +4022,7 @@ class ModeManager:
         "lightning": {
             "model": "gemini-3-flash",
             "temperature": 0.0,
+            "context_tokens": 60,
             "max_output_tokens": 2048,
             "top_p": 0.9,
             "top_k": 1,
@@ -1458,6 +4055,25 @@ class ModeManager:
         return list(ModeManager.MODES.keys())
 
 
+class DeferredModel:
+    """GenerativeModel built on first use, so startup does not import the Gemini SDK"""
+    
+    def __init__(self, *args, **kwargs):
+        self._args = args
+        self._kwargs = kwargs
+        self._model = None
+        self._lock = threading.Lock()
+    
+    def __getattr__(self, attr):
+        if attr.startswith('__') or attr in ('_args', '_kwargs', '_model', '_lock'):
+            raise AttributeError(attr)
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = genai.GenerativeModel(*self._args, **self._kwargs)
+        return getattr(self._model, attr)
+
+
 class AIBrain:
     """AI Brain - COMPLETELY FREE, no restrictions"""
     
@@ -1476,11 +4092,31 @@ class AIBrain:
             self.offline_model = OfflineModelManager()
             self.offline_model.load_model()
         
+        self.response_cache = ResponseCache()
+        self.fix_store = FixStore()
+        self.prompt_prefixes = PromptPrefixCache()
+        RATE_LIMITER.configure(self.memory.get_setting("rate_limit_rpm", RATE_LIMIT_RPM),
+                               self.memory.get_setting("rate_limit_tpm", RATE_LIMIT_TPM))
+        RATE_LIMITER.enabled = self.memory.get_setting("rate_limit_enabled", True)
         self.model = self._create_model()
         self.tools = AITools()
+        self.tools.shell_pool.enabled = self.memory.get_setting("shell_pool_enabled", True)
+        self.tools.shell_pool.keep_state = self.memory.get_setting("shell_keep_state", False)
+        self.tools.output_listener = self._echo_command_output
+        self.tools.max_concurrency = self.memory.get_setting("action_concurrency", ACTION_CONCURRENCY)
+        self.live_output = self.memory.get_setting("live_output", True)
+        self._echo_started = False
         self.context = self._build_context()
+        self.tools.system_sampler.start()
         self.max_retries = 5
         self.temp_mode = None
+        self.streaming_enabled = self.memory.get_setting("streaming_enabled", False)
+        self.racing_enabled = self.memory.get_setting("racing_enabled", True)
+        self.intent_classifier = IntentClassifier(threshold=self.memory.get_setting("intent_threshold", INTENT_CONFIDENCE_THRESHOLD))
+        self.intent_classifier.learn_from_history(self.memory.get_recent_history(50))
+        self.context_assembler = ContextAssembler(self.memory)
+        self.first_output_at = None
+        self._final_response_streamed = False
         
         self._task_context = TaskContext()
         self._web_research = None
@@ -1501,6 +4137,7 @@ class AIBrain:
         if self._web_research is None:
             self._web_research = WebResearchEngine()
             self._web_research.set_ai_model(self.model)
+            self._web_research.set_response_cache(self.response_cache)
         return self._web_research
     
     @property
@@ -1527,14 +4164,36 @@ class AIBrain:
         return self._p2p_sharing
     
     def detect_intent(self, user_message: str) -> Dict:
-        """Detect user intent - optimized: skips AI if features disabled"""
+        """Detect user intent locally.
+        
+        Image paths are matched by regex and clear research/GUI/terminal requests are
+        settled by the offline IntentClassifier. Ambiguous inputs are left to the main
+        planning call, which reports intent flags itself (see needs_intent_flags).
+        """
+        intents = self._base_intents(user_message)
+        
+        if not intents['needs_image_analysis'] and self.needs_intent_flags():
+            label, confidence, source = self.intent_classifier.classify(user_message)
+            self.intent_classifier.record_decision(source if label else None)
+            if label:
+                intents['resolved_locally'] = True
+                self._apply_intent_flags(intents, {
+                    'needs_research': label == 'research',
+                    'needs_gui': label == 'gui'
+                }, user_message)
+        
+        return intents
+    
+    def _base_intents(self, user_message: str) -> Dict:
+        """Intent dict with the regex-only image path check"""
         intents = {
             'needs_research': False,
             'needs_image_analysis': False,
             'needs_gui': False,
             'needs_hybrid': False,
             'image_path': None,
-            'research_query': None
+            'research_query': None,
+            'resolved_locally': False
         }
         
 
@@ -1546,40 +4205,25 @@ class AIBrain:
                 intents['image_path'] = match.group(0)
                 break
         
-
-        if self.offline_mode or not self.model:
-            return intents
-        
-
-        if not self.gui_enabled and not self.research_enabled:
+        return intents
+    
+    def needs_intent_flags(self) -> bool:
+        """Whether the planning call should also classify research/GUI intent"""
+        return not self.offline_mode and self.model is not None and (self.gui_enabled or self.research_enabled)
+    
+    def _apply_intent_flags(self, intents: Dict, flags: Dict, user_message: str) -> Dict:
+        """Merge model-reported intent flags, only for enabled features"""
+        if not isinstance(flags, dict):
             return intents
-        
-        try:
-            # Simplified prompt based on enabled features
-            intent_prompt = f"""Analyze: "{user_message}"
-Return JSON: {{"needs_research": bool, "needs_gui": bool, "needs_hybrid": bool}}
-Rules: needs_research=user asks current info/versions; needs_gui=clicking UI; needs_hybrid=both terminal+GUI"""
-            
-            response = self.model.generate_content(intent_prompt)
-            text = response.text
-            
-            start = text.find('{')
-            end = text.rfind('}') + 1
-            if start >= 0 and end > start:
-                result = json.loads(text[start:end])
-                # Only set if feature is enabled
-                if self.research_enabled:
-                    intents['needs_research'] = result.get('needs_research', False)
-                    if intents['needs_research']:
-                        intents['research_query'] = user_message
-                if self.gui_enabled:
-                    intents['needs_gui'] = result.get('needs_gui', False)
-                    intents['needs_hybrid'] = result.get('needs_hybrid', False)
-                    if intents['needs_hybrid']:
-                        intents['needs_gui'] = True
-        except Exception:
-            pass
-        
+        if self.research_enabled:
+            intents['needs_research'] = bool(flags.get('needs_research', False))
+            if intents['needs_research']:
+                intents['research_query'] = user_message
+        if self.gui_enabled:
+            intents['needs_gui'] = bool(flags.get('needs_gui', False))
+            intents['needs_hybrid'] = bool(flags.get('needs_hybrid', False))
+            if intents['needs_hybrid']:
+                intents['needs_gui'] = True
         return intents
     
     def generate_hybrid_plan(self, user_request: str) -> Optional[Dict]:
@@ -1611,8 +4255,7 @@ If the task can be done entirely with terminal, set needs_gui to false.
 Only include GUI steps if clicking/typing in a GUI application is truly needed."""
 
         try:
-            response = self.model.generate_content(plan_prompt)
-            text = response.text
+            text = self._generate_text(plan_prompt, site="AIBrain.generate_hybrid_plan")
             
             start = text.find('{')
             if start >= 0:
@@ -1739,7 +4382,8 @@ Only include GUI steps if clicking/typing in a GUI application is truly needed."
             try:
                 failed_steps = [s for s, r in zip(plan['steps'], results) if not r.get('success')]
                 recovery_prompt = f"These GUI/terminal steps failed: {json.dumps(failed_steps, ensure_ascii=False)}. Suggest alternative approach in 1 sentence."
-                recovery = self.model.generate_content(recovery_prompt)
+                with RATE_LIMITER.priority(RATE_PRIORITY_OPTIONAL):
+                    recovery = self.model.generate_content(recovery_prompt)
                 print(f"{Fore.CYAN}AI Suggestion: {recovery.text[:200]}{Style.RESET_ALL}")
             except:
                 pass
@@ -1766,10 +4410,118 @@ Only include GUI steps if clicking/typing in a GUI application is truly needed."
         if self.current_mode == "lightning":
             temperature = 0.0
         
-        return genai.GenerativeModel(
+        return MeteredModel(DeferredModel(
             mode_config["model"],
             generation_config={"temperature": temperature}
-        )
+        ), mode=self._get_active_mode)
+    
+    def _generate_text(self, prompt, site, cacheable=True, max_temperature=RESPONSE_CACHE_MAX_TEMPERATURE):
+        """Call the model through the response cache; site labels the call in the ledger"""
+        cacheable = cacheable and self.response_cache.is_cacheable(self.model, prompt, max_temperature)
+        if cacheable:
+            cached = self.response_cache.get(self.model, prompt)
+            if cached is not None:
+                return cached
+        
+        with LLM_LEDGER.call_site(site):
+            text = self.model.generate_content(prompt).text
+        if cacheable:
+            self.response_cache.put(self.model, prompt, text)
+        return text
+    
+    def _send_plan(self, prefix, suffix, stream=False):
+        """Send the plan prompt, static prefix first so backends with implicit prefix caching can reuse it.
+        
+        Returns the response text, or a chunk iterator when streaming.
+        """
+        with RATE_LIMITER.priority(RATE_PRIORITY_PLAN):
+            if stream:
+                return iter(self.model.generate_content(prefix + suffix, stream=True))
+            return self.model.generate_content(prefix + suffix).text
+    
+    def _mark_first_output(self):
+        """Record time-to-first-output for the current request"""
+        if self.first_output_at is None:
+            self.first_output_at = time.time()
+    
+    def _echo_command_output(self, text: str):
+        """Live echo of command output (and to the helper when sharing)"""
+        if self._p2p_sharing and self._p2p_sharing.is_connected:
+            self._p2p_sharing.broadcast_output(text)
+        if not self.live_output:
+            return
+        if not self._echo_started:
+            self._echo_started = True
+            print()
+        print(f"{Style.DIM}{text}{Style.RESET_ALL}", end='', flush=True)
+    
+    @staticmethod
+    def _chunk_text(chunk) -> str:
+        """Text of a streamed chunk (empty for finish-only chunks)"""
+        try:
+            return chunk.text
+        except Exception:
+            return ""
+    
+    def _stream_plan(self, prompt, cacheable=True, chunks=None) -> StreamingPlanParser:
+        """Stream a plan, echoing tokens, and return as soon as its actions array closes.
+        
+        The rest of the stream (the "response" field) is drained in the background.
+        """
+        cacheable = cacheable and self.response_cache.is_cacheable(self.model, prompt)
+        parser = StreamingPlanParser()
+        if chunks is None:
+            chunks = iter(self.model.generate_content(prompt, stream=True))
+        
+        def _drain():
+            try:
+                for chunk in chunks:
+                    parser.feed(self._chunk_text(chunk))
+                if cacheable and parser.result(timeout=0) is not None:
+                    self.response_cache.put(self.model, prompt, parser.text)
+            except Exception:
+                pass
+            finally:
+                parser.finish()
+        
+        print(f"\n{Style.DIM}", end='')
+        for chunk in chunks:
+            text = self._chunk_text(chunk)
+            if text:
+                self._mark_first_output()
+                print(text, end='', flush=True)
+            if parser.feed(text):
+                break
+        print(Style.RESET_ALL)
+        
+        threading.Thread(target=_drain, daemon=True).start()
+        return parser
+    
+    def _stream_text(self, prompt, site, prefix="") -> str:
+        """Stream a natural-language response to the console and return it; site labels the call in the ledger"""
+        cacheable = self.response_cache.is_cacheable(self.model, prompt)
+        cached = self.response_cache.get(self.model, prompt) if cacheable else None
+        if cached is not None:
+            self._mark_first_output()
+            print(f"{prefix}{cached.strip()}{Style.RESET_ALL}")
+            return cached.strip()
+        
+        parts = []
+        with LLM_LEDGER.call_site(site):
+            chunks = self.model.generate_content(prompt, stream=True)
+        print(prefix, end='', flush=True)
+        for chunk in chunks:
+            text = self._chunk_text(chunk)
+            if text:
+                self._mark_first_output()
+                print(text, end='', flush=True)
+                parts.append(text)
+        print(Style.RESET_ALL)
+        
+        text = "".join(parts)
+        if cacheable:
+            self.response_cache.put(self.model, prompt, text)
+        return text.strip()
     
     def switch_to_offline(self):
         """Switch to offline mode"""
@@ -1824,6 +4576,8 @@ Only include GUI steps if clicking/typing in a GUI application is truly needed."
     
     def _build_context(self):
         """Build system context"""
+        with STARTUP_PROFILER.phase("shell detection"):
+            shells = self._detect_shells()
         try:
             import psutil
             ctx = {
@@ -1837,7 +4591,7 @@ Only include GUI steps if clicking/typing in a GUI application is truly needed."
                 "cpu_cores": psutil.cpu_count(),
                 "memory_gb": round(psutil.virtual_memory().total / (1024**3), 2),
                 "username": os.getenv('USERNAME') or os.getenv('USER') or 'User',
-                "available_shells": self._detect_shells()
+                "available_shells": shells
             }
         except:
             ctx = {
@@ -1847,83 +4601,32 @@ Only include GUI steps if clicking/typing in a GUI application is truly needed."
                 "desktop": os.path.join(os.path.expanduser('~'), 'Desktop'),
                 "documents": os.path.join(os.path.expanduser('~'), 'Documents'),
                 "username": os.getenv('USERNAME') or os.getenv('USER') or 'User',
-                "available_shells": self._detect_shells()
+                "available_shells": shells
             }
         return ctx
     
     def _detect_shells(self):
-        """Detect available shells on system"""
-        shells = []
-        
-        if os.name == 'nt':  # Windows
-            # Core shells
-            shells.extend(['cmd', 'powershell'])
-            
-            # Check PowerShell Core
-            if subprocess.run(['where', 'pwsh'], capture_output=True, shell=True).returncode == 0:
-                shells.append('pwsh')
-            
-            # Check Git Bash - use global constant
-            for path in GIT_BASH_PATHS:
-                if os.path.exists(path):
-                    shells.append('git-bash')
-                    break
-            
-            # Check WSL (Windows Subsystem for Linux)
-            if subprocess.run(['where', 'wsl'], capture_output=True, shell=True).returncode == 0:
-                shells.append('wsl')
-            
-            # Check Cygwin - use global constant
-            if any(os.path.exists(p) for p in CYGWIN_PATHS):
-                shells.append('cygwin')
-        
-        else:  # Linux/Mac
-            # Core shells
-            shells.extend(['bash', 'sh'])
-            
-            # Check additional shells
-            shells_to_check = ['zsh', 'fish', 'ksh', 'tcsh', 'dash']
-            for shell in shells_to_check:
-                try:
-                    if subprocess.run(['which', shell], capture_output=True, shell=True).returncode == 0:
-                        shells.append(shell)
-                except:
-                    pass
-        
-        return shells
+        """Detect available shells on system (see ShellRegistry)"""
+        return self.tools.shells.discover()
     
-    def think_and_act(self, user_message, retry_context=None, force_execute=False, safe_mode=False, show_only=False, retry_count=0):
-        """Main thinking and action engine"""
+    def think_and_act(self, user_message, force_execute=False, safe_mode=False, show_only=False, detect_intents=False):
+        """Main thinking and action engine.
         
-        if self.temp_mode and not retry_context:
-            self.temp_mode = None
+        With detect_intents, the plan also carries research/GUI intent flags; if one is
+        set, nothing is executed and {"deferred": True, "intents": ...} is returned so
+        the shell can dispatch to the right branch.
+        """
+        detect_intents = detect_intents and self.needs_intent_flags()
         
-        if retry_context is None:
-            self.memory.add_conversation("user", user_message)
+        if self.temp_mode:
+            self.temp_mode = None
         
-        if retry_context:
-            retry_prompt = f"""
-⚠️ ERROR IN PREVIOUS ATTEMPT - REPLANNING REQUIRED
-
-User Request: {user_message}
-
-Failed Action:
-- Type: {retry_context['action_type']}
-- Description: {retry_context['description']}
-- Shell: {retry_context.get('shell', 'Not specified')}
-- Error Message: {retry_context['error']}
-- Attempt: {retry_context['retry_count']}/{self.max_retries}
-
-🔧 YOUR TASK NOW:
-1. ANALYZE ERROR IN DETAIL
-2. FIND A COMPLETELY DIFFERENT METHOD
-3. CREATE NEW PLAN
-
-REMEMBER: System has {len(self.context['available_shells'])} different shells: {', '.join(self.context['available_shells'])}
-"""
-            system_instruction = self._build_system_instruction(retry_prompt, safe_mode)
-        else:
-            system_instruction = self._build_system_instruction(user_message, safe_mode)
+        self.memory.add_conversation("user", user_message)
+        retry_state = RetryState(user_message, self.max_retries)
+        LLM_LEDGER.retry_index = 0
+        prefix, suffix = self._build_prompt_parts(user_message, safe_mode, include_intent=detect_intents)
+        system_instruction = prefix + suffix
+        retry_state.charge(system_instruction)
 
         try:
             if self.offline_mode:
@@ -1941,22 +4644,34 @@ REMEMBER: System has {len(self.context['available_shells'])} different shells: {
                     temperature=mode_temperature
                 )
             else:
-                response = self.model.generate_content(system_instruction)
-                response_text = response.text
-            
-            return self._process_ai_response(response_text, user_message, retry_count=retry_count, force_execute=force_execute, safe_mode=safe_mode, show_only=show_only)
+                # Live load figures change on every request, so they are left out of the plan cache key
+                cache_text = self._plan_cache_text(prefix, suffix)
+                cacheable = self.response_cache.is_cacheable(self.model, cache_text)
+                response_text = self.response_cache.get(self.model, cache_text) if cacheable else None
+                
+                if response_text is None and self.streaming_enabled:
+                    stream_plan = self._stream_plan(cache_text, cacheable=cacheable, chunks=self._send_plan(prefix, suffix, stream=True))
+                    if stream_plan.actions is not None:
+                        retry_state.charge(stream_plan.text)
+                        return self._process_ai_response(stream_plan.text, user_message, force_execute=force_execute, safe_mode=safe_mode, show_only=show_only, stream_plan=stream_plan, detect_intents=detect_intents, retry_state=retry_state)
+                    # No actions array in the stream: handle the complete text as usual
+                    stream_plan.done.wait()
+                    response_text = stream_plan.text
+                elif response_text is None:
+                    response_text = self._send_plan(prefix, suffix)
+                    if cacheable:
+                        self.response_cache.put(self.model, cache_text, response_text)
+            
+            retry_state.charge(response_text)
+            return self._process_ai_response(response_text, user_message, force_execute=force_execute, safe_mode=safe_mode, show_only=show_only, detect_intents=detect_intents, retry_state=retry_state)
             
         except Exception as e:
             return self._handle_error(e, user_message)
     
-    def _build_system_instruction(self, main_content, safe_mode=False):
-        """Build system instruction"""
-        
-        
-        if self.offline_mode:
-            
-            if self.thinking_enabled:
-                return f"""You are a command line tool.
+    def _build_offline_prompt(self, main_content):
+        """Few-shot prompt for the local model"""
+        if self.thinking_enabled:
+            return f"""You are a command line tool.
 First, analyze the user request inside <thinking> tags.
 Then, output valid JSON for the action.
 
@@ -1973,8 +4688,8 @@ I will use the 'dir' command for Windows.
 Current Task:
 User: {main_content}
 Output:"""
-            
-            return f"""You are a command line tool. Output valid JSON only.
+        
+        return f"""You are a command line tool. Output valid JSON only.
 
 Example 1:
 User: list files
@@ -1987,8 +4702,9 @@ JSON: {{"understanding": "create file", "actions": [{{"type": "file", "descripti
 Current Task:
 User: {main_content}
 JSON:"""
-        
-        active_mode = self._get_active_mode()
+    
+    def _build_static_prefix(self, active_mode, safe_mode=False, include_intent=False):
+        """Request-independent part of the prompt: mode, safety, system info, capabilities, schema"""
         mode_config = ModeManager.get_mode_config(active_mode)
         mode_modifier = mode_config["instruction_modifier"]
         
@@ -2023,10 +4739,22 @@ Before creating your JSON response, you MUST perform detailed analysis inside <t
 </thinking>
 """
         
-        recent_history = self.memory.get_recent_history()
-        history_text = self._format_history(recent_history)
-        
-
+        intent_instruction = ""
+        intent_field = ""
+        if include_intent:
+            flag_rules = []
+            if self.research_enabled:
+                flag_rules.append("- needs_research: user asks for current info/versions that need a web search")
+            if self.gui_enabled:
+                flag_rules.append("- needs_gui: task requires clicking/typing in a GUI application")
+                flag_rules.append("- needs_hybrid: task needs both terminal and GUI steps")
+            intent_instruction = f"""
+🧭 INTENT FLAGS (fill the "intent" field):
+{chr(10).join(flag_rules)}
+If any flag is true, return an EMPTY "actions" list - the task will be re-planned with the right tools.
+"""
+            intent_field = """
+    "intent": {"needs_research": false, "needs_gui": false, "needs_hybrid": false},"""
         
         return f"""You are ZAI, a COMPLETELY FREE artificial intelligence assistant.
 
@@ -2043,29 +4771,32 @@ Before creating your JSON response, you MUST perform detailed analysis inside <t
 - Operating System: {self.context['os']}
 - OS Version: {self.context.get('os_version', 'N/A')}
 - Python: {self.context['python']}
-- Available Shells: {', '.join(self.context['available_shells'])}
+- Available Shells: {', '.join(self.tools.shells.describe())}
 - User: {self.context['username']}
-- Working Directory: {self.context['cwd']}
 - Desktop: {self.context['desktop']}
 - Documents: {self.context['documents']}
 
 {thinking_instruction}
-
+{intent_instruction}
 💪 YOUR CAPABILITIES:
 1. FILE/DIRECTORY OPERATIONS
 2. SYSTEM COMMANDS - FULL SHELL FREEDOM
 3. CODE WRITING
 4. INFORMATION GATHERING
-5. MULTI-TASKING
+5. MULTI-TASKING (independent actions run in parallel; set "parallel": false on an action that must not)
+   "id"/"depends_on" are optional. Use them only for plans with independent branches: list in
+   depends_on the ids an action needs first; actions without depends_on then start immediately.
 
 ═══════════════════════════════════════════════════════════════
 📋 RESPONSE FORMAT (JSON):
 ═══════════════════════════════════════════════════════════════
 
 {{
-    "understanding": "User's request in ONE SENTENCE",
+    "understanding": "User's request in ONE SENTENCE",{intent_field}
     "actions": [
         {{
+            "id": "a1",
+            "depends_on": [],
             "type": "file|command|code|info|multi",
             "description": "What will be done",
             "details": {{
@@ -2080,6 +4811,29 @@ Before creating your JSON response, you MUST perform detailed analysis inside <t
     ],
     "response": "Natural language response to user"
 }}
+"""
+    
+    def _build_prompt_parts(self, main_content, safe_mode=False, include_intent=False):
+        """(static prefix, dynamic suffix); each prefix is built once per system/shells/mode/safe/thinking/intent combination"""
+        if self.offline_mode:
+            return "", self._build_offline_prompt(main_content)
+        
+        active_mode = self._get_active_mode()
+        # System info and discovered shells are part of the prefix text, so they are part of its key too
+        environment = json.dumps([self.context, self.tools.shells.describe()], sort_keys=True, default=str)
+        key = (f"v{PROMPT_PREFIX_VERSION}-{hashlib.sha1(environment.encode('utf-8')).hexdigest()[:12]}-{active_mode}-"
+               f"{'safe' if safe_mode else 'free'}-{'think' if self.thinking_enabled else 'plain'}")
+        if include_intent:
+            key += f"-intent{int(self.research_enabled)}{int(self.gui_enabled)}"
+        prefix = self.prompt_prefixes.get(key, lambda: self._build_static_prefix(active_mode, safe_mode, include_intent))
+        
+        history_text = self.context_assembler.assemble(main_content, ModeManager.get_mode_config(active_mode).get("context_tokens", 600))
+        suffix = f"""
+═══════════════════════════════════════════════════════════════
+🕒 RUNTIME:
+═══════════════════════════════════════════════════════════════
+- Working Directory: {self.tools.working_directory()}
+- System Load: {self.tools.system_sampler.summary()}
 
 ═══════════════════════════════════════════════════════════════
 📚 CONVERSATION HISTORY:
@@ -2092,23 +4846,18 @@ Before creating your JSON response, you MUST perform detailed analysis inside <t
 {main_content}
 
 START!"""
+        return prefix, suffix
     
-    def _format_history(self, history):
-        """Format conversation history"""
-        if not history:
-            return "First conversation"
-        
-        formatted = []
-        for msg in history:
-            role = "👤 User" if msg['role'] == 'user' else "🤖 ZAI"
-            formatted.append(f"{role}: {msg['message'][:100]}...")
-        
-        return "\n".join(formatted)
+    @staticmethod
+    def _plan_cache_text(prefix, suffix):
+        """Response cache key for a plan: the full prompt minus the System Load line (cwd, history and task stay in)"""
+        return prefix + re.sub(r'^- System Load: .*\n', '', suffix, count=1, flags=re.MULTILINE)
     
-    def _process_ai_response(self, ai_text, original_request, retry_count=0, force_execute=False, safe_mode=False, show_only=False):
+    def _process_ai_response(self, ai_text, original_request, force_execute=False, safe_mode=False, show_only=False, stream_plan=None, detect_intents=False, retry_state=None):
         """Process AI response and execute actions"""
         try:
-            if "<thinking>" in ai_text and "</thinking>" in ai_text:
+            # A streamed plan has already echoed its thinking block
+            if not stream_plan and "<thinking>" in ai_text and "</thinking>" in ai_text:
                 thinking_start = ai_text.find("<thinking>") + 10
                 thinking_end = ai_text.find("</thinking>")
                 thinking_content = ai_text[thinking_start:thinking_end].strip()
@@ -2119,18 +4868,33 @@ START!"""
             json_start = ai_text.find('{')
             json_end = ai_text.rfind('}') + 1
             
-            if json_start >= 0 and json_end > json_start:
-                json_str = ai_text[json_start:json_end]
-                ai_plan = json.loads(json_str)
+            if stream_plan or (json_start >= 0 and json_end > json_start):
+                if stream_plan:
+                    # Actions are ready; the "response" field may still be streaming in
+                    ai_plan = {"understanding": stream_plan.understanding or 'Analyzing...', "actions": stream_plan.actions}
+                    if detect_intents:
+                        intent = stream_plan.intent if stream_plan.intent is not None else (stream_plan.result() or {}).get('intent', {})
+                        ai_plan['intent'] = intent
+                else:
+                    json_str = ai_text[json_start:json_end]
+                    ai_plan = json.loads(json_str)
                 
-                if retry_count == 0:
-                    understanding = ai_plan.get('understanding', 'Analyzing...')
-                    print(f"\n{Fore.CYAN}💭 Understanding: {understanding}{Style.RESET_ALL}")
+                if detect_intents:
+                    intents = self._apply_intent_flags(self._base_intents(original_request), ai_plan.get('intent', {}), original_request)
+                    label = "research" if intents['needs_research'] else "gui" if intents['needs_gui'] else "terminal"
+                    self.intent_classifier.observe(original_request, label)
+                    if intents['needs_research'] or intents['needs_gui']:
+                        return {"success": True, "deferred": True, "intents": intents}
+                
+                understanding = ai_plan.get('understanding', 'Analyzing...')
+                print(f"\n{Fore.CYAN}💭 Understanding: {understanding}{Style.RESET_ALL}")
                 
                 actions = ai_plan.get('actions', [])
                 
                 # --show mode: Display actions but don't execute
                 if show_only:
+                    if stream_plan:
+                        ai_plan = stream_plan.result() or ai_plan
                     self._show_actions_preview(actions, ai_plan.get('response', ''))
                     return {"success": True, "message": "Preview only - no actions executed"}
                 
@@ -2150,30 +4914,13 @@ START!"""
                 results = []
                 
                 if actions:
-                    print(f"{Fore.YELLOW}⚡ Executing {len(actions)} action(s)...{Style.RESET_ALL}\n")
-                    
-                    for i, action in enumerate(actions, 1):
-                        result = self._execute_action(action, i, len(actions))
-                        results.append(result)
-                        
-                        if not result.get('success') and retry_count < self.max_retries:
-                            print(f"\n{Fore.YELLOW}🔧 Error detected, trying alternative method ({retry_count + 1}/{self.max_retries})...{Style.RESET_ALL}")
-                            
-                            retry_context = {
-                                'action_type': action.get('type', 'unknown'),
-                                'description': action.get('description', 'Action'),
-                                'shell': action.get('details', {}).get('shell', 'Not specified'),
-                                'error': result.get('error', 'Unknown error'),
-                                'retry_count': retry_count + 1
-                            }
-                            
-                            return self.think_and_act(original_request, retry_context, force_execute, safe_mode, show_only, retry_count=retry_count + 1)
-                        
-                        elif not result.get('success') and retry_count >= self.max_retries:
-                            print(f"\n{Fore.RED}❌ Max retry limit ({self.max_retries}) reached. Stopping.{Style.RESET_ALL}")
-                            break
-                        
-                        time.sleep(0.1)
+                    retry_state = retry_state or RetryState(original_request, self.max_retries)
+                    retry_state.start()
+                    graph = self._plan_graph(actions)
+                    if graph:
+                        results = self._run_action_graph(actions, graph, retry_state, force_execute=force_execute, safe_mode=safe_mode)
+                    else:
+                        results = self._run_actions(actions, retry_state, force_execute=force_execute, safe_mode=safe_mode)
                 
                 success_count = sum(1 for r in results if r.get('success'))
                 fail_count = len(results) - success_count
@@ -2186,9 +4933,12 @@ START!"""
                 
                 if needs_final_response:
                     final_response = self._generate_final_response(original_request, results)
-                    print(f"\n{Fore.GREEN}🤖 ZAI: {final_response}{Style.RESET_ALL}")
+                    if not self._final_response_streamed:
+                        print(f"\n{Fore.GREEN}🤖 ZAI: {final_response}{Style.RESET_ALL}")
                     response = final_response
                 else:
+                    if stream_plan:
+                        ai_plan = stream_plan.result() or ai_plan
                     response = ai_plan.get('response', 'Operation completed!')
                     print(f"\n{Fore.GREEN}🤖 ZAI: {response}{Style.RESET_ALL}")
                 
@@ -2196,8 +4946,7 @@ START!"""
                     color = Fore.GREEN if success_count == len(results) else Fore.YELLOW
                     print(f"{color}📊 Result: {success_count}/{len(results)} successful{Style.RESET_ALL}")
                 
-                if retry_count == 0 or not any(not r.get('success') for r in results):
-                    self.memory.add_conversation("assistant", response)
+                self.memory.add_conversation("assistant", response)
                 
                 return {"success": True, "results": results}
             
@@ -2212,6 +4961,365 @@ START!"""
         except Exception as e:
             return self._handle_error(e, original_request)
     
+    def _run_actions(self, actions, state, force_execute=False, safe_mode=False):
+        """Run a plan's actions in order, repairing failures in place.
+        
+        A failed action is replaced by a re-planned one and execution resumes from
+        that point, so actions that already succeeded are never run again. Runs of
+        independent actions are executed as one parallel batch.
+        """
+        print(f"{Fore.YELLOW}⚡ Executing {len(actions)} action(s)...{Style.RESET_ALL}\n")
+        
+        queue = list(actions)
+        results = []
+        finished = {}  # results of actions already run as part of a parallel batch
+        fix_span = None  # (start, end) of a spliced replacement whose actions are still running
+        i = 0
+        while i < len(queue):
+            action = queue[i]
+            if id(action) in finished:
+                result = finished.pop(id(action))
+            else:
+                batch = self.tools.plan_batches(queue, i)
+                done = [k for k, j in enumerate(batch) if id(queue[j]) in finished]
+                batch = batch[:done[0]] if done else batch
+                if len(batch) > 1:
+                    finished.update(self._execute_parallel([queue[j] for j in batch], i + 1, len(queue)))
+                    result = finished.pop(id(action))
+                else:
+                    result = self._execute_action(action, i + 1, len(queue))
+            
+            if result.get('success'):
+                results.append(result)
+                fix_span = self._step_succeeded(state, queue, i, fix_span)
+                i += 1
+                time.sleep(0.1)
+                continue
+            
+            replacement, raced_result = self._recover_action(state, action, result, force_execute, safe_mode)
+            if not replacement:
+                results.append(result)
+                break
+            # A replacement for an action inside a running replacement extends that fix
+            if fix_span and fix_span[0] <= i < fix_span[1]:
+                fix_span = (fix_span[0], fix_span[1] + len(replacement) - 1)
+            else:
+                fix_span = (i, i + len(replacement))
+            queue[i:i + 1] = replacement
+            if raced_result:
+                results.append(raced_result)
+                fix_span = self._step_succeeded(state, queue, i, fix_span)
+                i += 1
+        
+        return results
+    
+    @staticmethod
+    def _plan_graph(actions):
+        """(ids, {id: set(dependency ids)}) for plans that use depends_on, else None (flat order)"""
+        if not any(isinstance(a, dict) and a.get('depends_on') for a in actions):
+            return None
+        ids = [str(a.get('id') or f"step{i + 1}") for i, a in enumerate(actions)]
+        if len(set(ids)) != len(ids):
+            print(f"{Fore.YELLOW}⚠️ Duplicate action ids, running plan in order{Style.RESET_ALL}")
+            return None
+        
+        deps = {}
+        for node_id, action in zip(ids, actions):
+            wanted = action.get('depends_on') or []
+            if isinstance(wanted, str):
+                wanted = [wanted]
+            deps[node_id] = {str(d) for d in wanted if str(d) in ids and str(d) != node_id}
+        
+        # Reject cycles (Kahn's algorithm)
+        remaining = {k: set(v) for k, v in deps.items()}
+        while remaining:
+            ready = [k for k, v in remaining.items() if not v]
+            if not ready:
+                print(f"{Fore.YELLOW}⚠️ Circular depends_on, running plan in order{Style.RESET_ALL}")
+                return None
+            for k in ready:
+                remaining.pop(k)
+            for v in remaining.values():
+                v.difference_update(ready)
+        return ids, deps
+    
+    def _run_node(self, actions):
+        """Run a graph node's action list in order; returns (index of failed action or None, last result)"""
+        result = {"success": False, "error": "No action"}
+        for index, action in enumerate(actions):
+            result = self._perform_action(action, echo=False)
+            if not result.get('success'):
+                return index, result
+        return None, result
+    
+    def _run_action_graph(self, actions, graph, state, force_execute=False, safe_mode=False):
+        """Run a depends_on plan as a DAG.
+        
+        Each action starts as soon as its dependencies succeed; independent branches run
+        in parallel. A failed node is repaired on its own while other branches continue,
+        and if it cannot be repaired only its dependents are skipped.
+        """
+        ids, deps = graph
+        print(f"{Fore.YELLOW}⚡ Executing {len(actions)} action(s) as a dependency graph...{Style.RESET_ALL}\n")
+        
+        position = {node_id: i + 1 for i, node_id in enumerate(ids)}
+        node_actions = {node_id: [action] for node_id, action in zip(ids, actions)}
+        status = {}
+        results = {}
+        running = {}
+        workers = 1 if self.tools.shell_pool.keep_state else max(1, self.tools.max_concurrency)
+        
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            def launch_ready():
+                for node_id in ids:
+                    if node_id not in status and all(status.get(d) == 'done' for d in deps[node_id]):
+                        status[node_id] = 'running'
+                        running[pool.submit(LLM_LEDGER.carry(self._run_node), node_actions[node_id])] = node_id
+            
+            launch_ready()
+            while running:
+                completed, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    node_id = running.pop(future)
+                    failed_index, result = future.result()
+                    ran = node_actions[node_id]
+                    action = ran[-1] if failed_index is None else ran[failed_index]
+                    self._print_action_header(action, position[node_id], len(ids))
+                    self._print_action_result(result)
+                    
+                    state.switch_step(node_id)
+                    if failed_index is None:
+                        if state.failure_signature:
+                            self._remember_fix(state, ran)
+                        state.step_succeeded()
+                        status[node_id], results[node_id] = 'done', result
+                        continue
+                    
+                    replacement, raced_result = self._recover_action(state, action, result, force_execute, safe_mode)
+                    if raced_result:
+                        self._remember_fix(state, replacement)
+                        state.step_succeeded()
+                        if failed_index + 1 < len(ran):
+                            node_actions[node_id] = ran[failed_index + 1:]
+                            running[pool.submit(LLM_LEDGER.carry(self._run_node), node_actions[node_id])] = node_id
+                        else:
+                            status[node_id], results[node_id] = 'done', raced_result
+                        continue
+                    if replacement:
+                        node_actions[node_id] = replacement + ran[failed_index + 1:]
+                        running[pool.submit(LLM_LEDGER.carry(self._run_node), node_actions[node_id])] = node_id
+                        continue
+                    status[node_id], results[node_id] = 'failed', result
+                launch_ready()
+        
+        for node_id in ids:
+            if node_id not in results:
+                action = node_actions[node_id][0]
+                blocked_by = ', '.join(sorted(d for d in deps[node_id] if status.get(d) != 'done'))
+                print(f"{Fore.YELLOW}[{position[node_id]}/{len(ids)}] {action.get('description', 'Processing')}... skipped (dependency {blocked_by} did not complete){Style.RESET_ALL}")
+                results[node_id] = {"success": False, "error": f"Skipped: dependency {blocked_by} did not complete", "skipped": True}
+        
+        return [results[node_id] for node_id in ids]
+    
+    def _recover_action(self, state, action, result, force_execute=False, safe_mode=False):
+        """Retry engine step for a failed action.
+        
+        Returns (replacement_actions, raced_result): raced_result is set when a raced
+        read-only alternative already succeeded; (None, None) means give up.
+        """
+        if state.applied_fix:
+            self.fix_store.record_outcome(state.applied_fix, False)
+            state.applied_fix = None
+        state.record_failure(action, result)
+        known_fix = self.fix_store.lookup(state.failure_signature, action) if len(state.step_failures) == 1 else None
+        
+        while True:
+            can_retry, reason = state.can_retry()
+            if not can_retry:
+                print(f"\n{Fore.RED}❌ {reason}. Stopping.{Style.RESET_ALL}")
+                return None, None
+            
+            state.attempt += 1
+            LLM_LEDGER.retry_index = state.attempt
+            
+            if known_fix:
+                print(f"\n{Fore.GREEN}🩹 Known error, applying stored fix ({state.attempt}/{state.max_retries})...{Style.RESET_ALL}")
+                replacement = known_fix
+                state.applied_fix = state.failure_signature
+                break
+            
+            if state.pending_alternatives:
+                # Mutating alternatives from an earlier race stay serial, one per attempt
+                replacement = [state.pending_alternatives.pop(0)]
+                print(f"\n{Fore.YELLOW}🔧 Trying next alternative ({state.attempt}/{state.max_retries})...{Style.RESET_ALL}")
+                break
+            
+            if self.racing_enabled and action.get('type') == 'command' and not self.offline_mode:
+                print(f"\n{Fore.YELLOW}🏁 Error detected, racing alternative methods ({state.attempt}/{state.max_retries})...{Style.RESET_ALL}")
+                raced = self._race_alternatives(state, force_execute, safe_mode)
+                if raced:
+                    return raced
+                if state.pending_alternatives:
+                    replacement = [state.pending_alternatives.pop(0)]
+                    print(f"{Fore.YELLOW}🔧 Trying mutating alternative serially...{Style.RESET_ALL}")
+                    break
+                continue
+            
+            print(f"\n{Fore.YELLOW}🔧 Error detected, trying alternative method ({state.attempt}/{state.max_retries})...{Style.RESET_ALL}")
+            
+            replacement = self._replan_failed_action(state)
+            if replacement:
+                break
+        
+        if safe_mode:
+            blocked = self._check_dangerous_commands(replacement)
+            if blocked:
+                print(f"\n{Fore.RED}⛔ BLOCKED by safe mode: {blocked}{Style.RESET_ALL}")
+                return None, None
+        
+        with state.paused():
+            confirmed = force_execute or self._confirm_actions(replacement)
+        if not confirmed:
+            print(f"\n{Fore.YELLOW}⚠️ Actions cancelled by user{Style.RESET_ALL}")
+            return None, None
+        
+        return replacement, None
+    
+    def _step_succeeded(self, state, queue, i, fix_span):
+        """queue[i] succeeded: close the step, learning the fix once its last action has run.
+        
+        Returns the fix span that is still in progress, if any.
+        """
+        if fix_span and i < fix_span[1] - 1:
+            return fix_span
+        if state.failure_signature:
+            self._remember_fix(state, queue[fix_span[0]:fix_span[1]] if fix_span else [queue[i]])
+        state.step_succeeded()
+        return None
+    
+    def _remember_fix(self, state, fix_actions):
+        """Store the action that repaired the step, or count a stored fix as successful"""
+        if state.applied_fix:
+            self.fix_store.record_outcome(state.applied_fix, True)
+        else:
+            self.fix_store.learn(state.failure_signature, state.failure_action, fix_actions)
+    
+    def _propose_alternatives(self, state):
+        """Ask the model for several alternative commands for the failed step in one call"""
+        tried = "\n".join(
+            f"- [{a.get('details', {}).get('shell', '?')}] {str(a.get('details', {}).get('content', ''))[:150]} -> {err[:150]}"
+            for a, err in state.step_failures[:-1]
+        )
+        
+        prompt = f"""A command failed. Propose {RACE_CANDIDATES} DIFFERENT alternative commands that achieve the same goal.
+Spread them across different shells where possible.
+
+User request: {state.request[:300]}
+Failed action: {json.dumps(state.failed_action, ensure_ascii=False)[:1500]}
+Error: {state.last_error[:600]}
+{f"Already tried for this step:{chr(10)}{tried}" if tried else ""}
+OS: {self.context['os']} | Shells: {', '.join(self.context['available_shells'])}
+
+Set "read_only": true ONLY if the command changes nothing (no writes, installs, deletes, config changes).
+Return JSON only: {{"alternatives": [{{"description": "...", "details": {{"shell": "...", "content": "...", "encoding": "utf-8"}}, "read_only": true}}]}}"""
+        
+        try:
+            text = self._generate_text(prompt, site="AIBrain._propose_alternatives", cacheable=False)
+            state.charge(prompt, text)
+            
+            json_start = text.find('{')
+            json_end = text.rfind('}') + 1
+            if json_start >= 0 and json_end > json_start:
+                alternatives = json.loads(text[json_start:json_end]).get('alternatives', [])
+                return [a for a in alternatives if isinstance(a, dict) and isinstance(a.get('details'), dict)
+                        and a['details'].get('content')][:RACE_CANDIDATES]
+        except Exception as e:
+            print(f"{Fore.YELLOW}Re-plan error: {str(e)[:200]}{Style.RESET_ALL}")
+        return []
+    
+    def _race_alternatives(self, state, force_execute=False, safe_mode=False):
+        """Run read-only alternatives concurrently; first success wins, losers are cancelled.
+        
+        Mutating alternatives are queued on the retry state to be tried serially.
+        Returns ([winning_action], winning_result) or None.
+        """
+        candidates = []
+        for alt in self._propose_alternatives(state):
+            action = {"type": "command", "description": alt.get('description', 'Alternative'), "details": alt['details']}
+            if safe_mode and self._check_dangerous_commands([action]):
+                continue
+            if alt.get('read_only') and AITools.is_read_only_command(action['details'].get('content', '')):
+                candidates.append(action)
+            else:
+                state.pending_alternatives.append(action)
+        
+        if not candidates:
+            return None
+        
+        with state.paused():
+            confirmed = force_execute or self._confirm_actions(candidates)
+        if not confirmed:
+            print(f"\n{Fore.YELLOW}⚠️ Actions cancelled by user{Style.RESET_ALL}")
+            return None
+        
+        cancel_event = threading.Event()
+        winner = None
+        with ThreadPoolExecutor(max_workers=min(RACE_CONCURRENCY, len(candidates))) as pool:
+            futures = {pool.submit(self.tools.run_command, a['details'], cancel_event): a for a in candidates}
+            for future in as_completed(futures):
+                action = futures[future]
+                shell = action['details'].get('shell', '?')
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"success": False, "error": str(e)}
+                
+                if result.get('success') and winner is None:
+                    winner = ([action], result)
+                    cancel_event.set()
+                    print(f"{Fore.GREEN}  ✓ [{shell}] {action['description']} (winner){Style.RESET_ALL}")
+                elif winner is None:
+                    state.step_failures.append((action, str(result.get('error') or result.get('output') or 'Unknown error')))
+                    print(f"{Fore.RED}  ✗ [{shell}] {action['description']}{Style.RESET_ALL}")
+        
+        return winner
+    
+    def _replan_failed_action(self, state):
+        """Ask the model to replace only the failed action (delta context, not the full prompt)"""
+        tried = "\n".join(
+            f"- [{a.get('details', {}).get('shell', a.get('type', '?'))}] {str(a.get('details', {}).get('content', a.get('description', '')))[:150]} -> {err[:150]}"
+            for a, err in state.step_failures[:-1]
+        )
+        
+        prompt = f"""An action failed. Replace ONLY this action with a different method.
+
+User request: {state.request[:300]}
+Failed action: {json.dumps(state.failed_action, ensure_ascii=False)[:1500]}
+Error: {state.last_error[:600]}
+{f"Already tried for this step:{chr(10)}{tried}" if tried else ""}
+OS: {self.context['os']} | Shells: {', '.join(self.context['available_shells'])}
+Working directory: {self.tools.working_directory()}
+Attempt: {state.attempt}/{state.max_retries}
+
+Use a COMPLETELY DIFFERENT method (other shell, encoding or command). Same action schema as before.
+Return JSON only: {{"actions": [ ...replacement action(s)... ]}}"""
+        
+        try:
+            if self.offline_mode:
+                text = self.offline_model.generate(prompt, max_length=1024, temperature=0.1)
+            else:
+                text = self._generate_text(prompt, site="AIBrain._replan_failed_action", cacheable=False)
+            state.charge(prompt, text)
+            
+            json_start = text.find('{')
+            json_end = text.rfind('}') + 1
+            if json_start >= 0 and json_end > json_start:
+                actions = json.loads(text[json_start:json_end]).get('actions', [])
+                return [a for a in actions if isinstance(a, dict)]
+        except Exception as e:
+            print(f"{Fore.YELLOW}Re-plan error: {str(e)[:200]}{Style.RESET_ALL}")
+        return []
+    
     def _check_dangerous_commands(self, actions):
         """Check if actions contain dangerous commands"""
         for action in actions:
@@ -2306,47 +5414,52 @@ START!"""
     
     def _execute_action(self, action, index, total):
         """Execute a single action"""
-        action_type = action.get('type', 'unknown')
+        self._print_action_header(action, index, total)
+        self._echo_started = False
+        result = self._perform_action(action)
+        self._print_action_result(result)
+        return result
+    
+    def _execute_parallel(self, actions, first_index, total):
+        """Run independent actions concurrently; report them in plan order. Returns {id(action): result}"""
+        print(f"{Fore.MAGENTA}⚡ Running {len(actions)} independent actions in parallel...{Style.RESET_ALL}")
+        results = {}
+        with ThreadPoolExecutor(max_workers=min(self.tools.max_concurrency, len(actions))) as pool:
+            futures = [pool.submit(LLM_LEDGER.carry(self._perform_action), action, False) for action in actions]
+            for offset, (action, future) in enumerate(zip(actions, futures)):
+                result = future.result()
+                self._print_action_header(action, first_index + offset, total)
+                self._print_action_result(result)
+                results[id(action)] = result
+        return results
+    
+    def _perform_action(self, action, echo=True):
+        """Run an action's tool without printing; exceptions become failed results"""
+        try:
+            return self.tools.perform(action.get('type', 'unknown'), action.get('details', {}), echo=echo)
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+    
+    def _print_action_header(self, action, index, total):
+        """Print "[i/n] [shell] description..." (result follows on the same line)"""
         description = action.get('description', 'Processing')
-        details = action.get('details', {})
-        
-        shell_info = details.get('shell', '')
+        shell_info = action.get('details', {}).get('shell', '')
         if shell_info:
             print(f"{Fore.BLUE}[{index}/{total}] [{shell_info}] {description}...{Style.RESET_ALL}", end=' ')
         else:
             print(f"{Fore.BLUE}[{index}/{total}] {description}...{Style.RESET_ALL}", end=' ')
-        
-        try:
-            if action_type == 'file':
-                result = self.tools.handle_file(details)
-            elif action_type == 'command':
-                result = self.tools.run_command(details)
-            elif action_type == 'code':
-                result = self.tools.create_code(details)
-            elif action_type == 'info':
-                result = self.tools.gather_info(details)
-            elif action_type == 'multi':
-                result = self.tools.multi_task(details)
-            else:
-                result = {"success": False, "error": f"Unknown action: {action_type}"}
-            
-            if result.get('success'):
-                print(f"{Fore.GREEN}✓{Style.RESET_ALL}")
-            else:
-                error_msg = result.get('error', 'Unknown error')
-                print(f"{Fore.RED}✗{Style.RESET_ALL}")
-                if error_msg and len(error_msg) > 50:
-                    print(f"  {Fore.RED}↳ {error_msg[:200]}...{Style.RESET_ALL}")
-                else:
-                    print(f"  {Fore.RED}↳ {error_msg}{Style.RESET_ALL}")
-            
-            return result
-            
-        except Exception as e:
-            error_str = str(e)
+    
+    def _print_action_result(self, result):
+        """Print ✓ or ✗ with the error"""
+        if result.get('success'):
+            print(f"{Fore.GREEN}✓{Style.RESET_ALL}")
+        else:
+            error_msg = result.get('error', 'Unknown error')
             print(f"{Fore.RED}✗{Style.RESET_ALL}")
-            print(f"  {Fore.RED}↳ {error_str[:200]}{Style.RESET_ALL}")
-            return {"success": False, "error": error_str}
+            if error_msg and len(error_msg) > 50:
+                print(f"  {Fore.RED}↳ {error_msg[:200]}...{Style.RESET_ALL}")
+            else:
+                print(f"  {Fore.RED}↳ {error_msg}{Style.RESET_ALL}")
     
     def _handle_error(self, error, request):
         """Error handling"""
@@ -2356,6 +5469,7 @@ START!"""
     
     def _generate_final_response(self, original_request, results):
         """Generate final response with command outputs"""
+        self._final_response_streamed = False
         try:
             outputs = []
             for result in results:
@@ -2379,16 +5493,598 @@ Operation outputs:
 Using the outputs above, respond to the user in NATURAL LANGUAGE.
 Only write the response text, nothing else. No JSON, no explanation, just the response."""
 
-            response = self.model.generate_content(prompt)
-            return response.text.strip()
+            with RATE_LIMITER.priority(RATE_PRIORITY_OPTIONAL):
+                if self.streaming_enabled:
+                    final_response = self._stream_text(prompt, site="AIBrain._generate_final_response", prefix=f"\n{Fore.GREEN}🤖 ZAI: ")
+                    self._final_response_streamed = True
+                    return final_response
+                
+                return self._generate_text(prompt, site="AIBrain._generate_final_response").strip()
             
+        except RateLimitedError:
+            print(f"\n{Style.DIM}⏳ Rate limit reached - showing raw output instead of a summary{Style.RESET_ALL}")
+            return "\n".join(outputs)
         except Exception:
             return outputs[0] if outputs else "Operation completed!"
 
 
+def kill_process_tree(proc):
+    """Kill a process started with start_new_session, including its children"""
+    try:
+        if proc.poll() is None:
+            if os.name == 'nt':
+                subprocess.run(['taskkill', '/F', '/T', '/PID', str(proc.pid)], capture_output=True)
+            else:
+                os.killpg(proc.pid, signal.SIGKILL)
+    except Exception:
+        try:
+            proc.kill()
+        except Exception:
+            pass
+
+
+class OutputCapture:
+    """Bounded head+tail buffer for one output stream"""
+    
+    def __init__(self, head_chars: int, tail_chars: int, encoding: str = 'utf-8'):
+        self.head_chars = head_chars
+        self.tail_chars = tail_chars
+        self.encoding = encoding
+        self.head = []
+        self.head_len = 0
+        self.tail = deque()
+        self.tail_len = 0
+        self.total_chars = 0
+        self.bytes_seen = 0
+    
+    def feed(self, text: str, nbytes: int = None):
+        """Add text; only the first head_chars and last tail_chars are kept"""
+        if not text:
+            return
+        self.total_chars += len(text)
+        self.bytes_seen += nbytes if nbytes is not None else len(text.encode(self.encoding, errors='replace'))
+        if self.head_len < self.head_chars:
+            take = text[:self.head_chars - self.head_len]
+            self.head.append(take)
+            self.head_len += len(take)
+            text = text[len(take):]
+        if text:
+            self.tail.append(text)
+            self.tail_len += len(text)
+            while self.tail and self.tail_len - len(self.tail[0]) >= self.tail_chars:
+                self.tail_len -= len(self.tail.popleft())
+    
+    @property
+    def truncated(self) -> bool:
+        return self.total_chars > self.head_chars + self.tail_chars
+    
+    def text(self) -> str:
+        """Captured text, with a marker where the middle was dropped"""
+        head = ''.join(self.head)
+        tail = ''.join(self.tail)
+        if not self.truncated:
+            return head + tail
+        tail = tail[-self.tail_chars:]
+        omitted = self.total_chars - len(head) - len(tail)
+        return f"{head}\n... [{omitted} chars omitted] ...\n{tail}"
+
+
+class ProcessOutput:
+    """Watches a command's output: bounded capture, live echo, cap, idle and overall timeouts"""
+    
+    def __init__(self, encoding: str = 'utf-8', listener=None, cancel_event: threading.Event = None,
+                 timeout: int = COMMAND_TIMEOUT, idle_timeout: int = OUTPUT_IDLE_TIMEOUT,
+                 max_bytes: int = OUTPUT_MAX_BYTES):
+        self.stdout = OutputCapture(OUTPUT_STDOUT_HEAD, OUTPUT_STDOUT_TAIL, encoding)
+        self.stderr = OutputCapture(OUTPUT_STDERR_HEAD, OUTPUT_STDERR_TAIL, encoding)
+        self.listener = listener
+        self.cancel_event = cancel_event
+        self.deadline = time.time() + timeout
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.max_bytes = max_bytes
+        self.last_activity = time.time()
+        self.stop_reason = None
+        self._echo_ends_with_newline = True
+    
+    def feed(self, stream: str, text: str, nbytes: int = None):
+        """Record output from 'stdout' or 'stderr' and echo it"""
+        if not text:
+            return
+        self.last_activity = time.time()
+        (self.stdout if stream == 'stdout' else self.stderr).feed(text, nbytes)
+        if self.listener:
+            try:
+                self.listener(text)
+                self._echo_ends_with_newline = text.endswith('\n')
+            except Exception:
+                pass
+    
+    def check(self) -> Optional[str]:
+        """Reason to stop the process now, or None"""
+        now = time.time()
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            self.stop_reason = "Cancelled (another strategy won)"
+        elif self.stdout.bytes_seen + self.stderr.bytes_seen > self.max_bytes:
+            self.stop_reason = f"Output cap reached ({self.max_bytes // (1024 * 1024)} MB), process stopped"
+        elif now - self.last_activity > self.idle_timeout:
+            self.stop_reason = f"No output for {self.idle_timeout}s, process stopped"
+        elif now > self.deadline:
+            self.stop_reason = f"Command timed out ({self.timeout}s)"
+        return self.stop_reason
+    
+    def finish(self):
+        """End the live echo on a fresh line"""
+        if self.listener and not self._echo_ends_with_newline:
+            try:
+                self.listener('\n')
+            except Exception:
+                pass
+    
+    def result(self, returncode: int, shell_type: str) -> Dict:
+        """run_command result dict"""
+        self.finish()
+        error = self.stderr.text()
+        if self.stop_reason:
+            error = f"{error}\n{self.stop_reason}".strip()
+        return {
+            "success": returncode == 0 and not self.stop_reason,
+            "output": self.stdout.text(),
+            "error": error,
+            "returncode": returncode,
+            "shell": shell_type,
+            "bytes_seen": self.stdout.bytes_seen + self.stderr.bytes_seen,
+            "truncated": self.stdout.truncated or self.stderr.truncated or bool(self.stop_reason)
+        }
+
+
+class ShellSession:
+    """One long-lived shell process; commands go over stdin, output is framed by a sentinel"""
+    
+    def __init__(self, shell_type: str, argv: List[str], encoding: str = 'utf-8'):
+        self.shell_type = shell_type
+        self.argv = argv
+        self.encoding = encoding
+        self.is_powershell = shell_type in ('powershell', 'pwsh')
+        self.sentinel = f"__ZAI_DONE_{uuid.uuid4().hex}__"
+        self.lock = threading.Lock()
+        self.stateful = False
+        self.cwd = None  # session working directory, reported after every command
+        self.proc = None
+        self._chunks = queue.Queue()
+    
+    def is_alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+    
+    def start(self):
+        """Spawn the shell process and its pipe readers"""
+        self._chunks = queue.Queue()
+        self.stateful = False
+        self.cwd = None
+        self.proc = subprocess.Popen(
+            self.argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            start_new_session=(os.name != 'nt')
+        )
+        for name, stream in (('stdout', self.proc.stdout), ('stderr', self.proc.stderr)):
+            threading.Thread(target=self._pump, args=(name, stream, self._chunks, self.encoding), daemon=True).start()
+    
+    @staticmethod
+    def _pump(name, stream, target, encoding):
+        """Forward decoded chunks from a pipe to the shared queue (None marks EOF)"""
+        decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        try:
+            for data in iter(lambda: stream.read1(65536), b''):
+                target.put((name, decoder.decode(data), len(data)))
+        except Exception:
+            pass
+        target.put((name, None, 0))
+    
+    def _script(self, command: str, keep_state: bool) -> str:
+        """Wrap the command so it reports its exit code and cwd followed by the sentinel on both pipes"""
+        if self.is_powershell:
+            check = "if (-not $?) { $global:__zai_rc = 1 }; if ($LASTEXITCODE) { $global:__zai_rc = $LASTEXITCODE }"
+            if keep_state:
+                body = f"try {{\n{command}\n{check}\n}}"
+            else:
+                # Stateless: run in a child scope (variables, functions) and restore location and env afterwards
+                body = (
+                    "$__zai_env = @{}; foreach ($__zai_var in Get-ChildItem env:) { $__zai_env[$__zai_var.Name] = $__zai_var.Value }\n"
+                    f"Push-Location\ntry {{\n& {{\n{command}\n{check}\n}}\n}}"
+                )
+            body += " catch { [Console]::Error.WriteLine($_.ToString()); $global:__zai_rc = 1 }"
+            if not keep_state:
+                body += (
+                    " finally {\nPop-Location\n"
+                    "foreach ($__zai_var in @(Get-ChildItem env:)) { if (-not $__zai_env.ContainsKey($__zai_var.Name)) { Remove-Item -LiteralPath \"env:$($__zai_var.Name)\" } }\n"
+                    "foreach ($__zai_var in $__zai_env.GetEnumerator()) { [Environment]::SetEnvironmentVariable($__zai_var.Key, $__zai_var.Value) }\n}"
+                )
+            return (
+                "$global:LASTEXITCODE = 0; $global:__zai_rc = 0\n"
+                f"{body}\n"
+                f"[Console]::Out.WriteLine(''); [Console]::Out.WriteLine('{self.sentinel} ' + $global:__zai_rc + ' ' + (Get-Location).Path); "
+                f"[Console]::Error.WriteLine(''); [Console]::Error.WriteLine('{self.sentinel}')\n\n"
+            )
+        # Stateless commands run in a subshell so cd/export do not leak into later actions.
+        # The command goes through eval as one quoted word: a syntax error (unterminated
+        # quote or heredoc) fails right away instead of leaving the shell waiting for input.
+        opener, closer = ('{', '}') if keep_state else ('(', ')')
+        return (
+            f"{opener}\neval {shlex.quote(command)}\n{closer} </dev/null\n"
+            f"__zai_rc=$?; printf '\\n%s %s %s\\n' '{self.sentinel}' \"$__zai_rc\" \"$PWD\"; printf '\\n%s\\n' '{self.sentinel}' >&2\n"
+        )
+    
+    def run(self, command: str, watcher: ProcessOutput, keep_state: bool = False) -> int:
+        """Run a command in this session, streaming into watcher; returns the exit code.
+        
+        The session is killed (and respawned on next use) if the watcher stops it or the shell dies.
+        """
+        if not self.is_alive():
+            self.start()
+        if keep_state:
+            self.stateful = True
+        
+        try:
+            self.proc.stdin.write(self._script(command, keep_state).encode(self.encoding, errors='replace'))
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError):
+            self.close()
+            raise
+        
+        # The framing puts a newline before each sentinel. A trailing partial line is
+        # held back only while it could still be the start of that marker.
+        marker = '\n' + self.sentinel
+        pending = {'stdout': '', 'stderr': ''}
+        open_streams = {'stdout', 'stderr'}
+        returncode = None
+        while open_streams:
+            if watcher.check():
+                self.close()
+                return -9
+            try:
+                name, text, nbytes = self._chunks.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if name not in open_streams:
+                continue
+            if text is None:
+                watcher.feed(name, pending[name])
+                open_streams.discard(name)
+                continue
+            
+            buf = pending[name] + text
+            pos = buf.find(marker)
+            if pos >= 0:
+                rest = buf[pos + len(marker):]
+                if '\n' not in rest:
+                    pending[name] = buf
+                    continue
+                watcher.feed(name, buf[:pos])
+                open_streams.discard(name)
+                if name == 'stdout':
+                    status, _, cwd = rest.split('\n')[0].strip().partition(' ')
+                    try:
+                        returncode = int(status)
+                    except ValueError:
+                        returncode = 1
+                    self.cwd = cwd or self.cwd
+                continue
+            
+            cut = buf.rfind('\n')
+            if cut < 0 or not marker.startswith(buf[cut:]):
+                cut = len(buf)
+            watcher.feed(name, buf[:cut])
+            pending[name] = buf[cut:]
+        
+        if returncode is None:
+            # Shell exited (e.g. the command called exit)
+            returncode = self.proc.wait()
+            self.proc = None
+        return returncode
+    
+    def close(self):
+        """Terminate the shell process tree"""
+        if self.proc is None:
+            return
+        kill_process_tree(self.proc)
+        try:
+            self.proc.wait(timeout=5)
+        except Exception:
+            pass
+        self.proc = None
+
+
+class ShellSessionPool:
+    """One reusable ShellSession per (shell, encoding) to avoid process startup on every action"""
+    
+    def __init__(self, enabled: bool = True, keep_state: bool = False):
+        self.enabled = enabled
+        self.keep_state = keep_state
+        self.sessions = {}
+        self.cwd = None  # where stateful sessions left off in this request (keep_state only)
+        self.reused = 0
+        self.started = 0
+        self._lock = threading.Lock()
+        atexit.register(self.close_all)
+    
+    @staticmethod
+    def session_argv(shell_type: str, executable: str = None) -> Optional[List[str]]:
+        """Command line for a stdin-driven session, or None if the shell is not pooled"""
+        if shell_type in ('powershell', 'pwsh'):
+            return [shell_type, '-NoProfile', '-NoLogo', '-NonInteractive', '-Command', '-']
+        if shell_type == 'wsl':
+            return ['wsl', 'bash']
+        if executable:
+            return [executable]
+        if shell_type in POOLED_POSIX_SHELLS:
+            path = shutil.which(shell_type)
+            return [path] if path else None
+        return None
+    
+    def acquire(self, shell_type: str, encoding: str, executable: str = None) -> Optional[ShellSession]:
+        """Locked session for the shell, or None (pool off, unsupported shell, or session busy)"""
+        if not self.enabled:
+            return None
+        argv = self.session_argv(shell_type, executable)
+        if not argv:
+            return None
+        key = (shell_type, encoding, argv[0])
+        with self._lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = self.sessions[key] = ShellSession(shell_type, argv, encoding)
+        if not session.lock.acquire(blocking=False):
+            return None
+        if session.is_alive():
+            self.reused += 1
+        else:
+            self.started += 1
+        return session
+    
+    def begin_request(self):
+        """Drop sessions whose cwd/env was changed by the previous request"""
+        with self._lock:
+            self.cwd = None
+            for session in self.sessions.values():
+                if session.stateful and session.lock.acquire(blocking=False):
+                    session.close()
+                    session.lock.release()
+    
+    def close_all(self):
+        with self._lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
+    
+    def get_stats(self) -> Dict:
+        return {
+            "sessions": sum(1 for s in self.sessions.values() if s.is_alive()),
+            "started": self.started,
+            "reused": self.reused
+        }
+
+
+class ShellRegistry:
+    """Installed shells with absolute paths and versions, probed in parallel and cached per PATH"""
+    
+    POSIX_SHELLS = ['bash', 'sh', 'zsh', 'fish', 'ksh', 'tcsh', 'dash']
+    WINDOWS_SHELLS = ['cmd', 'powershell', 'pwsh', 'git-bash', 'wsl', 'cygwin']
+    VERSION_ARGS = {
+        'bash': ['--version'], 'zsh': ['--version'], 'fish': ['--version'], 'tcsh': ['--version'],
+        'ksh': ['-c', 'echo $KSH_VERSION'], 'git-bash': ['--version'], 'cygwin': ['--version'],
+        'pwsh': ['--version'], 'powershell': ['-NoProfile', '-Command', '$PSVersionTable.PSVersion.ToString()']
+    }
+    
+    def __init__(self, cache_file: str = SHELL_CACHE_FILE):
+        self.cache_file = cache_file
+        self.candidates = self.WINDOWS_SHELLS if os.name == 'nt' else self.POSIX_SHELLS
+        self.shells = {}  # name -> {"path", "version", "mtime"}
+        self.from_cache = False
+    
+    @staticmethod
+    def _fingerprint() -> str:
+        """PATH plus the modification times of its directories (installs and upgrades touch them)"""
+        digest = hashlib.sha1(os.environ.get('PATH', '').encode('utf-8', errors='replace'))
+        for directory in os.environ.get('PATH', '').split(os.pathsep) + SHELL_SEARCH_DIRS:
+            try:
+                digest.update(f"{directory}:{os.stat(directory).st_mtime_ns}".encode('utf-8', errors='replace'))
+            except OSError:
+                continue
+        return digest.hexdigest()[:16]
+    
+    @staticmethod
+    def locate(name: str) -> Optional[str]:
+        """Absolute executable path for a shell, or None"""
+        if name in ('git-bash', 'cygwin'):
+            return next((p for p in (GIT_BASH_PATHS if name == 'git-bash' else CYGWIN_PATHS) if os.path.exists(p)), None)
+        path = shutil.which(name)
+        if not path and os.name != 'nt':
+            path = next((os.path.join(d, name) for d in SHELL_SEARCH_DIRS if os.access(os.path.join(d, name), os.X_OK)), None)
+        return os.path.abspath(path) if path else None
+    
+    def _probe(self, name: str) -> Optional[Dict]:
+        path = self.locate(name)
+        if not path:
+            return None
+        version = ""
+        if name in self.VERSION_ARGS:
+            try:
+                out = subprocess.run([path] + self.VERSION_ARGS[name], capture_output=True, text=True,
+                                     errors='replace', timeout=SHELL_PROBE_TIMEOUT)
+                text = (out.stdout or out.stderr).strip()
+                match = re.search(r'\d+(?:\.\d+)+', text)
+                version = match.group(0) if match else text.splitlines()[0][:40] if text else ""
+            except Exception:
+                pass
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = 0
+        return {"path": path, "version": version, "mtime": mtime}
+    
+    def _load_cache(self, fingerprint: str) -> bool:
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("fingerprint") != fingerprint or data.get("candidates") != self.candidates:
+                return False
+            for info in data["shells"].values():
+                if os.stat(info["path"]).st_mtime_ns != info["mtime"]:
+                    return False
+            self.shells = data["shells"]
+            return True
+        except Exception:
+            return False
+    
+    def discover(self) -> List[str]:
+        """Installed shell names (cached result while PATH and the executables are unchanged)"""
+        fingerprint = self._fingerprint()
+        self.from_cache = self._load_cache(fingerprint)
+        if not self.from_cache:
+            with ThreadPoolExecutor(max_workers=len(self.candidates)) as pool:
+                found = dict(zip(self.candidates, pool.map(self._probe, self.candidates)))
+            self.shells = {name: info for name, info in found.items() if info}
+            try:
+                with open(self.cache_file, 'w', encoding='utf-8') as f:
+                    json.dump({"fingerprint": fingerprint, "candidates": self.candidates, "shells": self.shells}, f, indent=2)
+            except Exception:
+                pass
+        return self.names()
+    
+    def names(self) -> List[str]:
+        return list(self.shells) or (['cmd', 'powershell'] if os.name == 'nt' else ['sh'])
+    
+    def path(self, name: str) -> Optional[str]:
+        """Executable for a shell (discovered, else looked up now)"""
+        info = self.shells.get(name)
+        if info:
+            return info["path"]
+        path = self.locate(name)
+        if path:
+            self.shells[name] = {"path": path, "version": "", "mtime": 0}
+        return path
+    
+    def describe(self) -> List[str]:
+        """'name version' labels for the prompt and banner"""
+        return [f"{name} {info['version']}".strip() for name, info in self.shells.items()] or self.names()
+
+
+class SystemSampler:
+    """Background CPU/memory/disk/network sampler with a ring buffer of recent readings"""
+    
+    def __init__(self, interval: float = SYSTEM_SAMPLE_INTERVAL, history: int = SYSTEM_SAMPLE_HISTORY):
+        self.interval = interval
+        self.samples = deque(maxlen=history)
+        self.available = module_available("psutil")
+        self.boot_time = None
+        self._started = False
+        self._lock = threading.Lock()
+    
+    def start(self):
+        """Start sampling (once; no-op without psutil)"""
+        with self._lock:
+            if self._started or not self.available:
+                return
+            self._started = True
+        try:
+            threading.Thread(target=self._run, daemon=True).start()
+        except Exception:
+            self.available = False
+    
+    @staticmethod
+    def _read(reader):
+        """One psutil reading, or None if it is not supported here"""
+        try:
+            return reader()
+        except Exception:
+            return None
+    
+    def _run(self):
+        try:
+            import psutil
+        except Exception:
+            self.available = False
+            return
+        boot = self._read(psutil.boot_time)
+        if boot:
+            self.boot_time = datetime.datetime.fromtimestamp(boot).strftime('%Y-%m-%d %H:%M:%S')
+        disk_root = 'C:\\' if platform.system() == 'Windows' else '/'
+        self._read(lambda: psutil.cpu_percent(interval=None))  # prime: the next call reports usage since now
+        time.sleep(min(self.interval, 0.5))
+        previous = None
+        while True:
+            # Each reading is independent: e.g. containers without network counters still get CPU/RAM
+            memory = self._read(psutil.virtual_memory)
+            disk = self._read(lambda: psutil.disk_usage(disk_root))
+            pids = self._read(psutil.pids)
+            net = self._read(psutil.net_io_counters)
+            now = time.time()
+            sample = {
+                "time": now,
+                "cpu_percent": self._read(lambda: psutil.cpu_percent(interval=None)),
+                "memory_percent": memory.percent if memory else None,
+                "memory_available_gb": round(memory.available / (1024**3), 2) if memory else None,
+                "disk_percent": disk.percent if disk else None,
+                "process_count": len(pids) if pids is not None else None
+            }
+            if net is not None:
+                sample.update({
+                    "bytes_sent": net.bytes_sent,
+                    "bytes_recv": net.bytes_recv,
+                    "packets_sent": net.packets_sent,
+                    "packets_recv": net.packets_recv,
+                    "send_kbps": 0.0,
+                    "recv_kbps": 0.0
+                })
+                if previous and "bytes_sent" in previous:
+                    elapsed = max(now - previous["time"], 0.001)
+                    sample["send_kbps"] = round((net.bytes_sent - previous["bytes_sent"]) / 1024 / elapsed, 1)
+                    sample["recv_kbps"] = round((net.bytes_recv - previous["bytes_recv"]) / 1024 / elapsed, 1)
+            if any(value is not None for key, value in sample.items() if key != "time"):
+                self.samples.append(sample)
+                previous = sample
+            elif previous is None:
+                self.available = False  # psutil cannot read anything on this system
+                return
+            time.sleep(self.interval)
+    
+    def latest(self, wait: float = 1.0) -> Optional[Dict]:
+        """Most recent sample (waits briefly for the first one after start)"""
+        self.start()
+        deadline = time.time() + wait
+        while not self.samples and self.available and time.time() < deadline:
+            time.sleep(0.05)
+        return self.samples[-1] if self.samples else None
+    
+    def cpu_average(self) -> Optional[float]:
+        """Mean CPU over the buffered window"""
+        values = [s["cpu_percent"] for s in list(self.samples) if s["cpu_percent"] is not None]
+        return round(sum(values) / len(values), 1) if values else None
+    
+    def summary(self) -> str:
+        """One-line load figures for the prompt (never blocks)"""
+        if not self.samples:
+            return "n/a"
+        s = self.samples[-1]
+        parts = []
+        if s["cpu_percent"] is not None:
+            parts.append(f"CPU {s['cpu_percent']}% (avg {self.cpu_average()}%)")
+        if s["memory_percent"] is not None:
+            parts.append(f"RAM {s['memory_percent']}% ({s['memory_available_gb']} GB free)")
+        if s["disk_percent"] is not None:
+            parts.append(f"Disk {s['disk_percent']}%")
+        return " | ".join(parts) or "n/a"
+
+
 class AITools:
     """Tools that AI can use"""
     
+    def __init__(self):
+        self.shell_pool = ShellSessionPool()
+        self.shells = ShellRegistry()
+        self.system_sampler = SystemSampler()
+        self.output_listener = None  # callable(text) for live command output
+        self.max_concurrency = ACTION_CONCURRENCY
+    
     def handle_file(self, details):
         """File operations with Smart Path Correction"""
         try:
@@ -2442,8 +6138,55 @@ class AITools:
         except Exception as e:
             return {"success": False, "error": f"File error: {str(e)}"}
     
-    def run_command(self, details):
-        """Execute system command - optimized"""
+    READ_ONLY_COMMANDS = {
+        'ls', 'dir', 'cat', 'type', 'more', 'head', 'tail', 'echo', 'pwd', 'whoami',
+        'uname', 'ver', 'systeminfo', 'where', 'which', 'findstr', 'grep', 'egrep', 'wc', 'df', 'du',
+        'free', 'ps', 'tasklist', 'ipconfig', 'netstat', 'printenv', 'id',
+        'uptime', 'lsb_release', 'cut', 'stat', 'file', 'nproc', 'lscpu',
+        'chcp', 'vol', 'true',
+    }
+    # Version probes that are read-only, per program ("-v" is verbose/REPL mode for several of them)
+    VERSION_PROBES = {
+        **{name: ('--version',) for name in (
+            'pip', 'pip3', 'node', 'npm', 'npx', 'deno', 'javac', 'ruby', 'perl', 'php', 'rustc', 'cargo',
+            'gcc', 'g++', 'clang', 'make', 'cmake', 'git', 'docker', 'bash', 'zsh', 'fish', 'tcsh', 'pwsh')},
+        'python': ('--version', '-V'), 'python3': ('--version', '-V'), 'py': ('--version', '-V'),
+        'java': ('--version',), 'go': ('version',), 'dotnet': ('--version', 'version'),
+    }
+    READ_ONLY_CMDLET_PREFIXES = (
+        'get-', 'test-', 'select-', 'measure-', 'format-', 'out-string', 'write-output', 'sort-object', 'where-object'
+    )
+    
+    @classmethod
+    def is_read_only_command(cls, command: str) -> bool:
+        """Conservative check: every chained/piped segment starts with a read-only program and nothing is redirected"""
+        command = re.sub(r'[0-9]?>&[0-9]', ' ', command or '')
+        if not command.strip() or '>' in command or re.search(r'\s-(delete|exec)\b', command):
+            return False
+        # Command/process substitution can run anything inside an otherwise harmless command
+        if '$(' in command or '`' in command or '<(' in command:
+            return False
+        for segment in re.split(r'\|\||&&|[|;&]', command):
+            words = segment.strip().split()
+            if not words:
+                continue
+            program = os.path.basename(words[0].strip('"\'')).lower()
+            if program.endswith('.exe'):
+                program = program[:-4]
+            if program in cls.READ_ONLY_COMMANDS or program.startswith(cls.READ_ONLY_CMDLET_PREFIXES):
+                continue
+            # "python --version" style probes
+            if len(words) == 2 and words[1] in cls.VERSION_PROBES.get(program, ()):
+                continue
+            return False
+        return True
+    
+    def working_directory(self) -> str:
+        """Where commands run: the pooled session's cwd after a kept-state cd, else the process cwd"""
+        return self.shell_pool.cwd or os.getcwd()
+    
+    def run_command(self, details, cancel_event: threading.Event = None, echo: bool = True):
+        """Execute system command - output is streamed into a bounded buffer (killed early once cancel_event is set)"""
         command = details.get('content', '')
         shell_type = details.get('shell', 'cmd').lower()
         encoding = details.get('encoding', 'utf-8')
@@ -2451,61 +6194,102 @@ class AITools:
         if not command:
             return {"success": False, "error": "Command not specified"}
         
+        # Raced and parallel commands run side by side, so only echo output for serial runs
+        echo = echo and cancel_event is None
+        watcher = ProcessOutput(encoding, self.output_listener if echo else None, cancel_event)
+        
         def _run(cmd_args, use_shell=False, executable=None):
-            """Helper to run subprocess with common params"""
-            return subprocess.run(
-                cmd_args, shell=use_shell, executable=executable,
-                capture_output=True, text=True, timeout=600,
-                encoding=encoding, errors='replace'
+            """Helper to run a fresh process, streaming its output into the watcher"""
+            proc = subprocess.Popen(
+                cmd_args, shell=use_shell, executable=executable, cwd=self.working_directory(),
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=(os.name != 'nt')
             )
+            chunks = queue.Queue()
+            
+            def _pump(name, stream):
+                decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+                try:
+                    for data in iter(lambda: stream.read1(65536), b''):
+                        chunks.put((name, decoder.decode(data), len(data)))
+                    chunks.put((name, decoder.decode(b'', final=True), 0))
+                except Exception:
+                    pass
+                chunks.put((name, None, 0))
+            
+            for name, stream in (('stdout', proc.stdout), ('stderr', proc.stderr)):
+                threading.Thread(target=_pump, args=(name, stream), daemon=True).start()
+            
+            open_streams = 2
+            while open_streams:
+                if watcher.check():
+                    kill_process_tree(proc)
+                    break
+                try:
+                    name, text, nbytes = chunks.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if text is None:
+                    open_streams -= 1
+                else:
+                    watcher.feed(name, text, nbytes)
+            
+            try:
+                return proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                kill_process_tree(proc)
+                return -9
         
-        def _find_path(paths):
-            """Find first existing path from list"""
-            for p in paths:
-                if os.path.exists(p):
-                    return p
-            return None
+        def _run_pooled(executable=None):
+            """Run in a persistent session when possible (None = use a fresh process)"""
+            if cancel_event is not None:
+                return None
+            session = self.shell_pool.acquire(shell_type, encoding, executable)
+            if session is None:
+                return None
+            try:
+                returncode = session.run(command, watcher, keep_state=self.shell_pool.keep_state)
+                if self.shell_pool.keep_state and session.cwd and os.path.isdir(session.cwd):
+                    self.shell_pool.cwd = session.cwd
+                return returncode
+            finally:
+                session.lock.release()
         
         try:
-            # Direct command mappings
+            # Direct command mappings (discovered absolute paths where known)
             shell_cmds = {
-                'powershell': ['powershell', '-NoProfile', '-Command', command],
-                'pwsh': ['pwsh', '-NoProfile', '-Command', command],
-                'cmd': ['cmd', '/c', command],
-                'wsl': ['wsl', 'bash', '-c', command],
+                'powershell': [self.shells.path('powershell') or 'powershell', '-NoProfile', '-Command', command],
+                'pwsh': [self.shells.path('pwsh') or 'pwsh', '-NoProfile', '-Command', command],
+                'cmd': [self.shells.path('cmd') or 'cmd', '/c', command],
+                'wsl': [self.shells.path('wsl') or 'wsl', 'bash', '-c', command],
             }
             
-            if shell_type in shell_cmds:
-                result = _run(shell_cmds[shell_type])
+            executable = None
+            if shell_type in ShellRegistry.POSIX_SHELLS or shell_type in ('git-bash', 'cygwin'):
+                executable = self.shells.path(shell_type)
+                if not executable:
+                    names = {'git-bash': "Git Bash", 'cygwin': "Cygwin"}
+                    return {"success": False, "error": f"{names.get(shell_type, shell_type)} not found"}
+            
+            pooled = shell_type not in ShellRegistry.POSIX_SHELLS or shell_type in POOLED_POSIX_SHELLS
+            returncode = _run_pooled(executable) if pooled else None
             
-            elif shell_type == 'git-bash':
-                bash = _find_path(GIT_BASH_PATHS)
-                if not bash:
-                    return {"success": False, "error": "Git Bash not found"}
-                result = _run([bash, '-c', command])
+            if returncode is not None:
+                pass  # ran in a pooled session
             
-            elif shell_type == 'cygwin':
-                bash = _find_path(CYGWIN_PATHS)
-                if not bash:
-                    return {"success": False, "error": "Cygwin not found"}
-                result = _run([bash, '-c', command])
+            elif shell_type in shell_cmds:
+                returncode = _run(shell_cmds[shell_type])
             
-            elif shell_type in ['bash', 'sh', 'zsh', 'fish', 'ksh', 'tcsh', 'dash']:
-                result = _run(command, use_shell=True, executable=f'/bin/{shell_type}')
+            elif shell_type in ('git-bash', 'cygwin'):
+                returncode = _run([executable, '-c', command])
+            
+            elif executable:
+                returncode = _run(command, use_shell=True, executable=executable)
             
             else:
-                result = _run(command, use_shell=True)
+                returncode = _run(command, use_shell=True)
             
-            return {
-                "success": result.returncode == 0,
-                "output": result.stdout[:2000] if result.stdout else "",
-                "error": result.stderr[:1000] if result.stderr else "",
-                "returncode": result.returncode,
-                "shell": shell_type
-            }
+            return watcher.result(returncode, shell_type)
             
-        except subprocess.TimeoutExpired:
-            return {"success": False, "error": "Command timed out (600s)"}
         except Exception as e:
             return {"success": False, "error": f"Command error: {e}"}
     
@@ -2519,17 +6303,18 @@ class AITools:
             info_type = details.get('type', 'system')
             
             if info_type == 'system':
-                try:
-                    import psutil
+                sample = self.system_sampler.latest()
+                if sample:
                     info = {
-                        "cpu_percent": psutil.cpu_percent(interval=1),
-                        "memory_percent": psutil.virtual_memory().percent,
-                        "memory_available_gb": round(psutil.virtual_memory().available / (1024**3), 2),
-                        "disk_percent": psutil.disk_usage('/').percent if platform.system() != 'Windows' else psutil.disk_usage('C:\\').percent,
-                        "process_count": len(psutil.pids()),
-                        "boot_time": datetime.datetime.fromtimestamp(psutil.boot_time()).strftime('%Y-%m-%d %H:%M:%S')
+                        "cpu_percent": sample["cpu_percent"],
+                        "cpu_percent_avg": self.system_sampler.cpu_average(),
+                        "memory_percent": sample["memory_percent"],
+                        "memory_available_gb": sample["memory_available_gb"],
+                        "disk_percent": sample["disk_percent"],
+                        "process_count": sample["process_count"],
+                        "boot_time": self.system_sampler.boot_time
                     }
-                except:
+                else:
                     info = {"message": "System information unavailable (psutil required)"}
                     
             elif info_type == 'files':
@@ -2545,16 +6330,17 @@ class AITools:
                     info = {"error": f"Cannot read directory: {path}"}
                     
             elif info_type == 'network':
-                try:
-                    import psutil
-                    net_io = psutil.net_io_counters()
+                sample = self.system_sampler.latest()
+                if sample and "bytes_sent" in sample:
                     info = {
-                        "bytes_sent_mb": round(net_io.bytes_sent / (1024**2), 2),
-                        "bytes_recv_mb": round(net_io.bytes_recv / (1024**2), 2),
-                        "packets_sent": net_io.packets_sent,
-                        "packets_recv": net_io.packets_recv
+                        "bytes_sent_mb": round(sample["bytes_sent"] / (1024**2), 2),
+                        "bytes_recv_mb": round(sample["bytes_recv"] / (1024**2), 2),
+                        "packets_sent": sample["packets_sent"],
+                        "packets_recv": sample["packets_recv"],
+                        "send_kbps": sample["send_kbps"],
+                        "recv_kbps": sample["recv_kbps"]
                     }
-                except:
+                else:
                     info = {"message": "Network information unavailable"}
                     
             else:
@@ -2565,30 +6351,92 @@ class AITools:
         except Exception as e:
             return {"success": False, "error": f"Information gathering error: {str(e)}"}
     
+    def perform(self, action_type, details, echo=True):
+        """Dispatch one action/task to its tool"""
+        if action_type == 'file':
+            return self.handle_file(details)
+        elif action_type == 'command':
+            return self.run_command(details, echo=echo)
+        elif action_type == 'code':
+            return self.create_code(details)
+        elif action_type == 'info':
+            return self.gather_info(details)
+        elif action_type == 'multi':
+            return self.multi_task(details)
+        return {"success": False, "error": f"Unknown action: {action_type}"}
+    
+    def _is_independent(self, action) -> Optional[str]:
+        """'read' or 'write' if the action can share a batch with others, None if it must run alone.
+        
+        "parallel": false forces the action to run alone; "parallel": true is only a hint and never
+        makes a command 'read' unless is_read_only_command accepts it.
+        """
+        action_type = action.get('type')
+        details = action.get('details', action) if isinstance(action.get('details', action), dict) else {}
+        if action.get('parallel') is False or action_type == 'multi':
+            return None
+        if action_type in ('file', 'code'):
+            return 'write' if details.get('path') else None
+        if action_type == 'command' and self.shell_pool.keep_state:
+            return None  # commands share one shell's cwd/env
+        if action_type == 'info':
+            return 'read'
+        if action_type == 'command' and self.is_read_only_command(details.get('content', '')):
+            return 'read'
+        return None
+    
+    def plan_batches(self, actions, start=0) -> List[int]:
+        """Indices of the consecutive actions from start that can run concurrently (at least [start]).
+        
+        A batch holds either readers (info, read-only commands) or writers to distinct paths,
+        never both, so no action can observe another one from the same batch.
+        """
+        batch = [start]
+        kind = self._is_independent(actions[start])
+        if kind is None or self.max_concurrency <= 1:
+            return batch
+        paths = set()
+        if kind == 'write':
+            paths.add(os.path.abspath(str(actions[start].get('details', actions[start]).get('path'))))
+        for index in range(start + 1, len(actions)):
+            action = actions[index]
+            if self._is_independent(action) != kind:
+                break
+            if kind == 'write':
+                path = os.path.abspath(str(action.get('details', action).get('path')))
+                if path in paths:
+                    break
+                paths.add(path)
+            batch.append(index)
+        return batch
+    
     def multi_task(self, details):
-        """Multi-tasking"""
+        """Multi-tasking (independent tasks run concurrently, results keep task order)"""
         tasks = details.get('tasks', [])
-        results = []
+        results = [None] * len(tasks)
         
         if not tasks:
             return {"success": False, "error": "Task list is empty"}
         
-        for task in tasks:
+        def _run_task(task, echo=True):
             task_type = task.get('type')
-            task_details = task.get('details', task)
-            
-            if task_type == 'file':
-                result = self.handle_file(task_details)
-            elif task_type == 'command':
-                result = self.run_command(task_details)
-            elif task_type == 'code':
-                result = self.create_code(task_details)
-            elif task_type == 'info':
-                result = self.gather_info(task_details)
+            if task_type not in ('file', 'command', 'code', 'info'):
+                return {"success": False, "error": f"Unknown task type: {task_type}"}
+            try:
+                return self.perform(task_type, task.get('details', task), echo=echo)
+            except Exception as e:
+                return {"success": False, "error": str(e)}
+        
+        index = 0
+        while index < len(tasks):
+            batch = self.plan_batches(tasks, index)
+            if len(batch) == 1:
+                results[index] = _run_task(tasks[index])
             else:
-                result = {"success": False, "error": f"Unknown task type: {task_type}"}
-                
-            results.append(result)
+                with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batch))) as pool:
+                    for i, result in zip(batch, pool.map(lambda i: _run_task(tasks[i], echo=False), batch)):
+                        results[i] = result
+            index = batch[-1] + 1
         
         success_count = sum(1 for r in results if r.get('success'))
         return {
@@ -2603,8 +6451,10 @@ class ZAIShell:
     """Main shell interface v7.0"""
     
     def __init__(self):
-        self.memory = ChromaMemoryManager()
-        self.brain = AIBrain(self.memory)
+        with STARTUP_PROFILER.phase("memory init"):
+            self.memory = create_memory_manager()
+        with STARTUP_PROFILER.phase("AI brain init"):
+            self.brain = AIBrain(self.memory)
         self.start_time = datetime.datetime.now()
         self.request_count = 0
     
@@ -2622,6 +6472,8 @@ class ZAIShell:
         stats = self.memory.memory["stats"]
         
         memory_type = "ChromaDB" if hasattr(self.memory, 'use_chromadb') and self.memory.use_chromadb else "JSON"
+        if isinstance(self.memory, VectorMemoryManager):
+            memory_type = "Vector"
         
         gui_status = "ON" if self.brain.gui_enabled else "OFF"
         research_status = "ON" if self.brain.research_enabled else "OFF"
@@ -2654,8 +6506,18 @@ class ZAIShell:
   {Fore.CYAN}Modes:{Style.RESET_ALL} normal, eco, lightning
   {Fore.CYAN}Network:{Style.RESET_ALL} switch offline, switch online
   {Fore.CYAN}Thinking:{Style.RESET_ALL} thinking on/off
+  {Fore.CYAN}Streaming:{Style.RESET_ALL} stream on/off
+  {Fore.CYAN}Racing:{Style.RESET_ALL} race on/off
+  {Fore.CYAN}Shell pool:{Style.RESET_ALL} pool on/off, pool keep on/off
+  {Fore.CYAN}Live output:{Style.RESET_ALL} live on/off
+  {Fore.CYAN}Parallel:{Style.RESET_ALL} parallel [N], parallel off
   {Fore.CYAN}Sharing:{Style.RESET_ALL} share, share connect IP:PORT, share end
-  {Fore.CYAN}Memory:{Style.RESET_ALL} memory clear/show/search [query]
+  {Fore.CYAN}Memory:{Style.RESET_ALL} memory clear/show/search [query], memory migrate, memory embedder minilm|hashing
+  {Fore.CYAN}Cache:{Style.RESET_ALL} cache, cache clear, cache clear fixes, cache prompt
+  {Fore.CYAN}Context:{Style.RESET_ALL} context
+  {Fore.CYAN}Usage:{Style.RESET_ALL} stats, stats clear
+  {Fore.CYAN}Rate limit:{Style.RESET_ALL} ratelimit [on|off], ratelimit rpm|tpm N
+  {Fore.CYAN}Intent:{Style.RESET_ALL} intent, intent threshold [0-1]
   {Fore.CYAN}Safety:{Style.RESET_ALL} --safe, --show, --force
   {Fore.CYAN}Other:{Style.RESET_ALL} clear, exit
 
@@ -2750,6 +6612,46 @@ class ZAIShell:
 """)
         return True
     
+    def handle_research_request(self, parsed_input, intents, force, safe_mode, show_only):
+        """Search the web and answer from the results"""
+        if not (self.brain.web_research and self.brain.web_research.is_available()):
+            print(f"{Fore.YELLOW}Web research not available. Install with 'research on'{Style.RESET_ALL}")
+            self.brain.think_and_act(parsed_input, force_execute=force, safe_mode=safe_mode, show_only=show_only)
+            return
+        
+        print(f"\n{Fore.CYAN}Searching web...{Style.RESET_ALL}")
+        original_query = intents['research_query']
+        optimized_query = self.brain.web_research.optimize_query(original_query)
+        if optimized_query != original_query:
+            print(f"{Fore.YELLOW}Optimized search: {optimized_query}{Style.RESET_ALL}")
+        results = self.brain.web_research.search(optimized_query)
+        if results:
+            self.brain.web_research.print_results_to_user(results, original_query)
+            print(f"{Fore.GREEN}Analyzing {len(results)} results...{Style.RESET_ALL}\n")
+            formatted = self.brain.web_research.format_results_for_ai(results, original_query)
+            self.brain.think_and_act(formatted, force_execute=force, safe_mode=safe_mode, show_only=show_only)
+        else:
+            print(f"{Fore.YELLOW}No results found, answering from knowledge...{Style.RESET_ALL}")
+            self.brain.think_and_act(parsed_input, force_execute=force, safe_mode=safe_mode, show_only=show_only)
+    
+    def handle_gui_request(self, parsed_input, force, safe_mode, show_only):
+        """Generate and run a hybrid Terminal + GUI plan"""
+        print(f"\n{Fore.CYAN}Generating hybrid plan (Terminal + GUI)...{Style.RESET_ALL}")
+        plan = self.brain.generate_hybrid_plan(parsed_input)
+        if plan and plan.get('needs_gui'):
+            print(f"{Fore.GREEN}Plan generated with {len(plan.get('steps', []))} steps{Style.RESET_ALL}")
+            if not show_only:
+                if force or input(f"{Fore.YELLOW}Execute hybrid plan? (Y/N): {Style.RESET_ALL}").upper() == 'Y':
+                    self.brain.execute_hybrid_plan(plan, safe_mode=safe_mode)
+                else:
+                    print(f"{Fore.YELLOW}Plan cancelled{Style.RESET_ALL}")
+            else:
+                print(f"\n{Fore.CYAN}Hybrid Plan Preview:{Style.RESET_ALL}")
+                for step in plan.get('steps', []):
+                    print(f"  [{step.get('step')}] {step.get('type').upper()}: {step.get('description', step.get('action'))}")
+        else:
+            self.brain.think_and_act(parsed_input, force_execute=force, safe_mode=safe_mode, show_only=show_only)
+    
     def parse_command(self, user_input):
         """Parse command for special flags and mode overrides"""
         force = False
@@ -2888,12 +6790,103 @@ class ZAIShell:
                             print(f"\n{Fore.CYAN}Thinking mode is currently: {status}{Style.RESET_ALL}")
                         continue
                     
+                    # Handle streaming toggle
+                    if user_input.lower().startswith('stream'):
+                        if 'on' in user_input.lower():
+                            self.brain.streaming_enabled = True
+                            self.memory.set_setting("streaming_enabled", True)
+                            print(f"\n{Fore.GREEN}✓ Streaming output ENABLED{Style.RESET_ALL}")
+                        elif 'off' in user_input.lower():
+                            self.brain.streaming_enabled = False
+                            self.memory.set_setting("streaming_enabled", False)
+                            print(f"\n{Fore.YELLOW}✓ Streaming output DISABLED{Style.RESET_ALL}")
+                        else:
+                            status = "ON" if self.brain.streaming_enabled else "OFF"
+                            print(f"\n{Fore.CYAN}Streaming output: {status}{Style.RESET_ALL}")
+                        continue
+                    
+                    # Handle strategy racing toggle
+                    if user_input.lower() in ('race', 'race on', 'race off'):
+                        if user_input.lower() == 'race on':
+                            self.brain.racing_enabled = True
+                            self.memory.set_setting("racing_enabled", True)
+                            print(f"\n{Fore.GREEN}✓ Strategy racing ENABLED (read-only alternatives run in parallel){Style.RESET_ALL}")
+                        elif user_input.lower() == 'race off':
+                            self.brain.racing_enabled = False
+                            self.memory.set_setting("racing_enabled", False)
+                            print(f"\n{Fore.YELLOW}✓ Strategy racing DISABLED{Style.RESET_ALL}")
+                        else:
+                            status = "ON" if self.brain.racing_enabled else "OFF"
+                            print(f"\n{Fore.CYAN}Strategy racing: {status} (max {RACE_CONCURRENCY} concurrent){Style.RESET_ALL}")
+                        continue
+                    
+                    # Handle live command output toggle
+                    if user_input.lower() in ('live', 'live on', 'live off'):
+                        if user_input.lower() == 'live on':
+                            self.brain.live_output = True
+                            self.memory.set_setting("live_output", True)
+                            print(f"\n{Fore.GREEN}✓ Live command output ENABLED{Style.RESET_ALL}")
+                        elif user_input.lower() == 'live off':
+                            self.brain.live_output = False
+                            self.memory.set_setting("live_output", False)
+                            print(f"\n{Fore.YELLOW}✓ Live command output DISABLED{Style.RESET_ALL}")
+                        else:
+                            status = "ON" if self.brain.live_output else "OFF"
+                            print(f"\n{Fore.CYAN}Live command output: {status}{Style.RESET_ALL}")
+                        continue
+                    
+                    # Handle parallel action limit
+                    if user_input.lower() == 'parallel' or re.fullmatch(r'parallel (off|\d+)', user_input.lower()):
+                        value = user_input.lower().split()[-1]
+                        if value == 'off':
+                            self.brain.tools.max_concurrency = 1
+                            self.memory.set_setting("action_concurrency", 1)
+                            print(f"\n{Fore.YELLOW}✓ Actions run one at a time{Style.RESET_ALL}")
+                        elif value.isdigit():
+                            limit = max(1, min(int(value), 16))
+                            self.brain.tools.max_concurrency = limit
+                            self.memory.set_setting("action_concurrency", limit)
+                            print(f"\n{Fore.GREEN}✓ Up to {limit} independent actions run in parallel{Style.RESET_ALL}")
+                        else:
+                            limit = self.brain.tools.max_concurrency
+                            status = f"up to {limit}" if limit > 1 else "OFF"
+                            print(f"\n{Fore.CYAN}Parallel actions: {status}{Style.RESET_ALL}")
+                        continue
+                    
+                    # Handle shell session pool
+                    if user_input.lower() in ('pool', 'pool on', 'pool off', 'pool keep on', 'pool keep off'):
+                        pool = self.brain.tools.shell_pool
+                        command = user_input.lower()
+                        if command == 'pool on':
+                            pool.enabled = True
+                            self.memory.set_setting("shell_pool_enabled", True)
+                            print(f"\n{Fore.GREEN}✓ Shell session pool ENABLED{Style.RESET_ALL}")
+                        elif command == 'pool off':
+                            pool.enabled = False
+                            pool.close_all()
+                            self.memory.set_setting("shell_pool_enabled", False)
+                            print(f"\n{Fore.YELLOW}✓ Shell session pool DISABLED (fresh process per command){Style.RESET_ALL}")
+                        elif command == 'pool keep on':
+                            pool.keep_state = True
+                            self.memory.set_setting("shell_keep_state", True)
+                            print(f"\n{Fore.GREEN}✓ cwd/env now persist across actions within a request{Style.RESET_ALL}")
+                        elif command == 'pool keep off':
+                            pool.keep_state = False
+                            self.memory.set_setting("shell_keep_state", False)
+                            print(f"\n{Fore.YELLOW}✓ Each action starts from a clean cwd/env{Style.RESET_ALL}")
+                        else:
+                            stats = pool.get_stats()
+                            status = "ON" if pool.enabled else "OFF"
+                            keep = "ON" if pool.keep_state else "OFF"
+                            print(f"\n{Fore.CYAN}Shell pool: {status} | Keep state: {keep}{Style.RESET_ALL}")
+                            print(f"Live sessions: {stats['sessions']} | Started: {stats['started']} | Reused: {stats['reused']}")
+                        continue
+                    
                     # Handle memory commands
                     if user_input.lower().startswith('memory'):
                         if 'clear' in user_input.lower():
-                            self.memory.memory["conversation_history"] = []
-                            self.memory.save_memory()
-                            print(f"\n{Fore.GREEN}✓ Conversation history cleared{Style.RESET_ALL}")
+                            self.memory.clear_history()
+                            print(f"\n{Fore.GREEN}✓ Conversation history cleared (including session summaries and the archive){Style.RESET_ALL}")
                         elif 'show' in user_input.lower():
                             history = self.memory.get_recent_history(10)
                             print(f"\n{Fore.CYAN}Recent conversation history:{Style.RESET_ALL}")
@@ -2904,20 +6897,148 @@ class ZAIShell:
                             query = user_input.replace('memory search', '').strip()
                             if query and hasattr(self.memory, 'search_memory'):
                                 results = self.memory.search_memory(query)
+                                archived = [] if results else self.memory.tiers.search_archive(query)
                                 if results:
                                     print(f"\n{Fore.CYAN}Search results for '{query}':{Style.RESET_ALL}")
                                     for doc, meta in zip(results['documents'][0], results['metadatas'][0]):
                                         print(f"\n{Fore.YELLOW}{meta['role']}: {doc[:150]}...{Style.RESET_ALL}")
+                                elif archived:
+                                    print(f"\n{Fore.CYAN}Archived results for '{query}':{Style.RESET_ALL}")
+                                    for entry in archived:
+                                        print(f"\n{Fore.YELLOW}{entry['role']} ({entry['timestamp'][:10]}): {entry['message'][:150]}...{Style.RESET_ALL}")
                                 else:
                                     print(f"\n{Fore.YELLOW}No results found{Style.RESET_ALL}")
                             else:
                                 print(f"\n{Fore.YELLOW}Usage: memory search <query>{Style.RESET_ALL}")
+                        elif 'migrate' in user_input.lower():
+                            store = self.memory.json_manager
+                            if isinstance(store, SQLiteMemoryManager):
+                                print(f"\n{Fore.YELLOW}Memory already uses SQLite ({MEMORY_DB_FILE}){Style.RESET_ALL}")
+                            else:
+                                store.flush()
+                                counts = SQLiteMemoryManager().migrate_from_json(store)
+                                print(f"\n{Fore.GREEN}✓ Migrated {counts['conversations']} conversations and {counts['settings']} settings to {MEMORY_DB_FILE}{Style.RESET_ALL}")
+                                print(f"{Fore.YELLOW}SQLite memory is used from the next start ({MEMORY_FILE} is kept as a backup){Style.RESET_ALL}")
+                        elif 'embedder' in user_input.lower():
+                            parts = user_input.lower().split()
+                            if len(parts) == 3 and parts[2] in EMBEDDERS:
+                                self.memory.set_setting("embedder", parts[2])
+                                print(f"\n{Fore.GREEN}✓ Embedder set to {parts[2]} (used from the next start){Style.RESET_ALL}")
+                            else:
+                                print(f"\n{Fore.YELLOW}Usage: memory embedder {'|'.join(EMBEDDERS)}{Style.RESET_ALL}")
                         else:
                             stats = self.memory.memory["stats"]
-                            print(f"\n{Fore.CYAN}Memory Stats:{Style.RESET_ALL}")
+                            backend = "SQLite" if isinstance(self.memory.json_manager, SQLiteMemoryManager) else "JSON"
+                            print(f"\n{Fore.CYAN}Memory Stats ({backend}):{Style.RESET_ALL}")
                             print(f"Total requests: {stats['total_requests']}")
                             print(f"Successful actions: {stats['successful_actions']}")
                             print(f"Failed actions: {stats['failed_actions']}")
+                            if getattr(self.memory, 'use_chromadb', False):
+                                print(f"ChromaDB: {self.memory.ingested} indexed | backlog {self.memory.ingest_backlog()} | dropped {self.memory.ingest_dropped} | errors {self.memory.ingest_errors}")
+                            tiers = self.memory.tiers.get_stats()
+                            print(f"Tiers: hot {tiers['hot']}/{tiers['hot_capacity']} turns | warm {tiers['warm']} summaries | cold {tiers['cold_kb']} KB ({tiers['archived']} archived this session)")
+                            if isinstance(self.memory, VectorMemoryManager):
+                                vec = self.memory.get_stats()
+                                print(f"Vectors: {vec['entries']} x {vec['dim']} | IVF lists {vec['ivf_lists']} | last search {vec['last_search_ms']} ms")
+                            if self.memory.embedding_function:
+                                emb = self.memory.embedding_function.get_stats()
+                                print(f"Embeddings ({emb['embedder']}): {emb['cached']} cached | hits {emb['hits']} | misses {emb['misses']} | hit rate {emb['hit_rate']}%")
+                        continue
+                    
+                    # Handle local intent classifier commands
+                    if user_input.lower().startswith('intent'):
+                        parts = user_input.split()
+                        classifier = self.brain.intent_classifier
+                        if len(parts) == 3 and parts[1].lower() == 'threshold':
+                            try:
+                                classifier.threshold = min(max(float(parts[2]), 0.0), 1.0)
+                                self.memory.set_setting("intent_threshold", classifier.threshold)
+                                print(f"\n{Fore.GREEN}✓ Intent confidence threshold set to {classifier.threshold}{Style.RESET_ALL}")
+                            except ValueError:
+                                print(f"\n{Fore.YELLOW}Usage: intent threshold <0.0-1.0>{Style.RESET_ALL}")
+                        else:
+                            stats = classifier.get_stats()
+                            print(f"\n{Fore.CYAN}Local Intent Classifier:{Style.RESET_ALL}")
+                            print(f"Confidence threshold: {stats['threshold']}")
+                            print(f"Training examples: {stats['examples']} ({'trained' if stats['trained'] else 'rules only'})")
+                            print(f"Settled by rules: {stats['rule_decisions']} | by classifier: {stats['classifier_decisions']} | left to LLM: {stats['llm_fallbacks']}")
+                            print(f"LLM intent calls saved: {stats['llm_calls_saved']}")
+                        continue
+                    
+                    # Show prompt context token use
+                    if user_input.lower() == 'context':
+                        report = self.brain.context_assembler.last_report
+                        if not report:
+                            print(f"\n{Fore.YELLOW}No prompt built yet{Style.RESET_ALL}")
+                        else:
+                            print(f"\n{Fore.CYAN}Last prompt context ({self.brain.current_mode} budget {report['budget']} tokens):{Style.RESET_ALL}")
+                            print(f"Summaries: {report['summaries']} tokens ({report['summary_entries']} entries)")
+                            print(f"Recent: {report['recent']} tokens ({report['recent_entries']} entries)")
+                            print(f"Related: {report['related']} tokens ({report['related_entries']} entries)")
+                            print(f"Total: {report['total']} tokens")
+                        continue
+                    
+                    # Show model call latency and token spend from the ledger
+                    if user_input.lower() in ('stats', 'stats clear'):
+                        if user_input.lower() == 'stats clear':
+                            LLM_LEDGER.clear()
+                            print(f"\n{Fore.GREEN}✓ Call ledger cleared{Style.RESET_ALL}")
+                            continue
+                        for field, title in (('site', 'By call site'), ('mode', 'By mode')):
+                            summary = LLM_LEDGER.summary(field)
+                            if not summary:
+                                print(f"\n{Fore.YELLOW}No model calls recorded yet{Style.RESET_ALL}")
+                                break
+                            print(f"\n{Fore.CYAN}{title}:{Style.RESET_ALL}")
+                            for name, s in summary.items():
+                                errors = f" | errors {s['errors']}" if s['errors'] else ""
+                                print(f"  {name}: {s['calls']} calls | p50 {s['p50_ms']:.0f}ms p95 {s['p95_ms']:.0f}ms | "
+                                      f"tokens in {s['prompt_tokens']} out {s['output_tokens']} (avg {s['avg_tokens']}){errors}")
+                        continue
+                    
+                    # Client-side rate limiter
+                    if user_input.lower().startswith('ratelimit'):
+                        parts = user_input.lower().split()
+                        limiter = RATE_LIMITER
+                        if len(parts) == 2 and parts[1] in ('on', 'off'):
+                            limiter.enabled = parts[1] == 'on'
+                            self.memory.set_setting("rate_limit_enabled", limiter.enabled)
+                        elif len(parts) == 3 and parts[1] in ('rpm', 'tpm') and parts[2].isdigit() and int(parts[2]) > 0:
+                            self.memory.set_setting(f"rate_limit_{parts[1]}", int(parts[2]))
+                            limiter.configure(self.memory.get_setting("rate_limit_rpm", RATE_LIMIT_RPM),
+                                              self.memory.get_setting("rate_limit_tpm", RATE_LIMIT_TPM))
+                        elif len(parts) > 1:
+                            print(f"\n{Fore.YELLOW}Usage: ratelimit [on|off] | ratelimit rpm|tpm <N>{Style.RESET_ALL}")
+                            continue
+                        stats = limiter.get_stats()
+                        print(f"\n{Fore.CYAN}Rate Limiter: {'ON' if stats['enabled'] else 'OFF'}{Style.RESET_ALL}")
+                        print(f"Limits: {stats['rpm']} RPM | {stats['tpm']} TPM (left now: {stats['requests_left']} requests, {stats['tokens_left']} tokens)")
+                        print(f"Calls: {stats['granted']} | queued: {stats['queued']} ({stats['wait_seconds']:.1f}s) | skipped: {stats['skipped']} | quota errors: {stats['quota_errors']}")
+                        if stats['blocked_for']:
+                            print(f"Backing off for {stats['blocked_for']:.1f}s")
+                        continue
+                    
+                    # Handle response cache commands
+                    if user_input.lower().startswith('cache'):
+                        if 'fixes' in user_input.lower():
+                            self.brain.fix_store.clear()
+                            print(f"\n{Fore.GREEN}✓ Fix store cleared{Style.RESET_ALL}")
+                        elif 'prompt' in user_input.lower():
+                            stats = self.brain.prompt_prefixes.get_stats()
+                            print(f"\n{Fore.CYAN}Prompt Prefixes:{Style.RESET_ALL}")
+                            print(f"Built: {stats['builds']} | Reused: {stats['reuses']} ({stats['prefixes']} combinations)")
+                        elif 'clear' in user_input.lower():
+                            self.brain.response_cache.clear()
+                            print(f"\n{Fore.GREEN}✓ Response cache cleared{Style.RESET_ALL}")
+                        else:
+                            stats = self.brain.response_cache.get_stats()
+                            print(f"\n{Fore.CYAN}Response Cache:{Style.RESET_ALL}")
+                            print(f"Entries: {stats['entries']} ({stats['size_kb']} KB)")
+                            print(f"Hits: {stats['hits']} | Misses: {stats['misses']} | Hit rate: {stats['hit_rate']}%")
+                            fix_stats = self.brain.fix_store.get_stats()
+                            print(f"\n{Fore.CYAN}Fix Store:{Style.RESET_ALL}")
+                            print(f"Stored fixes: {fix_stats['fixes']} | Hit rate: {fix_stats['hit_rate']}% ({fix_stats['hits']}/{fix_stats['lookups']})")
+                            print(f"Applied: {fix_stats['uses']} | Success rate: {fix_stats['success_rate']}%")
                         continue
                     
                     parsed_input, force, safe_mode, show_only, temp_mode = self.parse_command(user_input)
@@ -2944,6 +7065,8 @@ class ZAIShell:
                     
                     self.request_count += 1
                     start = time.time()
+                    self.brain.first_output_at = None
+                    self.brain.tools.shell_pool.begin_request()
                     
                     intents = self.brain.detect_intent(parsed_input)
                     
@@ -2957,60 +7080,33 @@ class ZAIShell:
                         else:
                             print(f"\n{Fore.RED}Image analysis failed: {analysis.get('error')}{Style.RESET_ALL}")
                     
-                    elif intents['needs_research'] and not self.brain.offline_mode:
-                        if not self.brain.research_enabled:
-                            print(f"\n{Fore.YELLOW}Web research is disabled. Enable with 'research on'{Style.RESET_ALL}")
-                            self.brain.think_and_act(parsed_input, force_execute=force, safe_mode=safe_mode, show_only=show_only)
-                        elif self.brain.web_research and self.brain.web_research.is_available():
-                            print(f"\n{Fore.CYAN}Searching web...{Style.RESET_ALL}")
-                            original_query = intents['research_query']
-                            optimized_query = self.brain.web_research.optimize_query(original_query)
-                            if optimized_query != original_query:
-                                print(f"{Fore.YELLOW}Optimized search: {optimized_query}{Style.RESET_ALL}")
-                            results = self.brain.web_research.search(optimized_query)
-                            if results:
-                                self.brain.web_research.print_results_to_user(results, original_query)
-                                print(f"{Fore.GREEN}Analyzing {len(results)} results...{Style.RESET_ALL}\n")
-                                formatted = self.brain.web_research.format_results_for_ai(results, original_query)
-                                enhanced_input = f"{formatted}"
-                                self.brain.think_and_act(enhanced_input, force_execute=force, safe_mode=safe_mode, show_only=show_only)
-                            else:
-                                print(f"{Fore.YELLOW}No results found, answering from knowledge...{Style.RESET_ALL}")
-                                self.brain.think_and_act(parsed_input, force_execute=force, safe_mode=safe_mode, show_only=show_only)
-                        else:
-                            print(f"{Fore.YELLOW}Web research not available. Install with 'research on'{Style.RESET_ALL}")
-                            self.brain.think_and_act(parsed_input, force_execute=force, safe_mode=safe_mode, show_only=show_only)
+                    elif intents['needs_research']:
+                        self.handle_research_request(parsed_input, intents, force, safe_mode, show_only)
                     
-                    elif intents['needs_gui'] and not self.brain.offline_mode:
-                        if not self.brain.gui_enabled:
-                            print(f"\n{Fore.YELLOW}GUI automation is disabled. Enable with 'gui on'{Style.RESET_ALL}")
-                            self.brain.think_and_act(parsed_input, force_execute=force, safe_mode=safe_mode, show_only=show_only)
-                        else:
-                            print(f"\n{Fore.CYAN}Generating hybrid plan (Terminal + GUI)...{Style.RESET_ALL}")
-                            plan = self.brain.generate_hybrid_plan(parsed_input)
-                            if plan and plan.get('needs_gui'):
-                                print(f"{Fore.GREEN}Plan generated with {len(plan.get('steps', []))} steps{Style.RESET_ALL}")
-                                if not show_only:
-                                    if force or input(f"{Fore.YELLOW}Execute hybrid plan? (Y/N): {Style.RESET_ALL}").upper() == 'Y':
-                                        self.brain.execute_hybrid_plan(plan, safe_mode=safe_mode)
-                                    else:
-                                        print(f"{Fore.YELLOW}Plan cancelled{Style.RESET_ALL}")
-                                else:
-                                    print(f"\n{Fore.CYAN}Hybrid Plan Preview:{Style.RESET_ALL}")
-                                    for step in plan.get('steps', []):
-                                        print(f"  [{step.get('step')}] {step.get('type').upper()}: {step.get('description', step.get('action'))}")
-                            else:
-                                self.brain.think_and_act(parsed_input, force_execute=force, safe_mode=safe_mode, show_only=show_only)
+                    elif intents['needs_gui']:
+                        self.handle_gui_request(parsed_input, force, safe_mode, show_only)
                     
                     else:
                         print(f"\n{Fore.YELLOW}Processing...{Style.RESET_ALL}")
-                        self.brain.think_and_act(parsed_input, force_execute=force, safe_mode=safe_mode, show_only=show_only)
+                        result = self.brain.think_and_act(parsed_input, force_execute=force, safe_mode=safe_mode, show_only=show_only, detect_intents=not intents['resolved_locally'])
+                        
+                        # Only research/GUI need a second call, with their own prompt
+                        if result and result.get('deferred'):
+                            intents = result['intents']
+                            if intents['needs_research']:
+                                self.handle_research_request(parsed_input, intents, force, safe_mode, show_only)
+                            elif intents['needs_gui']:
+                                self.handle_gui_request(parsed_input, force, safe_mode, show_only)
                     
                     if self.brain.p2p_sharing.is_connected:
                         self.brain.p2p_sharing.add_terminal_log(f"Request: {parsed_input[:100]}")
                     
                     duration = time.time() - start
-                    print(f"\n{Fore.WHITE}{duration:.2f}s{Style.RESET_ALL}")
+                    if self.brain.first_output_at is not None:
+                        first_output = self.brain.first_output_at - start
+                        print(f"\n{Fore.WHITE}{duration:.2f}s (first output {first_output:.2f}s){Style.RESET_ALL}")
+                    else:
+                        print(f"\n{Fore.WHITE}{duration:.2f}s{Style.RESET_ALL}")
                     
                 except KeyboardInterrupt:
                     print(f"\n{Fore.YELLOW}Type 'exit' to quit{Style.RESET_ALL}")
@@ -3023,8 +7119,17 @@ class ZAIShell:
 
 def main():
     """Start the program"""
+    STARTUP_PROFILER.record("module import", time.perf_counter() - STARTUP_PROFILER.started)
     try:
         zai = ZAIShell()
+        if '--profile-startup' in sys.argv[1:]:
+            with STARTUP_PROFILER.phase("banner"):
+                zai.show_banner()
+            if zai.brain.model is not None:
+                with STARTUP_PROFILER.phase("first model use (deferred)"):
+                    getattr(zai.brain.model, 'model_name', None)
+            STARTUP_PROFILER.report()
+            return
         zai.run()
     except KeyboardInterrupt:
         print(f"\n{Fore.YELLOW}Closing program...{Style.RESET_ALL}")